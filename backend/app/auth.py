@@ -1,22 +1,55 @@
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
+from sqlalchemy import event
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from common.cache import TTLCache
+from ml.metrics import stage
 from . import database, models, schemas
 from .config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as the routes see it, with the admin check done once."""
+    id: int
+    email: str
+    is_admin: bool  # DB flag or ADMIN_EMAIL
+
+    @classmethod
+    def from_user(cls, user: models.User):
+        return cls(id=user.id, email=user.email, is_admin=bool(user.is_admin) or user.email == settings.ADMIN_EMAIL)
+
+# Verified token -> (Principal, token expiry). Only successful lookups are cached,
+# and every change to a User row clears it; other processes catch up within the TTL.
+principal_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_principals(mapper, connection, target):
+    principal_cache.clear()
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def authenticate_user(db: Session, email: str, password: str) -> Optional[models.User]:
+    """The user if `password` matches. bcrypt is slow on purpose, so async routes run this in a thread."""
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user or not verify_password(password, user.hashed_password):
+        return None
+    return user
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
@@ -24,26 +57,54 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def _cached_principal(token: str) -> Optional[Principal]:
+    entry = principal_cache.get(token)
+    if entry is None or entry[1] <= time.time():
+        return None
+    return entry[0]
+
+def _load_principal(token: str) -> Optional[Principal]:
+    """Verifies `token` and looks its user up in the DB, caching the result. None if invalid."""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    email = payload.get("sub")
+    if email is None:
+        return None
+    db = database.ReadSessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == email).first()
+    finally:
+        db.close()
+    if user is None:
+        return None
+    principal = Principal.from_user(user)
+    principal_cache.put(token, (principal, payload.get("exp", float("inf"))))
+    return principal
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
+    with stage("api.auth"):
+        principal = _cached_principal(token)
+        if principal is None:
+            # Keep the DB lookup off the event loop
+            principal = await run_in_threadpool(_load_principal, token)
+    if principal is None:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
+    return principal
 
-async def get_current_admin(current_user: models.User = Depends(get_current_user)):
-    # Check explicitly for Admin Email OR DB flag
-    if not current_user.is_admin and current_user.email != settings.ADMIN_EMAIL:
+async def get_current_admin(current_user: Principal = Depends(get_current_user)):
+    if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
     return current_user
+
+def is_admin_token(token: str) -> bool:
+    """True if `token` is a valid access token of an admin (used outside route dependencies).
+    May query the DB; call it from a thread, not the event loop."""
+    principal = _cached_principal(token) or _load_principal(token)
+    return principal is not None and principal.is_admin
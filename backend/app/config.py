@@ -6,8 +6,26 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440
     DATABASE_URL: str = "sqlite:///./data/backend.db"
+    DATABASE_READ_URL: str = "" # read replica for read-only sessions, defaults to DATABASE_URL
+    DB_POOL_SIZE: int = 5 # connections kept open per engine and app worker
+    DB_MAX_OVERFLOW: int = 10 # extra connections allowed under bursts
+    DB_POOL_TIMEOUT: float = 30.0 # seconds to wait for a free connection
+    DB_BUSY_TIMEOUT: int = 5000 # ms a SQLite writer waits for the lock
     ADMIN_EMAIL: str = "admin@email.com"
     MODEL_TYPE: str = "ensemble"
+    ML_WORKERS: int = 2 # inference/simulation processes per app worker, 0 = run in-process
+    ML_TASK_TIMEOUT: int = 120 # seconds
+    MODEL_CHECK_INTERVAL: float = 2.0 # seconds between checks for a model/snapshot changed by another app worker
+    WEB_CONCURRENCY: int = 1 # app worker processes; gunicorn reads it as its --workers default
+    RATE_LIMIT_BACKEND: str = "auto" # memory (per process), sqlite (shared by the workers on a host) or auto: sqlite if WEB_CONCURRENCY > 1
+    RATE_LIMIT_STORE: str = "./data/rate_limits.sqlite" # counter file for the sqlite backend
+    RATE_LIMIT_FLUSH_INTERVAL: float = 5.0 # seconds between write-behind flushes
+    PREDICTION_LOG_QUEUE_SIZE: int = 10000 # queued prediction rows before requests wait
+    PREDICTION_LOG_BATCH_SIZE: int = 500 # rows per insert transaction
+    PREDICTION_LOG_FLUSH_INTERVAL: float = 1.0 # seconds
+    AUTH_CACHE_TTL: int = 60 # seconds a verified token -> user lookup is reused
+    AUTH_CACHE_SIZE: int = 10000
+    HISTORY_SOURCE: str = "csv" # csv (fetch_data) or db (the matches table, filled by refresh/ingest)
     
     class Config:
         env_file = ".env"
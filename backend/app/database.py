@@ -1,17 +1,116 @@
-from sqlalchemy import create_engine
+"""Engines and sessions.
+
+Writes go through `engine` / `SessionLocal` / `get_db`; read-only work uses
+`read_engine` / `ReadSessionLocal` / `get_read_db`, which has its own pool (and,
+with DATABASE_READ_URL, can point at a replica). On SQLite every connection runs
+in WAL mode with synchronous=NORMAL and a busy timeout, so the app workers'
+readers never block the writer and concurrent writers wait for the lock instead
+of failing with "database is locked". Read connections are opened query_only.
+"""
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
-engine = create_engine(
-    settings.DATABASE_URL, connect_args={"check_same_thread": False}
-)
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def create_db_engine(database_url, read_only=False):
+    """Engine with the pool and (for SQLite) connection settings from config."""
+    url = make_url(database_url)
+    kwargs = {}
+    if url.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False, "timeout": settings.DB_BUSY_TIMEOUT / 1000}
+    if not _is_memory_sqlite(url):
+        kwargs.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_pre_ping=url.get_backend_name() != "sqlite",
+        )
+    db_engine = create_engine(url, **kwargs)
+
+    if url.get_backend_name() == "sqlite":
+        @event.listens_for(db_engine, "connect")
+        def _configure_sqlite(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            if not _is_memory_sqlite(url):
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(settings.DB_BUSY_TIMEOUT)}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+            cursor.close()
+    return db_engine
+
+
+engine = create_db_engine(settings.DATABASE_URL)
+if settings.DATABASE_READ_URL or not _is_memory_sqlite(make_url(settings.DATABASE_URL)):
+    read_engine = create_db_engine(settings.DATABASE_READ_URL or settings.DATABASE_URL, read_only=True)
+else:
+    read_engine = engine  # a second in-memory engine would be a different database
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
+
+def init_db(bind=None):
+    """Creates missing tables and adds missing columns. Safe to run from several workers at once."""
+    bind = bind or engine
+    try:
+        Base.metadata.create_all(bind=bind)
+    except OperationalError:
+        # Another worker created a table between our check and CREATE; the retry sees it
+        Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+
+
+def _missing_columns(bind):
+    inspector = inspect(bind)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if inspector.has_table(table.name):
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            missing += [column for column in table.columns if column.name not in existing]
+    return missing
+
+
+def add_missing_columns(bind):
+    """Adds model columns missing from tables created before they existed
+    (`create_all` never alters an existing table). New columns are nullable."""
+    for attempt in range(2):
+        missing = _missing_columns(bind)
+        if not missing:
+            return
+        try:
+            with bind.begin() as conn:
+                for column in missing:
+                    conn.execute(text(
+                        f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"
+                    ))
+            return
+        except (OperationalError, ProgrammingError):
+            # Another worker added it between our check and ALTER; the retry sees it
+            if attempt:
+                raise
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
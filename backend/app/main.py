@@ -1,20 +1,46 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Optional
 import os
-import pandas as pd
+import numpy as np
 
-from . import models, schemas, auth, database, middleware, utils
+from ml import metrics
+from ml.metrics import stage
+from . import models, schemas, auth, database, matches, middleware, utils, scheduler, profiling, ratelimit, prediction_log
 from .config import settings
-from ml.engine import MLEngine
 
-# Create Tables
-models.Base.metadata.create_all(bind=database.engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create Tables
+    database.init_db()
+    ratelimit.ensure_unique_index(database.engine)
+    matches.ensure_schema(database.engine)
+    # Write-behind flushing of rate limit counters and prediction logs
+    ratelimit.limiter.start()
+    prediction_log.logger.start()
+    # Serving engine + process pool for CPU-bound ML work. Models load and warm up
+    # in the background, so the server is up at once; /ready reports when they are.
+    scheduler.start(settings.MODEL_TYPE)
+    yield
+    scheduler.shutdown()
+    ratelimit.limiter.stop()
+    prediction_log.logger.stop()
 
-app = FastAPI(title="EPL Predictor")
+app = FastAPI(title="EPL Predictor", lifespan=lifespan)
+
+def require_engine():
+    if scheduler.engine_holder.get() is None:
+        raise HTTPException(status_code=503, detail="Models are still loading", headers={"Retry-After": "5"})
+
+# Request/stage timings and opt-in profiling
+app.add_middleware(middleware.InstrumentationMiddleware)
 
 # CORS
 app.add_middleware(
@@ -30,50 +56,88 @@ SHAP_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "reports",
 os.makedirs(SHAP_PATH, exist_ok=True)
 app.mount("/admin/shap", StaticFiles(directory=SHAP_PATH), name="shap")
 
+@app.get("/ready")
+def readiness():
+    # 503 until the models and team snapshot are loaded and warmed up
+    state = scheduler.readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
 # --- Simulation Routes ---
-@app.post("/simulate-match", response_model=schemas.SimulationMatchResponse)
+@app.post("/simulate-match", response_model=schemas.SimulationMatchResponse, dependencies=[Depends(require_engine)])
 def simulate_match(
-    request: schemas.PredictionRequest,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    request: schemas.SimulationMatchRequest,
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
     # Rate Limit
-    middleware.check_rate_limit(current_user, db)
+    middleware.check_rate_limit(current_user)
     
-    # We run the simulation multiple times for robust results
-    results = [utils.simulate_match_outcome(request.home_team, request.away_team, ml_engine) for _ in range(100)]
-    
-    counts = pd.Series(results).value_counts(normalize=True).to_dict()
+    # One prediction, then all simulations in a single vectorised draw
+    with stage("api.inference"):
+        probs, features = scheduler.run(utils.match_probabilities, request.home_team, request.away_team)
+    rng = np.random.default_rng(request.seed)
+
+    with stage("api.simulate"):
+        if request.mode == "exact":
+            sim_probs = dict(zip(utils.OUTCOMES, map(float, probs)))
+        else:
+            sim_probs = utils.simulate_match(probs, request.n_simulations, rng)
+
+        scoreline_sim = None
+        if request.scorelines and features is not None:
+            scoreline_sim = utils.simulate_scorelines(features, request.n_simulations, rng)
     
     return {
         "home_team": request.home_team,
         "away_team": request.away_team,
-        "sim_probs": {
-            "Home": counts.get('Home', 0), 
-            "Draw": counts.get('Draw', 0), 
-            "Away": counts.get('Away', 0)
-        }
+        "mode": request.mode,
+        "n_simulations": request.n_simulations,
+        "sim_probs": sim_probs,
+        "scoreline_sim": scoreline_sim
     }
 
-@app.get("/simulate-season", response_model=List[schemas.SimulationSeasonResponse])
+@app.get("/simulate-season", response_model=List[schemas.SimulationSeasonResponse], dependencies=[Depends(require_engine)])
 def simulate_season_endpoint(
     rounds: int = 100,
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    if rounds > 500:
-        raise HTTPException(status_code=400, detail="Max 500 rounds allowed for season simulation.")
+    if rounds < 1 or rounds > 100_000:
+        raise HTTPException(status_code=400, detail="Rounds must be between 1 and 100000 for season simulation.")
     
-    results = utils.simulate_season(ml_engine, rounds=rounds)
+    with stage("api.inference"):
+        results = scheduler.run(utils.simulate_season, rounds=rounds)
     return results
 
-# Initialize ML Engine
-ml_engine = MLEngine(model_type=settings.MODEL_TYPE)
+@app.get("/matchups", dependencies=[Depends(require_engine)])
+def get_matchups(
+    teams: Optional[str] = None,
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    # probs[i][j] = Home/Draw/Away for teams[i] at home to teams[j]; `teams` (comma separated) picks a block
+    team_list = [t.strip() for t in teams.split(",") if t.strip()] if teams else None
+    try:
+        return scheduler.engine_holder.get().matchup_table(team_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Match History Routes ---
+@app.get("/teams/{team}/matches", response_model=List[schemas.MatchOut])
+def get_team_matches(
+    team: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = 50,
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    # Most recent first, read from the matches table (filled by refresh/ingest)
+    if limit < 1 or limit > 1000:
+        raise HTTPException(status_code=400, detail="Limit must be between 1 and 1000.")
+    return matches.team_matches(team, start=start, end=end, limit=limit)
 
 # --- Auth Routes ---
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_read_db)):
+    user = await run_in_threadpool(auth.authenticate_user, db, form_data.username, form_data.password)
+    if not user:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     
     access_token = auth.create_access_token(data={"sub": user.email})
@@ -92,42 +156,122 @@ def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
     return new_user
 
 # --- Prediction Routes ---
-@app.post("/predict", response_model=schemas.PredictionResponse)
+@app.post("/predict", response_model=schemas.PredictionResponse, dependencies=[Depends(require_engine)])
 def predict_match(
     request: schemas.PredictionRequest, 
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    explain: bool = False,
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
     # Rate Limit
-    middleware.check_rate_limit(current_user, db)
+    middleware.check_rate_limit(current_user)
     
     try:
-        result = ml_engine.predict_proba(request.home_team, request.away_team)
+        with stage("api.inference"):
+            result = scheduler.run("predict_proba", request.home_team, request.away_team, explain=explain)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
     
-    # Save Prediction
-    pred = models.Prediction(
-        user_id=current_user.id,
-        home_team=request.home_team,
-        away_team=request.away_team,
-        probs_json=result['probs'],
-        features_json=result['features']
-    )
-    db.add(pred)
-    db.commit()
+    # Save Prediction (written in the background)
+    with stage("api.log_prediction"):
+        prediction_log.logger.log(current_user.id, [(request.home_team, request.away_team, result)])
     
     return result
 
+@app.post("/predict/batch", response_model=List[schemas.BatchPredictionItem], dependencies=[Depends(require_engine)])
+def predict_batch(
+    request: schemas.BatchPredictionRequest,
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    # Counted as one request per started 20 fixtures, so a full season fits in the daily limit
+    middleware.check_rate_limit(current_user, cost=middleware.batch_cost(len(request.fixtures)))
+
+    pairs = [(f.home_team, f.away_team) for f in request.fixtures]
+    try:
+        with stage("api.inference"):
+            results = scheduler.run("predict_many", pairs, explain=request.explain)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with stage("api.log_prediction"):
+        prediction_log.logger.log(current_user.id, [
+            (home_team, away_team, result) for (home_team, away_team), result in zip(pairs, results)
+        ])
+
+    return [
+        {"home_team": home_team, "away_team": away_team, **result}
+        for (home_team, away_team), result in zip(pairs, results)
+    ]
+
 # --- Admin Routes ---
-@app.post("/admin/retrain")
-def retrain_model(current_user: models.User = Depends(auth.get_current_admin)):
-    metrics = ml_engine.train()
-    # Reload model in memory
-    ml_engine.load_model()
-    return {"message": "Model retrained", "metrics": metrics}
-
-@app.get("/admin/stats")
-def get_stats(db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_admin)):
-    count = db.query(models.Prediction).count()
-    return {"total_predictions": count}
+@app.post("/admin/retrain", status_code=202)
+def retrain_model(current_user: auth.Principal = Depends(auth.get_current_admin)):
+    # Trains in the background; the new model is swapped in once fully loaded
+    job_id = scheduler.start_retrain()
+    return {"message": "Retraining started", "job_id": job_id, "status_url": f"/admin/retrain/{job_id}"}
+
+@app.get("/admin/retrain/{job_id}")
+def retrain_status(job_id: int, db: Session = Depends(database.get_read_db), current_user: auth.Principal = Depends(auth.get_current_admin)):
+    job = scheduler.retrain_status(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Retrain job not found")
+    return job
+
+@app.get("/admin/models", dependencies=[Depends(require_engine)])
+def list_models(current_user: auth.Principal = Depends(auth.get_current_admin)):
+    # `current` is what is promoted on disk; `serving` is what this app worker has loaded
+    # (they differ for up to MODEL_CHECK_INTERVAL after a change made by another worker)
+    ml_engine = scheduler.engine_holder.get()
+    registry = ml_engine.registry()
+    return {
+        "current": registry.current(),
+        "serving": ml_engine.model_version,
+        "versions": [registry.manifest(v) for v in registry.versions()]
+    }
+
+@app.post("/admin/models/rollback", dependencies=[Depends(require_engine)])
+def rollback_model(current_user: auth.Principal = Depends(auth.get_current_admin)):
+    try:
+        version = scheduler.engine_holder.get().registry().rollback()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Load it here now; every other app worker follows within MODEL_CHECK_INTERVAL
+    scheduler.reload_if_stale()
+    return {"current": version}
+
+@app.post("/admin/models/{version}/promote", dependencies=[Depends(require_engine)])
+def promote_model(version: str, current_user: auth.Principal = Depends(auth.get_current_admin)):
+    try:
+        scheduler.engine_holder.get().registry().promote(version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    scheduler.reload_if_stale()
+    return {"current": version}
+
+@app.post("/admin/refresh", dependencies=[Depends(require_engine)])
+def refresh_data(current_user: auth.Principal = Depends(auth.get_current_admin)):
+    # Store the latest results and rebuild the team snapshot from them without retraining
+    return scheduler.refresh_team_state(matches.history(refresh=True))
+
+@app.post("/admin/matches/ingest")
+def ingest_matches(current_user: auth.Principal = Depends(auth.get_current_admin)):
+    # Upsert the configured seasons into the matches table
+    return matches.ingest()
+
+@app.get("/admin/stats", dependencies=[Depends(require_engine)])
+def get_stats(db: Session = Depends(database.get_read_db), current_user: auth.Principal = Depends(auth.get_current_admin)):
+    # Rows still queued for the background writer are counted too
+    count = db.query(models.Prediction).count() + prediction_log.logger.pending()
+    return {"total_predictions": count, "prediction_cache": scheduler.prediction_cache_stats()}
+
+@app.get("/admin/metrics", response_class=PlainTextResponse)
+def get_metrics(current_user: auth.Principal = Depends(auth.get_current_admin)):
+    # Prometheus text format; histograms are per app worker process
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str, current_user: auth.Principal = Depends(auth.get_current_admin)):
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    with open(path) as f:
+        return PlainTextResponse(f.read())
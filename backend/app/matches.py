@@ -0,0 +1,192 @@
+"""Match history in the `matches` table.
+
+`ingest` bulk-upserts what `fetch_data` returns on the natural key (date, home
+team, away team), rewriting only rows whose result changed. The readers turn
+indexed range scans back into frames in `fetch_data`'s layout, so feature prep,
+the season simulation and team queries can skip the CSVs: with
+HISTORY_SOURCE=db they do, falling back to the CSVs until the first ingest.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import false, inspect, or_, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex
+
+from ml.data_fetch import DIVISIONS, compact_types, fetch_data
+from . import database, models
+from .config import settings
+
+BATCH_SIZE = 5000  # rows per upsert statement
+NATURAL_KEY = ("date", "home_team", "away_team")
+RESULT_COLUMNS = ("season", "division", "home_goals", "away_goals", "ftr", "raw_source")
+# matches column -> fetch_data column
+FRAME_COLUMNS = {
+    "division": "Div", "date": "Date", "home_team": "HomeTeam", "away_team": "AwayTeam",
+    "home_goals": "FTHG", "away_goals": "FTAG", "ftr": "FTR", "raw_source": "raw_source",
+}
+_SOURCE_SEASON = r"^(\d{4})_"  # '2324_E0.csv' -> '2324'
+
+
+def season_codes(df):
+    """football-data season code of each match: from its source file name, else
+    from the date (seasons start in July)."""
+    start = df['Date'].dt.year - (df['Date'].dt.month < 7)
+    codes = (start % 100).map("{:02d}".format) + ((start + 1) % 100).map("{:02d}".format)
+    if 'raw_source' in df:
+        codes = df['raw_source'].astype(str).str.extract(_SOURCE_SEASON, expand=False).fillna(codes)
+    return codes
+
+
+def _rows(df):
+    fthg, ftag = df['FTHG'].to_numpy(), df['FTAG'].to_numpy()
+    frame = pd.DataFrame({
+        "date": df['Date'],
+        "season": season_codes(df),
+        "division": df['Div'] if 'Div' in df else None,
+        "home_team": df['HomeTeam'],
+        "away_team": df['AwayTeam'],
+        "home_goals": df['FTHG'],
+        "away_goals": df['FTAG'],
+        "ftr": np.where(fthg > ftag, 'H', np.where(fthg == ftag, 'D', 'A')),
+        "raw_source": df['raw_source'] if 'raw_source' in df else None,
+    }).astype(object)
+    return frame.where(frame.notna(), None).to_dict("records")
+
+
+def upsert_matches(df, engine=None):
+    """Inserts new matches of a `fetch_data` frame and updates changed results.
+    Returns the number of rows written."""
+    if df.empty:
+        return 0
+    engine = engine or database.engine
+    table = models.Match.__table__
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c[c] for c in NATURAL_KEY],
+        set_={c: stmt.excluded[c] for c in RESULT_COLUMNS},
+        # Unchanged rows are left alone, so a re-ingest of the same files writes nothing
+        where=or_(*[table.c[c].is_distinct_from(stmt.excluded[c]) for c in RESULT_COLUMNS]),
+    )
+    rows = _rows(df)
+    written = 0
+    with engine.begin() as conn:
+        for start in range(0, len(rows), BATCH_SIZE):
+            written += conn.execute(stmt, rows[start:start + BATCH_SIZE]).rowcount
+    return written
+
+
+def ingest(offline=None, engine=None):
+    """Fetches the configured seasons and upserts them into `matches`."""
+    start = time.perf_counter()
+    raw_df = fetch_data(offline=offline)
+    written = upsert_matches(raw_df, engine=engine)
+    return {"matches": len(raw_df), "written": written, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def ensure_schema(engine):
+    """Adds the season/division columns and the indexes to a `matches` table
+    created before they existed, dropping duplicate matches first. Safe to run
+    from several workers at once."""
+    database.add_missing_columns(engine)
+    table = models.Match.__table__
+    for attempt in range(2):
+        indexes = {ix["name"] for ix in inspect(engine).get_indexes("matches")}
+        if all(index.name in indexes for index in table.indexes):
+            return
+        try:
+            with engine.begin() as conn:
+                if "ix_matches_date_teams" not in indexes:
+                    conn.execute(text(
+                        "DELETE FROM matches WHERE id NOT IN (SELECT max(id) FROM matches GROUP BY date, home_team, away_team)"
+                    ))
+                for index in table.indexes:
+                    if index.name not in indexes:
+                        conn.execute(CreateIndex(index, if_not_exists=True))
+            return
+        except (OperationalError, ProgrammingError):
+            # Another worker changed the table between our check and DDL; the retry sees it
+            if attempt:
+                raise
+
+
+# --- Readers ---
+def _select():
+    table = models.Match.__table__
+    return table, select(*[table.c[c] for c in FRAME_COLUMNS])
+
+
+def _frame(stmt, engine):
+    with (engine or database.read_engine).connect() as conn:
+        df = pd.read_sql(stmt, conn, parse_dates=["date"])
+    return compact_types(df.rename(columns=FRAME_COLUMNS))
+
+
+def _bound(value):
+    # Dates, strings and Timestamps as the datetime the DateTime column compares against
+    return pd.Timestamp(value).to_pydatetime()
+
+
+def has_matches(engine=None):
+    with (engine or database.read_engine).connect() as conn:
+        return conn.execute(select(models.Match.id).limit(1)).first() is not None
+
+
+def load_history(start=None, end=None, divisions=None, engine=None):
+    """Matches dated in [start, end), optionally only of `divisions`, in
+    `fetch_data`'s layout and order."""
+    table, stmt = _select()
+    if start is not None:
+        stmt = stmt.where(table.c.date >= _bound(start))
+    if end is not None:
+        stmt = stmt.where(table.c.date < _bound(end))
+    if divisions:
+        stmt = stmt.where(table.c.division.in_(divisions))
+    # Ingest inserts in fetch_data's order, so the id breaks ties within a day the same way
+    return _frame(stmt.order_by(table.c.date, table.c.id), engine)
+
+
+def current_season(division=None, engine=None):
+    """Matches of the season (and division) of the most recent match in `division`
+    (default: the main one, or any if no match has that division)."""
+    table, stmt = _select()
+    latest = select(table.c.season, table.c.division).order_by(table.c.date.desc()).limit(1)
+    with (engine or database.read_engine).connect() as conn:
+        row = conn.execute(latest.where(table.c.division == (division or DIVISIONS[0]))).first()
+        row = row or conn.execute(latest).first()
+    if row is None:
+        return _frame(stmt.where(false()), engine)
+    same_division = table.c.division == row.division if row.division is not None else table.c.division.is_(None)
+    return _frame(stmt.where(table.c.season == row.season, same_division).order_by(table.c.date, table.c.id), engine)
+
+
+def team_matches(team, start=None, end=None, limit=None, engine=None):
+    """`team`'s matches dated in [start, end), most recent first, as rows of the table."""
+    table = models.Match.__table__
+    stmt = select(table).where(or_(table.c.home_team == team, table.c.away_team == team))
+    if start is not None:
+        stmt = stmt.where(table.c.date >= _bound(start))
+    if end is not None:
+        stmt = stmt.where(table.c.date < _bound(end))
+    stmt = stmt.order_by(table.c.date.desc())
+    if limit:
+        stmt = stmt.limit(limit)
+    with (engine or database.read_engine).connect() as conn:
+        return [dict(row) for row in conn.execute(stmt).mappings()]
+
+
+def history(refresh=False):
+    """Raw match history for feature prep: the matches table with
+    HISTORY_SOURCE=db (once ingested), otherwise the CSVs. With `refresh`,
+    freshly fetched matches are ingested first."""
+    if refresh:
+        raw_df = fetch_data()
+        upsert_matches(raw_df)
+        if settings.HISTORY_SOURCE != "db":
+            return raw_df
+    if settings.HISTORY_SOURCE == "db" and has_matches():
+        return load_history()
+    return fetch_data()
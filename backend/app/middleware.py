@@ -1,9 +1,14 @@
 from fastapi import Request, HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
 from sqlalchemy.orm import Session
-from datetime import date
+import time
+from ml import metrics
+from ml.metrics import stage
+from . import auth, ratelimit
 from .database import SessionLocal
-from .models import RateLimit, User
+from .profiling import SamplingProfiler
 from .config import settings
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
@@ -19,21 +24,90 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         response = await call_next(request)
         return response
 
-def check_rate_limit(user: User, db: Session):
-    # Admin Override
-    if user.email == settings.ADMIN_EMAIL:
-        return True
-        
-    today = date.today().isoformat()
-    usage = db.query(RateLimit).filter(RateLimit.user_id == user.id, RateLimit.date == today).first()
-    
-    if usage:
-        if usage.requests_count >= 30:
+class InstrumentationMiddleware:
+    """Times every request and the stages it runs (see ml.metrics).
+
+    Latency goes to the epl_request_seconds histogram, labelled by endpoint
+    function rather than raw path to keep the label set small, and the stage
+    breakdown is returned in a Server-Timing header. Admins can add
+    `X-Profile: 1` to sample the request with the profiler; the report id comes
+    back in X-Profile-Id. Plain ASGI (not BaseHTTPMiddleware) to keep the
+    per-request overhead low.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profiler = await self._profiler(scope)
+        start = time.perf_counter()
+        status = 500
+
+        with metrics.trace() as stages:
+            async def send_with_timing(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", server_timing(stages, time.perf_counter() - start))
+                    if profiler is not None:
+                        headers.append("X-Profile-Id", profiler.id)
+                await send(message)
+
+            try:
+                if profiler is None:
+                    await self.app(scope, receive, send_with_timing)
+                else:
+                    with metrics.stage_hook(profiler.add_thread):
+                        await self.app(scope, receive, send_with_timing)
+            finally:
+                endpoint = scope.get("endpoint")
+                handler = getattr(endpoint, "__name__", "unmatched")
+                metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, handler, scope["method"], str(status))
+                if profiler is not None:
+                    profiler.stop()
+                    profiler.save(f"{scope['method']} {scope['path']} -> {status}")
+
+    @staticmethod
+    async def _profiler(scope):
+        headers = Headers(scope=scope)
+        if headers.get("x-profile") != "1":
+            return None
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        # A token missing from the principal cache is looked up in the DB, off the event loop
+        if scheme.lower() != "bearer" or not await run_in_threadpool(auth.is_admin_token, token):
+            return None
+        return SamplingProfiler().start()
+
+
+def server_timing(stages, total):
+    """Server-Timing header value: summed milliseconds per stage plus the total so far."""
+    durations = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1e3:.2f}" for name, seconds in durations.items()]
+    parts.append(f"total;dur={total * 1e3:.2f}")
+    return ", ".join(parts)
+
+DAILY_LIMIT = 30
+BATCH_FIXTURES_PER_REQUEST = 20 # /predict/batch: every started 20 fixtures count as one request
+
+def batch_cost(n_fixtures: int) -> int:
+    # A full season (schemas.MAX_BATCH_FIXTURES = 380) costs 19 of the DAILY_LIMIT requests
+    return -(-n_fixtures // BATCH_FIXTURES_PER_REQUEST)
+
+def check_rate_limit(user: auth.Principal, db: Session = None, cost: int = 1):
+    # A request of `cost` (see batch_cost) is checked and counted at once.
+    # Counters live in memory and are written behind to rate_limits (see app.ratelimit),
+    # so `db` is no longer used here.
+    with stage("api.rate_limit"):
+        # Admin Override
+        if user.email == settings.ADMIN_EMAIL:
+            return True
+        if not ratelimit.limiter.hit(user.id, cost=cost, limit=DAILY_LIMIT):
             raise HTTPException(status_code=429, detail="Daily rate limit exceeded")
-        usage.requests_count += 1
-    else:
-        usage = RateLimit(user_id=user.id, date=today, requests_count=1)
-        db.add(usage)
-    
-    db.commit()
-    return True
+        return True
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, JSON, ForeignKey, Index
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -12,14 +12,24 @@ class User(Base):
 
 class Match(Base):
     __tablename__ = "matches"
+    __table_args__ = (
+        # Natural key: a team plays at most once a day. Also serves date range scans.
+        Index("ix_matches_date_teams", "date", "home_team", "away_team", unique=True),
+        Index("ix_matches_home_team_date", "home_team", "date"),
+        Index("ix_matches_away_team_date", "away_team", "date"),
+        Index("ix_matches_division_date", "division", "date"),
+        Index("ix_matches_season_division", "season", "division"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     date = Column(DateTime)
+    season = Column(String) # football-data season code, e.g. '2324'
+    division = Column(String) # e.g. 'E0'
     home_team = Column(String)
     away_team = Column(String)
     home_goals = Column(Integer)
     away_goals = Column(Integer)
     ftr = Column(String) # Full Time Result (H, D, A)
-    raw_source = Column(String) # e.g., 'E0.csv'
+    raw_source = Column(String) # e.g., '2324_E0.csv'
 
 class Prediction(Base):
     __tablename__ = "predictions"
@@ -34,6 +44,7 @@ class Prediction(Base):
 
 class RateLimit(Base):
     __tablename__ = "rate_limits"
+    __table_args__ = (Index("ix_rate_limits_user_date", "user_id", "date", unique=True),)
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
     date = Column(String) # YYYY-MM-DD
@@ -44,4 +55,5 @@ class RetrainLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     started_at = Column(DateTime)
     finished_at = Column(DateTime)
+    status = Column(String, default="running") # running, succeeded, failed
     metrics_json = Column(JSON) # Accuracy, LogLoss etc
@@ -0,0 +1,138 @@
+"""Prediction logging off the request path.
+
+Endpoints enqueue prediction rows; a background thread drains the bounded queue
+and bulk-inserts up to `batch_size` rows per transaction, at least every
+`flush_interval` seconds. When the queue is full, a producer waits up to
+`put_timeout` seconds once for room (backpressure), then writes the rest of its
+rows itself. `stop()` drains everything on shutdown. Rows the background writer
+fails to insert are logged and dropped; failures of inline writes propagate to
+the request.
+"""
+import logging
+import queue
+import threading
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from ml.metrics import stage
+from . import database, models
+from .config import settings
+
+_STOP = object()
+log = logging.getLogger(__name__)
+
+
+class PredictionLogger:
+    def __init__(self, maxsize=10_000, batch_size=500, flush_interval=1.0, put_timeout=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+
+    def log(self, user_id, predictions):
+        """Queues (home_team, away_team, result) predictions made for `user_id`."""
+        now = datetime.utcnow()
+        overflow = []
+        for home_team, away_team, result in predictions:
+            row = {
+                "user_id": user_id,
+                "home_team": home_team,
+                "away_team": away_team,
+                "probs_json": result["probs"],
+                "features_json": result["features"],
+                "created_at": now
+            }
+            if overflow:
+                # The queue was already full: no more waiting, one put_timeout per call at most
+                overflow.append(row)
+                continue
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+            except queue.Full:
+                overflow.append(row)
+        if overflow:
+            self._write(overflow)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Writes every queued row, then stops the writer thread."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        else:
+            self._drain()
+
+    def flush(self):
+        """Blocks until every row queued so far is written."""
+        if self._thread is None:
+            self._drain()
+        else:
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = any(row is _STOP for row in batch)
+            rows = [row for row in batch if row is not _STOP]
+            self._write_logged(rows)
+            for _ in batch:
+                self._queue.task_done()
+            if stopping:
+                self._drain()
+                return
+
+    def _drain(self):
+        while True:
+            rows = []
+            while len(rows) < self.batch_size:
+                try:
+                    row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+                if row is not _STOP:
+                    rows.append(row)
+            if not rows:
+                return
+            self._write_logged(rows)
+
+    def _write_logged(self, rows):
+        try:
+            self._write(rows)
+        except Exception:
+            log.exception("Failed to log %d predictions; they are dropped", len(rows))
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with stage("prediction_log.write"):
+            # One executemany in one transaction for the whole batch
+            with database.engine.begin() as conn:
+                conn.execute(insert(models.Prediction.__table__), rows)
+
+
+logger = PredictionLogger(
+    maxsize=settings.PREDICTION_LOG_QUEUE_SIZE,
+    batch_size=settings.PREDICTION_LOG_BATCH_SIZE,
+    flush_interval=settings.PREDICTION_LOG_FLUSH_INTERVAL
+)
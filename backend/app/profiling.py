@@ -0,0 +1,125 @@
+"""Opt-in sampling profiler for single requests.
+
+An admin sends `X-Profile: 1` with a request; while it runs, the stacks of the
+threads working on it (every thread that enters a `metrics.stage` for the
+request) are sampled every PROFILE_INTERVAL seconds. The report is written to
+reports/profiles/<id>.txt and served by GET /admin/profiles/<id>. Work running
+in ML worker processes is not sampled; set ML_WORKERS=0 to profile it in-process.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "reports", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_MAX_FILES = 50
+MAX_STACK_DEPTH = 64
+# Innermost frames of threads that are just waiting (event loop select, pool queues)
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _function_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of a set of threads from a background thread."""
+
+    def __init__(self, interval=None):
+        self.interval = PROFILE_INTERVAL if interval is None else interval
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.threads = set()
+        self.stacks = Counter()  # tuple of frame labels, outermost first -> samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._started = None
+        self._elapsed = 0.0
+
+    def add_thread(self, ident):
+        self.threads.add(ident)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._elapsed = time.perf_counter() - self._started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is None or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append((_frame_label(frame), _function_label(frame)))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+
+    def report(self, title="", top=30):
+        """Text report: functions by inclusive and self samples, then collapsed stacks."""
+        inclusive, own = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            for function in {fn for _, fn in stack}:
+                inclusive[function] += n
+            own[stack[-1][1]] += n
+
+        total = max(self.samples, 1)
+        lines = [
+            f"Profile {self.id} {title}".rstrip(),
+            f"wall {self._elapsed * 1e3:.1f} ms, {self.samples} samples every {self.interval * 1e3:g} ms"
+            f" over {len(self.threads)} thread(s)",
+            "",
+            "Inclusive (function incl. callees):",
+        ]
+        lines += [f"  {n / total:7.1%}  {n:6d}  {fn}" for fn, n in inclusive.most_common(top)]
+        lines += ["", "Self (innermost function):"]
+        lines += [f"  {n / total:7.1%}  {n:6d}  {fn}" for fn, n in own.most_common(top)]
+        lines += ["", "Collapsed stacks (flamegraph.pl / speedscope input):"]
+        lines += [
+            ";".join(label for label, _ in stack) + f" {n}"
+            for stack, n in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def save(self, title=""):
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        path = os.path.join(PROFILES_DIR, f"{self.id}.txt")
+        with open(path + ".tmp", "w") as f:
+            f.write(self.report(title))
+        os.replace(path + ".tmp", path)
+        prune_profiles()
+        return path
+
+
+def prune_profiles(max_files=PROFILE_MAX_FILES):
+    names = sorted(n for n in os.listdir(PROFILES_DIR) if n.endswith(".txt"))
+    for name in names[:-max_files] if max_files else names:
+        try:
+            os.remove(os.path.join(PROFILES_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def profile_path(profile_id):
+    """Path of a saved report, or None for unknown (or malformed) ids."""
+    if not profile_id.replace("-", "").isalnum():
+        return None
+    path = os.path.join(PROFILES_DIR, f"{profile_id}.txt")
+    return path if os.path.exists(path) else None
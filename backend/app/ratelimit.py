@@ -0,0 +1,248 @@
+"""Daily per-user request counters kept in memory and written behind to the DB.
+
+`RateLimiter.hit` is an atomic check-and-increment on a counter backend. The
+first hit on a (user, day) in a process seeds the counter from the
+`rate_limits` table, and a background thread upserts the counters that changed
+every `flush_interval` seconds (and once more on shutdown), so limits survive
+restarts without a DB round trip per request.
+
+Backends:
+    MemoryCounterStore  counters private to this process (one app worker)
+    SQLiteCounterStore  counters in a local SQLite file shared by every app
+                        worker process on the host
+
+With more than one app worker only the shared store enforces the limit: each
+worker's private counters would let a user through once per worker. So the
+default (RATE_LIMIT_BACKEND=auto) picks it whenever WEB_CONCURRENCY > 1.
+"""
+import os
+import sqlite3
+import threading
+from datetime import date
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex
+
+from . import database, models
+from .config import settings
+
+
+class MemoryCounterStore:
+    """Counters in a dict guarded by a lock."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def seed(self, key, count):
+        with self._lock:
+            self._counts[key] = max(self._counts.get(key, 0), count)
+
+    def try_add(self, key, cost, limit):
+        """Adds `cost` unless that would exceed `limit`. Returns whether it was added."""
+        with self._lock:
+            count = self._counts.get(key, 0)
+            if count + cost > limit:
+                return False
+            self._counts[key] = count + cost
+            return True
+
+    def get(self, key):
+        with self._lock:
+            return self._counts.get(key, 0)
+
+    def drop_before(self, day):
+        with self._lock:
+            for key in [k for k in self._counts if k[1] < day]:
+                del self._counts[key]
+
+
+class SQLiteCounterStore:
+    """Counters in a small local SQLite file, shared across processes.
+
+    Each check-and-increment is a single conditional UPDATE, which SQLite runs
+    atomically; the file is only a cache of the rate_limits table, so it skips
+    fsyncs (synchronous=OFF).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "user_id INTEGER NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL, "
+            "PRIMARY KEY (user_id, day)) WITHOUT ROWID"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def seed(self, key, count):
+        self._conn().execute(
+            "INSERT INTO counters VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, day) DO UPDATE SET count = max(count, excluded.count)",
+            (*key, count)
+        )
+
+    def try_add(self, key, cost, limit):
+        cursor = self._conn().execute(
+            "UPDATE counters SET count = count + ? WHERE user_id = ? AND day = ? AND count + ? <= ?",
+            (cost, *key, cost, limit)
+        )
+        return cursor.rowcount == 1
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT count FROM counters WHERE user_id = ? AND day = ?", key
+        ).fetchone()
+        return row[0] if row else 0
+
+    def drop_before(self, day):
+        self._conn().execute("DELETE FROM counters WHERE day < ?", (day,))
+
+
+class RateLimiter:
+    def __init__(self, store, flush_interval=5.0):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._seeded = set()  # keys loaded from the DB by this process
+        self._dirty = set()  # keys changed since the last flush
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def hit(self, user_id, cost=1, limit=30, day=None):
+        """Counts `cost` requests for the user today. False (and nothing counted) if over `limit`."""
+        key = (user_id, day or date.today().isoformat())
+        if key not in self._seeded:
+            self._seed(key)
+        if not self.store.try_add(key, cost, limit):
+            return False
+        with self._lock:
+            self._dirty.add(key)
+        return True
+
+    def count(self, user_id, day=None):
+        key = (user_id, day or date.today().isoformat())
+        if key not in self._seeded:
+            self._seed(key)
+        return self.store.get(key)
+
+    def _seed(self, key):
+        db = database.SessionLocal()
+        try:
+            stored = db.query(models.RateLimit.requests_count).filter(
+                models.RateLimit.user_id == key[0], models.RateLimit.date == key[1]
+            ).scalar()
+        finally:
+            db.close()
+        self.store.seed(key, stored or 0)
+        with self._lock:
+            self._seeded.add(key)
+
+    def flush(self):
+        """Upserts the changed counters into rate_limits. Counts only ever grow, so
+        concurrent flushes from several processes keep the largest value."""
+        with self._lock:
+            keys, self._dirty = self._dirty, set()
+        rows = [{"user_id": k[0], "date": k[1], "requests_count": self.store.get(k)} for k in keys]
+        if rows:
+            try:
+                _upsert_counts(rows)
+            except Exception:
+                with self._lock:
+                    self._dirty.update(keys)  # retried on the next flush
+                raise
+
+        # Yesterday's counters are never read again
+        today = date.today().isoformat()
+        self.store.drop_before(today)
+        with self._lock:
+            self._seeded = {k for k in self._seeded if k[1] >= today}
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rate-limit-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Rate limit flush failed: {e}")
+
+
+def _upsert_counts(rows):
+    table = models.RateLimit.__table__
+    dialect = database.engine.dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(table)
+        greatest = func.greatest
+    else:
+        stmt = sqlite.insert(table)
+        greatest = func.max
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.date],
+        set_={"requests_count": greatest(table.c.requests_count, stmt.excluded.requests_count)}
+    )
+    with database.engine.begin() as conn:
+        conn.execute(stmt, rows)
+
+
+def ensure_unique_index(engine):
+    """Adds the (user_id, date) unique index to databases created before it existed,
+    merging duplicate rows first. Safe to run from several workers at once."""
+    index = next(ix for ix in models.RateLimit.__table__.indexes if ix.name == "ix_rate_limits_user_date")
+    for attempt in range(2):
+        if any(ix["name"] == index.name for ix in inspect(engine).get_indexes("rate_limits")):
+            return
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "UPDATE rate_limits SET requests_count = ("
+                    "SELECT max(r.requests_count) FROM rate_limits r "
+                    "WHERE r.user_id = rate_limits.user_id AND r.date = rate_limits.date)"
+                ))
+                conn.execute(text(
+                    "DELETE FROM rate_limits WHERE id NOT IN (SELECT min(id) FROM rate_limits GROUP BY user_id, date)"
+                ))
+                conn.execute(CreateIndex(index, if_not_exists=True))
+            return
+        except (OperationalError, ProgrammingError):
+            # Another worker changed the table between our check and DDL; the retry sees it
+            if attempt:
+                raise
+
+
+def create_limiter():
+    backend = settings.RATE_LIMIT_BACKEND
+    if backend == "auto":
+        backend = "sqlite" if settings.WEB_CONCURRENCY > 1 else "memory"
+    if backend == "sqlite":
+        store = SQLiteCounterStore(settings.RATE_LIMIT_STORE)
+    elif backend == "memory":
+        store = MemoryCounterStore()
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.RATE_LIMIT_BACKEND}")
+    return RateLimiter(store, flush_interval=settings.RATE_LIMIT_FLUSH_INTERVAL)
+
+
+limiter = create_limiter()
@@ -0,0 +1,289 @@
+"""Runs ML work off the request handlers.
+
+CPU-bound inference and simulation go to a bounded process pool whose workers
+each hold their own MLEngine, and retraining runs as a background job. The
+serving engine is swapped in atomically once a new model is fully loaded and
+warmed up; worker processes notice the new generation on their next task and
+reload. At startup the engine loads in a background thread and `readiness()`
+reports when it (and every worker) can serve.
+
+Each app worker process has its own serving engine. A watcher thread compares
+its artifacts with what is promoted on disk (`ml.engine.artifact_version`)
+every MODEL_CHECK_INTERVAL seconds and reloads when another app worker (or a
+retrain job) trained, promoted, rolled back or refreshed.
+"""
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+
+from ml import metrics
+from ml.engine import MLEngine
+from . import database, matches, models
+from .config import settings
+
+
+class EngineHolder:
+    """Current serving engine plus a generation counter bumped on every swap."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engine = None
+        self.generation = 0
+
+    def get(self):
+        return self._engine
+
+    def swap(self, engine):
+        with self._lock:
+            self._engine = engine
+            self.generation += 1
+
+
+engine_holder = EngineHolder()
+_model_type = settings.MODEL_TYPE
+_pool: Optional[ProcessPoolExecutor] = None
+_retrain_pool = None
+_jobs: Dict[int, Future] = {}
+_jobs_lock = threading.Lock()
+_loaded = threading.Event()  # startup load and warm-up finished (successfully or not)
+_load_error: Optional[str] = None
+_reload_lock = threading.Lock()
+_stop_watch = threading.Event()
+_worker_cache_stats: Dict[int, dict] = {}  # pool worker pid -> its prediction cache stats
+
+# --- Worker process side ---
+_worker = {"generation": None, "engine": None}
+
+
+def _run_in_worker(generation, model_type, target, args, kwargs):
+    # Stage timings and cache counters go back with the result so the server can report them
+    with metrics.trace() as stages:
+        if _worker["generation"] != generation:
+            with metrics.stage("worker.load_engine"):
+                _worker["engine"] = MLEngine(model_type=model_type)
+            _worker["generation"] = generation
+        result = _call(_worker["engine"], target, args, kwargs)
+    return result, stages, (os.getpid(), _worker["engine"].prediction_cache.stats())
+
+
+def _call(engine, target, args, kwargs):
+    # `target` is an engine method name or a function taking the engine first
+    if isinstance(target, str):
+        return getattr(engine, target)(*args, **kwargs)
+    return target(engine, *args, **kwargs)
+
+
+def _warm_up_worker(engine):
+    return engine.warm_up()
+
+
+def _train_job(model_type):
+    engine = MLEngine(model_type=model_type)
+    return engine.train(matches.history())
+
+
+# --- Server side ---
+def start(model_type: str = None, workers: int = None):
+    """Starts the inference pool (0 workers = run inline) and loads the serving
+    engine in the background; see `readiness()`."""
+    global _pool, _retrain_pool, _model_type, _load_error
+    _model_type = model_type or settings.MODEL_TYPE
+    workers = settings.ML_WORKERS if workers is None else workers
+
+    if workers > 0:
+        ctx = multiprocessing.get_context("spawn")
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        _retrain_pool = ProcessPoolExecutor(max_workers=1, mp_context=ctx)
+    else:
+        _retrain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrain")
+
+    _loaded.clear()
+    _load_error = None
+    _stop_watch.clear()
+    threading.Thread(target=_load, args=(workers,), name="engine-load", daemon=True).start()
+
+
+def _load(workers):
+    global _load_error
+    try:
+        reload_engine()
+        if _pool is not None and engine_holder.get().warmed:
+            # Each worker loads its own engine; one warm-up task per worker (they
+            # are spawned on demand, so concurrent tasks land on different ones)
+            futures = [
+                _pool.submit(_run_in_worker, engine_holder.generation, _model_type, _warm_up_worker, (), {})
+                for _ in range(workers)
+            ]
+            for future in futures:
+                _worker_cache_stats.update([future.result(timeout=settings.ML_TASK_TIMEOUT)[2]])
+    except Exception:
+        _load_error = traceback.format_exc(limit=5)
+    finally:
+        _loaded.set()
+    _watch()
+
+
+def _watch():
+    while not _stop_watch.wait(settings.MODEL_CHECK_INTERVAL):
+        try:
+            reload_if_stale()
+        except Exception as e:
+            print(f"Engine reload failed: {e}")
+
+
+def reload_if_stale():
+    """Reloads the serving engine if the promoted model or team snapshot on disk
+    changed since it loaded. Returns whether it reloaded."""
+    engine = engine_holder.get()
+    if engine is None or not engine.is_stale():
+        return False
+    reload_engine()
+    return True
+
+
+def wait_loaded(timeout: float = None) -> bool:
+    """Blocks until the startup load has finished. Returns False on timeout."""
+    return _loaded.wait(timeout)
+
+
+def readiness():
+    """Whether the serving engine has a model and team snapshot loaded and warmed up."""
+    engine = engine_holder.get()
+    status = {
+        "model_loaded": engine is not None and engine.model is not None,
+        "team_state_loaded": engine is not None and engine.team_state is not None,
+        "warmed": _loaded.is_set() and engine is not None and engine.warmed,
+        "model_version": engine.model_version if engine is not None else None,
+    }
+    status["ready"] = status["model_loaded"] and status["team_state_loaded"] and status["warmed"]
+    if _load_error:
+        status["error"] = _load_error
+    return status
+
+
+def shutdown():
+    global _pool, _retrain_pool
+    _stop_watch.set()
+    for pool in (_pool, _retrain_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _pool = _retrain_pool = None
+    _worker_cache_stats.clear()
+
+
+def run(target, *args, **kwargs):
+    """Runs `target` against the current engine, in the process pool when enabled.
+
+    Blocks the calling (threadpool) thread, never the event loop.
+    """
+    if _pool is None:
+        return _call(engine_holder.get(), target, args, kwargs)
+    future = _pool.submit(_run_in_worker, engine_holder.generation, _model_type, target, args, kwargs)
+    result, stages, (pid, cache_stats) = future.result(timeout=settings.ML_TASK_TIMEOUT)
+    metrics.record(stages)
+    _worker_cache_stats[pid] = cache_stats
+    return result
+
+
+def prediction_cache_stats():
+    """Prediction cache counters summed over the serving engine and the pool
+    workers (as of each worker's last task), which do the lookups when the pool
+    is enabled."""
+    engine = engine_holder.get()
+    processes = list(_worker_cache_stats.values())
+    if engine is not None:
+        processes.append(engine.prediction_cache.stats())
+    if not processes:
+        return None
+    total = {key: sum(p[key] for p in processes) for key in ("size", "hits", "misses")}
+    lookups = total["hits"] + total["misses"]
+    total.update(
+        maxsize=processes[0]["maxsize"],
+        ttl=processes[0]["ttl"],
+        hit_rate=total["hits"] / lookups if lookups else 0.0,
+        processes=len(processes),
+    )
+    return total
+
+
+def reload_engine():
+    """Loads the currently promoted model into a new engine, warms it up and swaps it in."""
+    with _reload_lock, metrics.stage("scheduler.load_engine"):
+        engine = MLEngine(model_type=_model_type)
+        engine.warm_up()
+        engine_holder.swap(engine)
+
+
+def refresh_team_state(raw_df):
+    """Rebuilds the team snapshot from `raw_df` on a new engine and swaps it in once
+    complete, so requests never see a half-updated snapshot. Other app workers
+    reload the saved snapshot within MODEL_CHECK_INTERVAL."""
+    with _reload_lock, metrics.stage("scheduler.refresh_team_state"):
+        engine = MLEngine(model_type=_model_type)
+        result = engine.refresh_team_state(raw_df)
+        engine.warm_up()
+        engine_holder.swap(engine)
+    return result
+
+
+def start_retrain() -> int:
+    """Starts a background retrain and returns its job id (the RetrainLog id).
+
+    Only one retrain runs at a time; asking again returns the running job.
+    """
+    with _jobs_lock:
+        for job_id, future in _jobs.items():
+            if not future.done():
+                return job_id
+
+        db = database.SessionLocal()
+        try:
+            log = models.RetrainLog(started_at=datetime.utcnow(), status="running")
+            db.add(log)
+            db.commit()
+            job_id = log.id
+        finally:
+            db.close()
+
+        future = _retrain_pool.submit(_train_job, _model_type)
+        _jobs[job_id] = future
+    future.add_done_callback(lambda f: _finish_retrain(job_id, f))
+    return job_id
+
+
+def _finish_retrain(job_id, future):
+    status, scores = "failed", None
+    try:
+        scores = future.result()
+        # Fully load the new artifacts before serving from them
+        reload_engine()
+        status = "succeeded"
+    except Exception:
+        scores = {"error": traceback.format_exc(limit=5)}
+
+    db = database.SessionLocal()
+    try:
+        log = db.get(models.RetrainLog, job_id)
+        log.finished_at = datetime.utcnow()
+        log.status = status
+        log.metrics_json = scores
+        db.commit()
+    finally:
+        db.close()
+
+
+def retrain_status(db, job_id: int):
+    log = db.get(models.RetrainLog, job_id)
+    if log is None:
+        return None
+    return {
+        "job_id": log.id,
+        "status": log.status,
+        "started_at": log.started_at,
+        "finished_at": log.finished_at,
+        "metrics": log.metrics_json
+    }
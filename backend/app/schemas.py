@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Literal
 
 class UserCreate(BaseModel):
     email: str
@@ -22,14 +23,65 @@ class PredictionRequest(BaseModel):
 
 class PredictionResponse(BaseModel):
     probs: Dict[str, float]
-    shap_url: str
+    shap_url: Optional[str] = None # only with explain=true; rendered in the background
+    shap_values: Optional[Dict[str, float]] = None
     features: Dict[str, Any]
+
+MAX_BATCH_FIXTURES = 380 # a full 20-team season
+
+class BatchPredictionRequest(BaseModel):
+    fixtures: List[PredictionRequest] = Field(..., min_length=1, max_length=MAX_BATCH_FIXTURES)
+    explain: bool = False
+
+class BatchPredictionItem(BaseModel):
+    home_team: str
+    away_team: str
+    probs: Dict[str, float]
+    shap_url: Optional[str] = None
+    shap_values: Optional[Dict[str, float]] = None
+    features: Dict[str, Any]
+
+class SimulationMatchRequest(PredictionRequest):
+    n_simulations: int = Field(100, ge=1, le=5_000_000)
+    mode: Literal["sample", "exact"] = "sample" # exact: return the model probabilities directly
+    scorelines: bool = False # also simulate scorelines from a Poisson goals model
+    seed: Optional[int] = None
+
+class Scoreline(BaseModel):
+    score: str
+    prob: float
+
+class ScorelineSimulation(BaseModel):
+    expected_goals: Dict[str, float]
+    outcome_probs: Dict[str, float]
+    scorelines: List[Scoreline]
+
 class SimulationMatchResponse(BaseModel):
     home_team: str
     away_team: str
+    mode: str
+    n_simulations: int
     sim_probs: Dict[str, float]
+    scoreline_sim: Optional[ScorelineSimulation] = None
 
 class SimulationSeasonResponse(BaseModel):
     Team: str
     Avg_Final_Rank: float
     Rounds: int
+    Current_Pts: int
+    Remaining_Fixtures: int
+    Expected_Pts: float
+    Title_Odds: float
+    Top4_Odds: float
+    Relegation_Odds: float
+    Position_Probs: List[float] # Position_Probs[i] = P(finishing position i + 1)
+
+class MatchOut(BaseModel):
+    date: datetime
+    season: Optional[str] = None
+    division: Optional[str] = None
+    home_team: str
+    away_team: str
+    home_goals: int
+    away_goals: int
+    ftr: Optional[str] = None
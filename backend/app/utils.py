@@ -1,108 +1,194 @@
 import numpy as np
 import pandas as pd
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from ml.engine import MLEngine
-from ml.data_fetch import fetch_data
+from ml.data_fetch import DIVISIONS, fetch_data
 from ml.feature_engineering import prepare_features
+from ml.metrics import stage
+from app import matches
 from app.config import settings
 
-def simulate_match_outcome(home_team: str, away_team: str, ml_engine: MLEngine) -> str:
-    """Simulates a single match based on predicted probabilities."""
+OUTCOMES = ['Home', 'Draw', 'Away']
+MAX_GOALS = 10  # scorelines above this are folded into it
+
+def match_probabilities(ml_engine: MLEngine, home_team: str, away_team: str) -> Tuple[np.ndarray, Optional[Dict]]:
+    """One model prediction: (Home/Draw/Away probabilities, feature row or None on fallback)."""
     try:
         result = ml_engine.predict_proba(home_team, away_team)
-        probs = result['probs']
+        probs, features = result['probs'], result['features']
     except Exception:
         # Fallback to pure random if model fails (e.g., initial run)
-        probs = {"Home": 0.4, "Draw": 0.3, "Away": 0.3}
+        probs, features = {"Home": 0.4, "Draw": 0.3, "Away": 0.3}, None
 
-    outcomes = ['Home', 'Draw', 'Away']
-    probabilities = [probs['Home'], probs['Draw'], probs['Away']]
-    
+    probabilities = np.array([probs[o] for o in OUTCOMES])
     # Normalize probabilities just in case
-    probabilities = np.array(probabilities) / sum(probabilities)
-    
-    # Monte Carlo selection
-    return np.random.choice(outcomes, p=probabilities)
+    return probabilities / probabilities.sum(), features
+
+def simulate_match(probs: np.ndarray, n: int, rng: np.random.Generator) -> Dict[str, float]:
+    """Outcome frequencies of `n` simulated matches.
+
+    Counting n categorical draws is a single multinomial draw, so the cost does
+    not depend on n.
+    """
+    counts = rng.multinomial(n, probs)
+    return {o: float(c / n) for o, c in zip(OUTCOMES, counts)}
+
+def expected_goals(features: Dict) -> Tuple[float, float]:
+    """Poisson goal rates from the form features: own scoring form vs opponent's conceding form."""
+    home = (features['Home_Form_GF'] + features['Away_Form_GA']) / 2
+    away = (features['Away_Form_GF'] + features['Home_Form_GA']) / 2
+    return max(home, 0.05), max(away, 0.05)
+
+def simulate_scorelines(features: Dict, n: int, rng: np.random.Generator, top: int = 10) -> Dict:
+    """Simulates `n` scorelines from independent Poisson goals, fully vectorised."""
+    lam_home, lam_away = expected_goals(features)
+    home_goals = np.minimum(rng.poisson(lam_home, n), MAX_GOALS)
+    away_goals = np.minimum(rng.poisson(lam_away, n), MAX_GOALS)
+
+    grid = np.bincount(home_goals * (MAX_GOALS + 1) + away_goals, minlength=(MAX_GOALS + 1) ** 2) / n
+    grid = grid.reshape(MAX_GOALS + 1, MAX_GOALS + 1)  # grid[h, a] = P(h-a)
+    best = np.argsort(grid, axis=None, kind='stable')[::-1][:top]
+
+    return {
+        "expected_goals": {"Home": lam_home, "Away": lam_away},
+        "outcome_probs": {
+            "Home": float(np.tril(grid, -1).sum()),
+            "Draw": float(np.trace(grid)),
+            "Away": float(np.triu(grid, 1).sum())
+        },
+        "scorelines": [
+            {"score": f"{h}-{a}", "prob": float(grid[h, a])}
+            for h, a in zip(*np.unravel_index(best, grid.shape))
+        ]
+    }
+
+HOME_POINTS = np.array([3, 1, 0])  # indexed by outcome: Home, Draw, Away
+AWAY_POINTS = np.array([0, 1, 3])
+MAX_DRAWS_PER_CHUNK = 1_000_000  # rounds x fixtures sampled at once, keeps a chunk's arrays in cache
+DRAW_RANGE = 1 << 16  # outcome probabilities are resolved to 1/65536
+
+def current_season(raw_df: pd.DataFrame) -> pd.DataFrame:
+    """Matches from the same source file as the most recent match of the main division."""
+    if 'Div' in raw_df and (raw_df['Div'] == DIVISIONS[0]).any():
+        raw_df = raw_df[raw_df['Div'] == DIVISIONS[0]]
+    latest_source = raw_df.loc[raw_df['Date'].idxmax(), 'raw_source']
+    return raw_df[raw_df['raw_source'] == latest_source]
+
+def load_current_season() -> pd.DataFrame:
+    """`current_season` of the history, read from the matches table with HISTORY_SOURCE=db."""
+    if settings.HISTORY_SOURCE == "db" and matches.has_matches():
+        return matches.current_season()
+    return current_season(fetch_data())
+
+def remaining_fixtures(season_df: pd.DataFrame, teams: List[str]) -> List[Tuple[str, str]]:
+    """Home/away pairs of the double round robin that have no result yet."""
+    played = set(zip(season_df['HomeTeam'], season_df['AwayTeam']))
+    return [(h, a) for h in teams for a in teams if h != a and (h, a) not in played]
+
+def fixture_probabilities(ml_engine: MLEngine, fixtures: List[Tuple[str, str]]) -> np.ndarray:
+    """(n_fixtures, 3) array of Home/Draw/Away probabilities, indexed out of the matchup tensor."""
+    if not fixtures:
+        return np.empty((0, 3))
+    try:
+        probs = np.asarray(ml_engine.matchup_probs(fixtures), dtype=np.float64)
+    except Exception:
+        # Fallback to pure random if model fails (e.g., initial run)
+        probs = np.tile([0.4, 0.3, 0.3], (len(fixtures), 1))
+    return probs / probs.sum(axis=1, keepdims=True)
 
-def simulate_season(ml_engine: MLEngine, rounds: int = 100) -> List[Dict]:
+def simulate_standings(baseline: np.ndarray, home_idx: np.ndarray, away_idx: np.ndarray,
+                       probs: np.ndarray, rounds: int, rng: np.random.Generator) -> np.ndarray:
+    """Monte Carlo over the remaining fixtures.
+
+    Returns a (n_teams, n_teams) matrix of how often each team finished in each position.
+    Ties on points are broken by team order, as the original dict-sort did.
+
+    Draws are 16-bit integers laid out fixture x round, with the fixtures grouped
+    by home team, so a team's points are sums of contiguous rows of small integers.
+    """
+    n_teams = len(baseline)
+    n_fixtures = len(home_idx)
+    position_counts = np.zeros((n_teams, n_teams), dtype=np.int64)
+
+    by_home = np.argsort(home_idx, kind='stable')
+    home_idx, away_idx, probs = home_idx[by_home], away_idx[by_home], probs[by_home]
+    by_away = np.argsort(away_idx, kind='stable')
+    home_teams, home_starts = np.unique(home_idx, return_index=True)
+    away_teams, away_starts = np.unique(away_idx[by_away], return_index=True)
+    # Every away fixture is worth 3 points, minus what the home side took
+    start_points = (baseline + 3 * np.bincount(away_idx, minlength=n_teams)).astype(np.int32)[:, None]
+
+    # P(Home) and P(Home or Draw) as thresholds on a uniform 16-bit draw: draw <= limit
+    thresholds = np.rint(np.cumsum(probs, axis=1)[:, :2] * DRAW_RANGE)
+    limits = np.clip(thresholds - 1, 0, DRAW_RANGE - 1).astype(np.uint16)
+    never = thresholds == 0
+    chunk = max(1, MAX_DRAWS_PER_CHUNK // max(n_fixtures, 1))
+
+    for start in range(0, rounds, chunk):
+        n = min(chunk, rounds - start)
+        u = rng.integers(0, DRAW_RANGE, (n_fixtures, n), dtype=np.uint16)
+        home_win = (u <= limits[:, :1]).view(np.uint8)
+        not_away_win = (u <= limits[:, 1:]).view(np.uint8)
+        home_win[never[:, 0]] = 0
+        not_away_win[never[:, 1]] = 0
+
+        # Home side: 3/1/0 = 2*home_win + not_away_win; away side: 0/1/3 = 3 - home_win - 2*not_away_win
+        points = np.repeat(start_points, n, axis=1)
+        points[home_teams] += np.add.reduceat(2 * home_win + not_away_win, home_starts, axis=0, dtype=np.int32)
+        away_lost = (home_win + 2 * not_away_win)[by_away]
+        points[away_teams] -= np.add.reduceat(away_lost, away_starts, axis=0, dtype=np.int32)
+
+        order = np.argsort(-points.T, axis=1, kind='stable')  # order[r, pos] = team
+        position_counts += np.bincount((order * n_teams + np.arange(n_teams)).ravel(),
+                                       minlength=n_teams * n_teams).reshape(n_teams, n_teams)
+    return position_counts
+
+def simulate_season(ml_engine: MLEngine, rounds: int = 100, seed=None) -> List[Dict]:
     """Runs Monte Carlo simulation for the remaining season fixtures."""
-    
-    # 1. Fetch current league data (simplification: assume 'current' means the last match in history)
-    raw_df = fetch_data()
-    
-    # Identify unique teams and initialize table
-    teams = sorted(list(set(raw_df['HomeTeam']).union(set(raw_df['AwayTeam']))))
-    
-    # Identify remaining fixtures (this is the tricky part without a 'future fixtures' source)
-    # SIMPLE APPROACH: Assume current season is in E0.csv and find rows where FTHG/FTAG are null
-    
-    current_season_df = raw_df[raw_df['raw_source'].str.contains('2324', na=False)] 
-    
-    # Filter for completed matches (where scores are available)
-    completed_df = current_season_df.dropna(subset=['FTHG', 'FTAG'])
-    # Remaining fixtures (where scores are NaN)
-    fixtures_df = current_season_df[current_season_df['FTHG'].isnull() | current_season_df['FTAG'].isnull()]
-
-    if fixtures_df.empty:
-        # Fallback: if data is fully updated, assume the next round is fixtures. 
-        # For simplicity, we skip if no remaining fixtures are found.
-        return [{"message": "Season complete, no remaining fixtures to simulate."}]
-
-    final_standings = []
-    
-    # Monte Carlo Rounds
-    for _ in range(rounds):
-        temp_standings = {team: {'P': 0, 'W': 0, 'D': 0, 'L': 0, 'GF': 0, 'GA': 0, 'Pts': 0} for team in teams}
-        
-        # Start standings from completed matches
-        for _, row in completed_df.iterrows():
-            ftr = row['FTR']
-            h_pts, a_pts = 0, 0
-            if ftr == 'H': h_pts, a_pts = 3, 0
-            elif ftr == 'A': h_pts, a_pts = 0, 3
-            elif ftr == 'D': h_pts, a_pts = 1, 1
-
-            temp_standings[row['HomeTeam']]['P'] += 1
-            temp_standings[row['AwayTeam']]['P'] += 1
-            temp_standings[row['HomeTeam']]['Pts'] += h_pts
-            temp_standings[row['AwayTeam']]['Pts'] += a_pts
-            
-        
-        # Simulate remaining matches
-        for _, fixture in fixtures_df.iterrows():
-            h_team = fixture['HomeTeam']
-            a_team = fixture['AwayTeam']
-            
-            # Predict outcome using the model
-            outcome = simulate_match_outcome(h_team, a_team, ml_engine)
-            
-            h_pts, a_pts = 0, 0
-            if outcome == 'Home': h_pts, a_pts = 3, 0
-            elif outcome == 'Away': h_pts, a_pts = 0, 3
-            elif outcome == 'Draw': h_pts, a_pts = 1, 1
-            
-            # Update points (P is handled by completed matches, but needs update for remaining)
-            temp_standings[h_team]['P'] += 1
-            temp_standings[a_team]['P'] += 1
-            temp_standings[h_team]['Pts'] += h_pts
-            temp_standings[a_team]['Pts'] += a_pts
-        
-        # Convert to list and sort
-        round_result = sorted([{'Team': t, 'Pts': d['Pts'], 'Pos': 0} for t, d in temp_standings.items()], key=lambda x: x['Pts'], reverse=True)
-        for i, team_data in enumerate(round_result):
-            team_data['Pos'] = i + 1
-            
-        final_standings.append(round_result)
-
-    # Aggregate: Calculate average final rank for each team
-    rank_aggregation = {team: [] for team in teams}
-    for standings in final_standings:
-        for team_data in standings:
-            rank_aggregation[team_data['Team']].append(team_data['Pos'])
-            
+    with stage("season.fetch_data"):
+        season_df = load_current_season()
+    teams = sorted(set(season_df['HomeTeam']).union(set(season_df['AwayTeam'])))
+    team_idx = {team: i for i, team in enumerate(teams)}
+
+    # Points already banked from completed matches
+    completed_df = season_df.dropna(subset=['FTHG', 'FTAG'])
+    fthg, ftag = completed_df['FTHG'].to_numpy(), completed_df['FTAG'].to_numpy()
+    outcome = np.where(fthg > ftag, 0, np.where(fthg == ftag, 1, 2))
+    baseline = (
+        np.bincount(completed_df['HomeTeam'].map(team_idx).to_numpy(np.intp), weights=HOME_POINTS[outcome], minlength=len(teams))
+        + np.bincount(completed_df['AwayTeam'].map(team_idx).to_numpy(np.intp), weights=AWAY_POINTS[outcome], minlength=len(teams))
+    ).astype(np.int64)
+
+    # Every remaining fixture is predicted exactly once
+    fixtures = remaining_fixtures(season_df, teams)
+    home_idx = np.array([team_idx[h] for h, _ in fixtures], dtype=np.intp)
+    away_idx = np.array([team_idx[a] for _, a in fixtures], dtype=np.intp)
+    with stage("season.fixture_probabilities"):
+        probs = fixture_probabilities(ml_engine, fixtures)
+
+    with stage("season.simulate"):
+        counts = simulate_standings(baseline, home_idx, away_idx, probs, rounds, np.random.default_rng(seed))
+    position_probs = counts / rounds
+    positions = np.arange(1, len(teams) + 1)
+    fixtures_left = np.bincount(home_idx, minlength=len(teams)) + np.bincount(away_idx, minlength=len(teams))
+    expected_pts = baseline + (
+        np.bincount(home_idx, weights=probs @ HOME_POINTS, minlength=len(teams))
+        + np.bincount(away_idx, weights=probs @ AWAY_POINTS, minlength=len(teams))
+    )
+
     final_output = []
-    for team in teams:
-        avg_rank = np.mean(rank_aggregation[team])
-        final_output.append({'Team': team, 'Avg_Final_Rank': avg_rank, 'Rounds': rounds})
+    for i, team in enumerate(teams):
+        final_output.append({
+            'Team': team,
+            'Avg_Final_Rank': float(position_probs[i] @ positions),
+            'Rounds': rounds,
+            'Current_Pts': int(baseline[i]),
+            'Remaining_Fixtures': int(fixtures_left[i]),
+            'Expected_Pts': float(expected_pts[i]),
+            'Title_Odds': float(position_probs[i, 0]),
+            'Top4_Odds': float(position_probs[i, :4].sum()),
+            'Relegation_Odds': float(position_probs[i, -3:].sum()),
+            'Position_Probs': position_probs[i].tolist()
+        })
         
     return sorted(final_output, key=lambda x: x['Avg_Final_Rank'])
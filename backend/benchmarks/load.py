@@ -0,0 +1,104 @@
+"""Concurrent /predict load against a running server.
+
+Start the API with several workers (e.g. the Dockerfile's gunicorn command or
+`uvicorn app.main:app --workers 4`), then:
+
+    python -m benchmarks.load --url http://localhost:8000 --password <admin password>
+
+Requests are sent as the admin (no daily limit) from `--concurrency` threads.
+Reports throughput, latency percentiles and status codes; exits 1 if any request
+failed with a server error (e.g. "database is locked").
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import httpx
+
+FIXTURES = [
+    ("Arsenal", "Chelsea"), ("Liverpool", "Man City"), ("Tottenham", "Man United"),
+    ("Newcastle", "Aston Villa"), ("Brighton", "West Ham"), ("Everton", "Fulham"),
+]
+
+
+def run_load(url, token, requests=2000, concurrency=16, fixtures=FIXTURES, timeout=30.0):
+    """Sends `requests` POST /predict calls from `concurrency` threads.
+    Returns {"statuses": Counter, "latencies_s": [...], "elapsed_s": float, "errors": [...]}."""
+    statuses, latencies, errors = Counter(), [], []
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def worker():
+        with httpx.Client(base_url=url, headers=headers, timeout=timeout) as client:
+            while True:
+                with lock:
+                    i = next(remaining, None)
+                if i is None:
+                    return
+                home, away = fixtures[i % len(fixtures)]
+                start = time.perf_counter()
+                try:
+                    response = client.post("/predict", json={"home_team": home, "away_team": away})
+                    status, detail = response.status_code, response.text if response.status_code >= 500 else None
+                except httpx.HTTPError as e:
+                    status, detail = "error", repr(e)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    statuses[status] += 1
+                    latencies.append(elapsed)
+                    if detail:
+                        errors.append(detail)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"statuses": statuses, "latencies_s": latencies, "elapsed_s": time.perf_counter() - start, "errors": errors}
+
+
+def summarize(result):
+    latencies = sorted(result["latencies_s"])
+    n = len(latencies)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if n > 1 else (latencies or [0.0]) * 99
+    return {
+        "requests": n,
+        "rps": n / result["elapsed_s"] if result["elapsed_s"] else 0.0,
+        "p50_ms": quantiles[49] * 1e3,
+        "p95_ms": quantiles[94] * 1e3,
+        "p99_ms": quantiles[98] * 1e3,
+        "statuses": dict(result["statuses"]),
+        "server_errors": sum(v for k, v in result["statuses"].items() if k == "error" or k >= 500),
+    }
+
+
+def main(argv=None):
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", default=settings.ADMIN_EMAIL)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    response = httpx.post(f"{args.url}/token", data={"username": args.email, "password": args.password})
+    response.raise_for_status()
+    summary = summarize(run_load(args.url, response.json()["access_token"], args.requests, args.concurrency))
+    print(f"{summary['requests']} requests, {summary['rps']:.1f} req/s, "
+          f"p50 {summary['p50_ms']:.1f}ms p95 {summary['p95_ms']:.1f}ms p99 {summary['p99_ms']:.1f}ms")
+    print(f"statuses: {summary['statuses']}")
+    return 1 if summary["server_errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
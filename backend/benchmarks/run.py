@@ -0,0 +1,294 @@
+"""Benchmarks for the feature, training, prediction and simulation hot paths.
+
+Runs every case against synthetic history (see `synthetic.make_history`) with
+`fetch_data` stubbed out and all artifacts in a temp dir, then compares the
+timings with a stored JSON baseline:
+
+    python -m benchmarks.run --size small --save      # record benchmarks/baselines/small.json
+    python -m benchmarks.run --size small             # compare, exit 1 on a regression
+
+Baselines are machine specific; record one per machine (or CI runner type).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from unittest import mock
+
+# Keep the benchmark database and ML work local to this process
+_TMP_DIR = tempfile.mkdtemp(prefix="epl-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP_DIR, 'bench.db')}")
+os.environ.setdefault("ML_WORKERS", "0")
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from benchmarks.synthetic import make_history, write_csvs
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+SIZES = {
+    "small": {"rows": 10_000, "teams": 20},
+    "medium": {"rows": 100_000, "teams": 100},
+    "large": {"rows": 1_000_000, "teams": 200},
+}
+DEFAULT_THRESHOLD = 0.25  # fail when a median gets more than 25% slower
+CASES = [
+    "fetch_data", "calculate_elo", "get_recent_form", "prepare_features", "train",
+    "predict_proba", "predict_proba_cached", "build_matchups", "simulate_season", "simulate_standings",
+    "api_predict"
+]
+# Absolute budgets (median seconds) that fail the run whatever the baseline says
+TARGETS = {
+    "simulate_standings": 1.0,  # 100k rounds of a full 20-team, 380-fixture season
+}
+STANDINGS_ROUNDS = 100_000
+
+
+def measure(fn, repeat=5, number=1):
+    """Per-call seconds of `fn` over `repeat` timed batches of `number` calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {"median_s": statistics.median(times), "min_s": min(times), "repeat": repeat, "number": number}
+
+
+def _workspace(stack, df):
+    """Points the engine and simulator at `df` and a fresh artifact dir."""
+    from ml import engine
+    from app import utils
+
+    models_dir = tempfile.mkdtemp(dir=_TMP_DIR)
+    patches = {
+        "fetch_data": lambda: df.copy(),
+        "MODELS_DIR": models_dir,
+        "SHAP_DIR": models_dir,
+        "TEAM_STATE_PATH": os.path.join(models_dir, "team_state.pkl"),
+        "HISTORY_PATH": os.path.join(models_dir, "feature_history.pkl"),
+    }
+    for name, value in patches.items():
+        stack.enter_context(mock.patch.object(engine, name, value))
+    stack.enter_context(mock.patch.object(utils, "fetch_data", lambda: df.copy()))
+
+
+def run(rows, teams, cases=CASES, seed=0, season_rounds=1000):
+    """Times `cases` on `rows` synthetic matches between `teams` teams. Returns {case: timing}."""
+    from ml import feature_engineering
+    from ml.engine import MLEngine
+
+    df = make_history(rows, n_teams=teams, seed=seed)
+    results = {}
+    with ExitStack() as stack:
+        _workspace(stack, df)
+
+        if "fetch_data" in cases:
+            results["fetch_data"] = _fetch_data(stack, df)
+        if "calculate_elo" in cases:
+            results["calculate_elo"] = measure(lambda: feature_engineering.calculate_elo(df.copy()), repeat=3)
+        if "get_recent_form" in cases:
+            results["get_recent_form"] = measure(lambda: feature_engineering.get_recent_form(df), repeat=3)
+        if "prepare_features" in cases:
+            results["prepare_features"] = measure(lambda: feature_engineering.prepare_features(df.copy()), repeat=3)
+        if "simulate_standings" in cases:
+            results["simulate_standings"] = _simulate_standings(seed)
+
+        # Everything below needs a trained model; training is timed once, on a fresh snapshot
+        needs_model = {"train", "predict_proba", "predict_proba_cached", "build_matchups", "simulate_season", "api_predict"}
+        if not needs_model.intersection(cases):
+            return results
+        ml_engine = MLEngine(model_type="ensemble")
+        results_train = measure(ml_engine.train, repeat=1)
+        if "train" in cases:
+            results["train"] = results_train
+
+        rng = np.random.default_rng(seed)
+        names = ml_engine.team_state.teams
+        pairs = [tuple(rng.choice(names, 2, replace=False)) for _ in range(200)]
+        pair_iter = iter(pairs * 1000)
+
+        if "predict_proba" in cases:
+            def cold_predict():
+                ml_engine.prediction_cache.clear()
+                ml_engine.predict_proba(*next(pair_iter))
+            results["predict_proba"] = measure(cold_predict, repeat=5, number=200)
+        if "predict_proba_cached" in cases:
+            results["predict_proba_cached"] = measure(
+                lambda: ml_engine.predict_proba(*next(pair_iter)), repeat=5, number=1000
+            )
+        if "build_matchups" in cases:
+            results["build_matchups"] = measure(ml_engine.build_matchups, repeat=3)
+        if "simulate_season" in cases:
+            from app import utils
+            results["simulate_season"] = measure(
+                lambda: utils.simulate_season(ml_engine, rounds=season_rounds, seed=seed), repeat=3
+            )
+        if "api_predict" in cases:
+            results["api_predict"] = _api_predict(ml_engine, pairs)
+    return results
+
+
+def _simulate_standings(seed, n_teams=20, rounds=STANDINGS_ROUNDS):
+    """`simulate_standings` over a whole double round robin, independent of the model."""
+    from app import utils
+
+    rng = np.random.default_rng(seed)
+    home_idx, away_idx = np.nonzero(~np.eye(n_teams, dtype=bool))
+    probs = rng.dirichlet([4, 3, 3], len(home_idx))
+    baseline = np.zeros(n_teams, dtype=np.int64)
+    return measure(
+        lambda: utils.simulate_standings(baseline, home_idx, away_idx, probs, rounds, np.random.default_rng(seed)),
+        repeat=3
+    )
+
+
+def _fetch_data(stack, df):
+    """Cold `fetch_data` over `df` written as football-data CSVs, with its peak traced memory."""
+    from ml import data_fetch
+
+    data_dir = tempfile.mkdtemp(dir=_TMP_DIR)
+    cache_dir = os.path.join(data_dir, "cache")
+    patches = {
+        "DATA_DIR": data_dir, "CACHE_DIR": cache_dir, "META_PATH": os.path.join(data_dir, "meta.json"),
+        "URLS": write_csvs(df, data_dir), "_memo": {},
+    }
+    for name, value in patches.items():
+        stack.enter_context(mock.patch.object(data_fetch, name, value))
+
+    def cold_fetch():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        data_fetch._memo.clear()
+        return data_fetch.fetch_data(offline=True)
+
+    timing = measure(cold_fetch, repeat=3)
+    tracemalloc.start()
+    frame = cold_fetch()
+    timing["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    timing["frame_mb"] = frame.memory_usage(deep=True).sum() / 2 ** 20
+    return timing
+
+
+def _api_predict(ml_engine, pairs):
+    from fastapi.testclient import TestClient
+    from app import middleware, scheduler
+    from app.auth import create_access_token
+    from app.main import app
+
+    with TestClient(app) as client:  # runs the app's startup (tables, background writers)
+        scheduler.wait_loaded(timeout=60)
+        scheduler.engine_holder.swap(ml_engine)
+        client.post("/register", json={"email": "bench@example.com", "password": "bench"})
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'bench@example.com'})}"}
+        payloads = iter([{"home_team": h, "away_team": a} for h, a in pairs] * 100)
+
+        def predict():
+            response = client.post("/predict", json=next(payloads), headers=headers)
+            response.raise_for_status()
+
+        # Keep the per-user daily limit out of the way. Measured: auth, the rate limit
+        # check-and-increment and queueing the prediction log row; the DB writes of
+        # both happen later on background threads, outside the timed requests.
+        with mock.patch.object(middleware, "DAILY_LIMIT", 10 ** 9):
+            return measure(predict, repeat=5, number=50)
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Rows of (case, baseline s, current s, ratio, regressed) for cases present in both."""
+    rows = []
+    for case, timing in results.items():
+        base = baseline.get("results", {}).get(case)
+        if base is None:
+            continue
+        ratio = timing["median_s"] / base["median_s"]
+        rows.append((case, base["median_s"], timing["median_s"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def over_target(results, targets=TARGETS):
+    """Cases whose median exceeds their absolute budget in `targets`."""
+    return [case for case, timing in results.items() if case in targets and timing["median_s"] > targets[case]]
+
+
+def _report(results, baseline, threshold):
+    rows = compare(results, baseline, threshold) if baseline else []
+    compared = {row[0]: row for row in rows}
+    missed = over_target(results)
+    print(f"{'case':<22}{'median':>12}{'baseline':>12}{'ratio':>8}")
+    for case, timing in results.items():
+        line = f"{case:<22}{timing['median_s'] * 1e3:>10.3f}ms"
+        if case in compared:
+            _, base, _, ratio, regressed = compared[case]
+            line += f"{base * 1e3:>10.3f}ms{ratio:>8.2f}" + ("  REGRESSION" if regressed else "")
+        if case in missed:
+            line += f"  OVER TARGET ({TARGETS[case] * 1e3:.0f}ms)"
+        if "peak_mb" in timing:
+            line += f"  (peak {timing['peak_mb']:.1f} MB, frame {timing['frame_mb']:.1f} MB)"
+        print(line)
+    return [row[0] for row in rows if row[4]] + missed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--rows", type=int, help="override the number of matches for --size")
+    parser.add_argument("--teams", type=int, help="override the number of teams for --size")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated subset of: " + ", ".join(CASES))
+    parser.add_argument("--baseline", help="baseline JSON (default: benchmarks/baselines/<size>.json)")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown of a median before it counts as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    rows = args.rows or SIZES[args.size]["rows"]
+    teams = args.teams or SIZES[args.size]["teams"]
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"{args.size}.json")
+
+    results = run(rows, teams, cases=cases, seed=args.seed)
+    report = {
+        "meta": {
+            "size": args.size, "rows": rows, "teams": teams, "seed": args.seed,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.machine(), "platform": platform.platform()
+        },
+        "results": results
+    }
+
+    baseline = None
+    if not args.save and os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if (baseline["meta"]["rows"], baseline["meta"]["teams"]) != (rows, teams):
+            print(f"Baseline {baseline_path} was recorded for a different data size; not comparing.")
+            baseline = None
+
+    regressions = _report(results, baseline, args.threshold)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+    if regressions:
+        print(f"Regressions over {args.threshold:.0%} or over target: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+ROUNDS_PER_SEASON = 38
+DIVISION_SIZE = 20
+# Keep synthetic dates inside pandas' Timestamp range however many rounds are asked for
+MAX_SPAN = pd.Timedelta(days=250 * 365)
+
+
+def make_history(n_rows, n_teams=20, seed=0, start="1990-08-04"):
+    """Synthetic multi-season results in the layout returned by `fetch_data`.
+
+    Teams are split into divisions of up to DIVISION_SIZE that each play one
+    randomly paired round per matchday, ROUNDS_PER_SEASON rounds per season.
+    Goals and shots are Poisson draws around fixed team strengths, so ratings and
+    form behave like real data. `raw_source` names a file per season and
+    division (e.g. "S0003_D1.csv"), like football-data's season files.
+    """
+    rng = np.random.default_rng(seed)
+    teams = np.array([f"Team{i:03d}" for i in range(n_teams)])
+    strength = rng.normal(0, 0.3, n_teams)
+
+    divisions = np.array_split(rng.permutation(n_teams), max(1, n_teams // DIVISION_SIZE))
+    per_round = sum(len(d) // 2 for d in divisions)
+    n_rounds = -(-n_rows // per_round)
+
+    home, away, division = [], [], []
+    for d, members in enumerate(divisions):
+        pairs = len(members) // 2
+        order = rng.permuted(np.tile(members, (n_rounds, 1)), axis=1)[:, :2 * pairs]
+        home.append(order[:, 0::2])
+        away.append(order[:, 1::2])
+        division.append(np.full((n_rounds, pairs), d))
+    # Row-major over (round, match) so rows come out in date order
+    home = np.concatenate(home, axis=1).ravel()[:n_rows]
+    away = np.concatenate(away, axis=1).ravel()[:n_rows]
+    division = np.concatenate(division, axis=1).ravel()[:n_rows]
+    round_idx = np.repeat(np.arange(n_rounds), per_round)[:n_rows]
+
+    spacing = min(pd.Timedelta(days=7), MAX_SPAN / max(n_rounds, 1))
+    dates = pd.Timestamp(start) + spacing * round_idx
+    season = round_idx // ROUNDS_PER_SEASON
+
+    diff = strength[home] - strength[away]
+    fthg = rng.poisson(np.exp(0.3 + diff))
+    ftag = rng.poisson(np.exp(0.1 - diff))
+    hs = fthg + rng.poisson(np.exp(2.3 + diff))
+    as_ = ftag + rng.poisson(np.exp(2.1 - diff))
+
+    return pd.DataFrame({
+        'Date': dates,
+        'HomeTeam': teams[home],
+        'AwayTeam': teams[away],
+        'FTHG': fthg,
+        'FTAG': ftag,
+        'FTR': np.where(fthg > ftag, 'H', np.where(fthg == ftag, 'D', 'A')),
+        'HS': hs,
+        'AS': as_,
+        'HST': fthg + rng.binomial(hs - fthg, 0.25),
+        'AST': ftag + rng.binomial(as_ - ftag, 0.25),
+        'raw_source': [f"S{s:04d}_D{d + 1}.csv" for s, d in zip(season, division)]
+    })
+
+
+def write_csvs(df, directory, odds_columns=60, seed=0):
+    """Writes `df` as football-data.co.uk style CSVs, one per `raw_source`, into `directory`.
+
+    Files carry the same kind of extra columns as the real ones (half-time
+    score, referee, cards, `odds_columns` bookmaker odds) and dd/mm/yyyy dates.
+    Returns URLs whose `data_fetch` file names match the written files.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(df)
+    extra = {
+        'Time': np.full(n, "15:00"),
+        'HTHG': rng.binomial(df['FTHG'], 0.45), 'HTAG': rng.binomial(df['FTAG'], 0.45),
+        'HTR': df['FTR'].to_numpy(),
+        'Referee': rng.choice([f"Referee {i}" for i in range(40)], n),
+        'HF': rng.poisson(11, n), 'AF': rng.poisson(11, n), 'HC': rng.poisson(5, n), 'AC': rng.poisson(4, n),
+        'HY': rng.poisson(2, n), 'AY': rng.poisson(2, n), 'HR': rng.poisson(0.1, n), 'AR': rng.poisson(0.1, n),
+    }
+    for i in range(odds_columns):
+        extra[f"Odds{i // 3}{'HDA'[i % 3]}"] = np.round(rng.uniform(1.1, 12.0, n), 2)
+
+    out = df.assign(Div=df['raw_source'].str.extract(r"_(D\d+)\.csv$", expand=False),
+                    Date=df['Date'].dt.strftime("%d/%m/%Y"), **extra)
+    columns = ['Div', 'Date', 'Time', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'FTR', 'HTHG', 'HTAG', 'HTR',
+               'Referee', 'HS', 'AS', 'HST', 'AST'] + list(extra)[5:]
+    columns = list(dict.fromkeys(columns))
+    urls = []
+    for source, part in out.groupby('raw_source', sort=True):
+        part[columns].to_csv(f"{directory}/{source}", index=False)
+        season, division = source[:-len(".csv")].split("_")
+        urls.append(f"https://synthetic.invalid/mmz4281/{season}/{division}.csv")
+    return urls
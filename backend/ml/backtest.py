@@ -0,0 +1,177 @@
+"""Walk-forward backtesting of the engine's model types.
+
+Features are built once over the whole history with `prepare_features` (every
+feature only looks at earlier matches) and sliced per fold: a fold trains on all
+matches before a matchday (calendar week) or month boundary and predicts the
+matches up to the next boundary. Folds x model types run in a process pool;
+each worker receives the feature matrix once, when it starts.
+"""
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.metrics import log_loss
+
+from .data_fetch import fetch_data
+from .engine import fit_model, model_proba
+from .feature_engineering import prepare_features
+from .team_state import FEATURE_COLS
+
+MODEL_TYPES = ("logreg", "rf", "xgb", "ensemble")
+FREQS = {"matchday": "W", "month": "M"}
+LABELS = [0, 1, 2]  # Home, Draw, Away
+CALIBRATION_BINS = 10
+
+_shared = {}  # "X", "y" of the process (set once per worker)
+
+
+def fold_bounds(dates, freq="month", warmup_days=365):
+    """(start, end) row ranges of the test blocks for date-sorted `dates`.
+
+    Rows before `start` train the fold's model. Blocks start once `warmup_days`
+    of history are available.
+    """
+    if freq not in FREQS:
+        raise ValueError(f"Unknown backtest frequency: {freq}")
+    dates = pd.DatetimeIndex(dates)
+    if len(dates) == 0:
+        return []
+    periods = dates.to_period(FREQS[freq]).asi8
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    ends = np.r_[starts[1:], len(dates)]
+    first_test = dates[0] + pd.Timedelta(days=warmup_days)
+    return [(int(s), int(e)) for s, e in zip(starts, ends) if dates[s] >= first_test]
+
+
+def season_labels(dates):
+    """Football season of each date, e.g. "2023/24" (seasons start in July)."""
+    dates = pd.DatetimeIndex(dates)
+    start = dates.year - (dates.month < 7)
+    return [f"{y}/{(y + 1) % 100:02d}" for y in start]
+
+
+def score(y, probs):
+    """Log loss, accuracy and multi-class Brier score of `probs` for outcomes `y`."""
+    onehot = np.eye(len(LABELS))[y]
+    return {
+        "n": int(len(y)),
+        "log_loss": float(log_loss(y, probs, labels=LABELS)),
+        "accuracy": float(np.mean(probs.argmax(axis=1) == y)),
+        "brier": float(np.mean(np.sum((probs - onehot) ** 2, axis=1))),
+    }
+
+
+def calibration(y, probs, bins=CALIBRATION_BINS):
+    """Reliability table over all three outcomes (one-vs-rest) and its expected calibration error."""
+    predicted = probs.ravel()
+    observed = np.eye(len(LABELS))[y].ravel()
+    idx = np.minimum((predicted * bins).astype(int), bins - 1)
+    counts = np.bincount(idx, minlength=bins)
+    sum_predicted = np.bincount(idx, weights=predicted, minlength=bins)
+    sum_observed = np.bincount(idx, weights=observed, minlength=bins)
+    table = [
+        {
+            "bin": f"{i / bins:.1f}-{(i + 1) / bins:.1f}",
+            "n": int(counts[i]),
+            "mean_predicted": float(sum_predicted[i] / counts[i]),
+            "observed": float(sum_observed[i] / counts[i]),
+        }
+        for i in range(bins) if counts[i]
+    ]
+    ece = float(np.abs(sum_predicted - sum_observed).sum() / len(predicted))
+    return table, ece
+
+
+def _init_worker(X, y):
+    _shared["X"], _shared["y"] = X, y
+
+
+def _fit_predict(model_type, start, end, n_jobs=None):
+    """Trains `model_type` on rows [0, start) and predicts rows [start, end)."""
+    X, y = _shared["X"], _shared["y"]
+    if len(np.unique(y[:start])) < len(LABELS):
+        return None  # every outcome has to be seen before probabilities make sense
+    with warnings.catch_warnings():
+        # The engine's logistic regression stops at max_iter on raw Elo values; that is the model being tested
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        model = fit_model(model_type, X[:start], y[:start], n_jobs=n_jobs)
+    probs = np.asarray(model_proba(model, X[start:end]), dtype=np.float64)
+    return probs / probs.sum(axis=1, keepdims=True)  # XGBoost's float32 rows are off by ~1e-7
+
+
+def _run_folds(tasks, X, y, processes):
+    if processes <= 1:
+        _init_worker(X, y)
+        try:
+            return [_fit_predict(*task) for task in tasks]
+        finally:
+            _shared.clear()
+
+    # Longest folds first so no worker is left with a big one at the end
+    order = sorted(range(len(tasks)), key=lambda i: -tasks[i][1])
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=ctx,
+                             initializer=_init_worker, initargs=(X, y)) as pool:
+        # One thread per model; the parallelism is across folds
+        futures = {i: pool.submit(_fit_predict, *tasks[i], 1) for i in order}
+        return [futures[i].result() for i in range(len(tasks))]
+
+
+def backtest(df=None, model_types=MODEL_TYPES, freq="month", warmup_days=365, processes=None):
+    """Walk-forward backtest of each model type over the history in `df` (default: `fetch_data()`).
+
+    Returns {"config", "models": {model_type: {"overall", "calibration", "seasons"}}, "folds"}.
+    """
+    raw = fetch_data() if df is None else df.copy()
+    features, _ = prepare_features(raw)
+    features = features.dropna(subset=["Date", "Target"]).sort_values("Date", kind="stable").reset_index(drop=True)
+    X = np.ascontiguousarray(features[FEATURE_COLS].to_numpy(dtype=np.float64))
+    y = features["Target"].to_numpy(dtype=np.int64)
+    seasons = np.array(season_labels(features["Date"]))
+
+    bounds = fold_bounds(features["Date"], freq=freq, warmup_days=warmup_days)
+    tasks = [(model_type, start, end) for start, end in bounds for model_type in model_types]
+    processes = min(processes or os.cpu_count() or 1, max(len(tasks), 1))
+    outputs = _run_folds(tasks, X, y, processes)
+
+    predictions = {model_type: np.full((len(y), len(LABELS)), np.nan) for model_type in model_types}
+    folds = []
+    for (model_type, start, end), probs in zip(tasks, outputs):
+        if probs is None:
+            continue
+        predictions[model_type][start:end] = probs
+        folds.append({
+            "model_type": model_type,
+            "train_rows": start,
+            "test_start": features["Date"].iloc[start].date().isoformat(),
+            "test_end": features["Date"].iloc[end - 1].date().isoformat(),
+            **score(y[start:end], probs),
+        })
+
+    models = {}
+    for model_type, probs in predictions.items():
+        covered = ~np.isnan(probs[:, 0])
+        if not covered.any():
+            continue
+        table, ece = calibration(y[covered], probs[covered])
+        models[model_type] = {
+            "overall": {**score(y[covered], probs[covered]), "ece": ece},
+            "calibration": table,
+            "seasons": {
+                season: score(y[covered & (seasons == season)], probs[covered & (seasons == season)])
+                for season in sorted(set(seasons[covered]))
+            },
+        }
+
+    return {
+        "config": {
+            "freq": freq, "warmup_days": warmup_days, "processes": processes,
+            "rows": int(len(y)), "folds": len(bounds), "model_types": list(model_types),
+        },
+        "models": models,
+        "folds": folds,
+    }
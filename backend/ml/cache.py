@@ -0,0 +1,10 @@
+from common.cache import TTLCache
+
+
+class PredictionCache(TTLCache):
+    """LRU/TTL cache of engine predictions.
+
+    Keys should carry everything a prediction depends on (model artifact hash,
+    data snapshot version, teams) so stale entries can never be served; `clear`
+    is still called on retrain/refresh to free memory right away.
+    """
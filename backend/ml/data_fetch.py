@@ -1,46 +1,252 @@
 import requests
 import pandas as pd
+import hashlib
+import json
 import os
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+META_PATH = os.path.join(DATA_DIR, "fetch_meta.json")
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# Sources: current season and last 2 seasons for history
-URLS = [
-    "https://www.football-data.co.uk/mmz4281/2324/E0.csv",
-    "https://www.football-data.co.uk/mmz4281/2223/E0.csv",
-    "https://www.football-data.co.uk/mmz4281/2122/E0.csv",
-    "https://www.football-data.co.uk/mmz4281/2425/E0.csv"]
+# Sources: every season x division file (football-data.co.uk season codes and
+# division ids, e.g. DATA_SEASONS=1920,2021,... DATA_DIVISIONS=E0,E1). The first
+# division is the one the season simulation runs on.
+BASE_URL = "https://www.football-data.co.uk/mmz4281"
+SEASONS = os.getenv("DATA_SEASONS", "2122,2223,2324,2425").split(",")
+DIVISIONS = os.getenv("DATA_DIVISIONS", "E0").split(",")
+URLS = [f"{BASE_URL}/{season}/{division}.csv" for season in SEASONS for division in DIVISIONS]
+
+# Columns kept from the CSVs (everything else, e.g. odds and referees, is never
+# parsed) and their dtypes in the combined frame. Both team columns share one
+# categorical, whose codes double as team ids.
+RESULT_DTYPE = pd.CategoricalDtype(['H', 'D', 'A'])
+COLUMNS = {
+    'Div': 'category', 'Date': 'datetime64[ns]', 'HomeTeam': 'category', 'AwayTeam': 'category',
+    'FTHG': 'int8', 'FTAG': 'int8', 'FTR': RESULT_DTYPE,
+    'HS': 'float32', 'AS': 'float32', 'HST': 'float32', 'AST': 'float32',
+    'Home_xG': 'float32', 'Away_xG': 'float32',
+}
+TEAM_COLUMNS = ['HomeTeam', 'AwayTeam']
+REQUIRED_COLUMNS = ['Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG']
+DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%y")  # older seasons use two-digit years
+PARSE_VERSION = 3  # bump when the parsed layout changes, invalidates the parse cache
+
+REQUEST_TIMEOUT = 10  # seconds per download
+MAX_WORKERS = 4
+# Skip the upstream check entirely if every file was checked this recently
+CHECK_INTERVAL = int(os.getenv("DATA_CHECK_INTERVAL", "300"))
+# Only read what is already on disk (no network at all)
+OFFLINE = os.getenv("DATA_OFFLINE", "0") == "1"
+
+_lock = threading.Lock()
+_memo = {}  # tuple of file hashes -> combined, cleaned frame
+# url -> last upstream check by this process. A 304 changes nothing worth
+# persisting, so its check time is only remembered here.
+_checked = {}
+
+
+def _filename(url):
+    return url.split("/")[-2] + "_" + url.split("/")[-1]
+
+
+def _load_meta():
+    try:
+        with open(META_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _persisted(meta):
+    # Everything in the meta file except check times
+    return {url: {k: v for k, v in entry.items() if k != "checked_at"} for url, entry in meta.items()}
+
+
+def _save_meta(meta):
+    tmp = META_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, META_PATH)
+
+
+def _download(url, entry):
+    """Conditional GET. Returns the updated meta entry for `url`."""
+    path = os.path.join(DATA_DIR, _filename(url))
+    headers = {}
+    if os.path.exists(path):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    entry = dict(entry)
+    try:
+        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(response.content)
+            os.replace(tmp, path)
+            entry["etag"] = response.headers.get("ETag")
+            entry["last_modified"] = response.headers.get("Last-Modified")
+        # 304 Not Modified: the local copy is current
+        entry["checked_at"] = time.time()
+    except Exception as e:
+        print(f"Error fetching {url}: {e}")
+    return entry
+
+
+def _file_hash(path, entry):
+    stat = os.stat(path)
+    if entry.get("sha1") and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+        return entry["sha1"]
+    with open(path, "rb") as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    entry.update(sha1=sha1, size=stat.st_size, mtime=stat.st_mtime)
+    return sha1
+
+
+def _parse_dates(values):
+    dates = pd.to_datetime(values, format=DATE_FORMATS[0], errors='coerce')
+    for fmt in DATE_FORMATS[1:]:
+        missing = dates.isna() & values.notna()
+        if not missing.any():
+            break
+        dates[missing] = pd.to_datetime(values[missing], format=fmt, errors='coerce')
+    return dates
+
+
+def _read(path):
+    """The COLUMNS of one CSV as read; types are fixed once for all files in `_compact`."""
+    df = pd.read_csv(path, encoding="unicode_escape", usecols=lambda c: c in COLUMNS)
+    df['raw_source'] = os.path.basename(path)
+    return df
+
+
+def _compact(df):
+    """Drops incomplete rows and converts the combined frame to COLUMNS dtypes, one column at a time."""
+    df = df.dropna(subset=REQUIRED_COLUMNS).reset_index(drop=True)
+    df['Date'] = _parse_dates(df['Date'].astype(str))
+    df = df.dropna(subset=['Date'])
+    return compact_types(fill_results(df)).sort_values('Date', ignore_index=True)
+
+
+def fill_results(df):
+    """Derives a missing FTR from the goals, so every match with a score has a
+    result. Returns `df` itself when nothing is missing."""
+    missing = df['FTR'].isna() if 'FTR' in df else pd.Series(True, index=df.index)
+    if not missing.any():
+        return df
+    home, away = df['FTHG'][missing], df['FTAG'][missing]
+    derived = pd.Series('D', index=home.index).mask(home > away, 'H').mask(home < away, 'A')
+    df = df.copy()
+    if 'FTR' in df:
+        df['FTR'] = df['FTR'].astype(object).where(~missing, derived).astype(df['FTR'].dtype)
+    else:
+        df['FTR'] = derived
+    return df
+
+
+def compact_types(df):
+    """Converts the columns of a match frame with parsed dates to COLUMNS dtypes (in place)."""
+    teams = pd.Index(pd.concat([df[col] for col in TEAM_COLUMNS]).unique()).sort_values()
+    for col in TEAM_COLUMNS:
+        df[col] = pd.Categorical(df[col], categories=teams)
+    for col in df.columns:
+        dtype = COLUMNS.get(col, 'category' if col == 'raw_source' else None)
+        if col not in TEAM_COLUMNS and dtype is not None and df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def _cache_path(key):
+    digest = hashlib.sha1(json.dumps([PARSE_VERSION, list(key)]).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"history.{digest}.pkl")
+
+
+def _load_history(hashes):
+    """Combined compact frame of the local CSVs, cached on disk by their content
+    hashes. Returns (frame, complete); an incomplete frame (a file failed to
+    parse) is not cached, so the next call tries that file again."""
+    cache_path = _cache_path(hashes.values())
+    if os.path.exists(cache_path):
+        return pd.read_pickle(cache_path), True
 
-def fetch_data():
     dfs = []
-    for url in URLS:
+    for url in hashes:
         try:
-            filename = url.split("/")[-2] + "_" + url.split("/")[-1]
-            path = os.path.join(DATA_DIR, filename)
-            
-            # Always download fresh
-            response = requests.get(url)
-            if response.status_code == 200:
-                with open(path, "wb") as f:
-                    f.write(response.content)
-            
-            if os.path.exists(path):
-                df = pd.read_csv(path, encoding="unicode_escape")
-                # Basic cleanup
-                df = df.dropna(subset=['Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG'])
-                dfs.append(df)
+            dfs.append(_read(os.path.join(DATA_DIR, _filename(url))))
         except Exception as e:
-            print(f"Error fetching {url}: {e}")
-    
+            print(f"Error parsing {url}: {e}")
     if not dfs:
-        return pd.DataFrame()
-    
-    full_df = pd.concat(dfs, ignore_index=True)
-    
-    # Standardize Date
-    full_df['Date'] = pd.to_datetime(full_df['Date'], dayfirst=True, errors='coerce')
-    full_df = full_df.sort_values('Date').reset_index(drop=True)
-    
-    return full_df
+        return pd.DataFrame(), False
+    df = _compact(pd.concat(dfs, ignore_index=True))
+    if len(dfs) < len(hashes):
+        return df, False
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp)
+    os.replace(tmp, cache_path)
+    # Drop parses of older versions of the files
+    for old in os.listdir(CACHE_DIR):
+        if os.path.join(CACHE_DIR, old) != cache_path and not old.endswith(".tmp"):
+            os.remove(os.path.join(CACHE_DIR, old))
+    return df, True
+
+
+def refresh_files(offline=None):
+    """Brings the local CSVs up to date. Returns {url: sha1} of the files available locally."""
+    offline = OFFLINE if offline is None else offline
+    with _lock:
+        meta = _load_meta()
+        saved = _persisted(meta)
+        now = time.time()
+        stale = [
+            url for url in URLS
+            if now - max(meta.get(url, {}).get("checked_at", 0), _checked.get(url, 0)) >= CHECK_INTERVAL
+        ]
+        if stale and not offline:
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(stale))) as pool:
+                for url, entry in zip(stale, pool.map(lambda u: _download(u, meta.get(u, {})), stale)):
+                    _checked[url] = entry.get("checked_at", 0)
+                    meta[url] = entry
+
+        hashes = {}
+        for url in URLS:
+            path = os.path.join(DATA_DIR, _filename(url))
+            if os.path.exists(path):
+                entry = meta.setdefault(url, {})
+                hashes[url] = _file_hash(path, entry)
+        # Only rewritten when a file or its ETag/Last-Modified changed
+        if _persisted(meta) != saved:
+            _save_meta(meta)
+    return hashes
+
+
+def fetch_data(offline=None):
+    """All seasons in `URLS` as one frame sorted by date.
+
+    Files are re-downloaded only when upstream reports a change (ETag /
+    Last-Modified), and the CSVs are parsed into one compact frame (see
+    COLUMNS) once per set of file contents. When nothing changed, a call costs
+    a dict lookup plus a copy of that frame. With `offline=True` (or
+    DATA_OFFLINE=1) only local files are read.
+    """
+    hashes = refresh_files(offline=offline)
+    key = tuple(hashes.get(url) for url in URLS)
+
+    full_df = _memo.get(key)
+    if full_df is None:
+        full_df, complete = _load_history(hashes)
+        if full_df.empty or not complete:
+            return full_df
+        _memo.clear()
+        _memo[key] = full_df
+
+    # Callers add feature columns in place, never hand out the memoized frame
+    return full_df.copy()
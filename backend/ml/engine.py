@@ -1,138 +1,451 @@
 import pandas as pd
 import numpy as np
 import joblib
-import shap
-import matplotlib.pyplot as plt
-from sklearn.ensemble import RandomForestClassifier
-from xgboost import XGBClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import TimeSeriesSplit, cross_val_score
-from sklearn.metrics import log_loss, accuracy_score
 from .data_fetch import fetch_data
 from .feature_engineering import prepare_features
+from .team_state import TeamState, FEATURE_COLS
+from .cache import PredictionCache
+from .registry import ModelRegistry
+from .fast_inference import CompiledModel
+from .matchups import Matchups
+from .metrics import stage
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import hashlib
 import os
-import uuid
+import threading
+import time
 
 MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models_store")
 SHAP_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "reports", "shap")
+TEAM_STATE_PATH = os.path.join(MODELS_DIR, "team_state.pkl")
+HISTORY_PATH = os.path.join(MODELS_DIR, "feature_history.pkl")
+HISTORY_COLS = ['Date', 'HomeTeam', 'AwayTeam'] + FEATURE_COLS + ['Target']
 os.makedirs(MODELS_DIR, exist_ok=True)
 os.makedirs(SHAP_DIR, exist_ok=True)
 
+# SHAP plot retention: oldest files beyond the count, and files past the age, are deleted
+SHAP_MAX_FILES = int(os.getenv("SHAP_MAX_FILES", "500"))
+SHAP_MAX_AGE = int(os.getenv("SHAP_MAX_AGE", str(7 * 24 * 3600)))
+EXPLAIN_CACHE_SIZE = 1024
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL = int(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+# Registry versions kept after a retrain: the promoted one and what rollback returns
+# to. Every version is committed by the daily retrain job, so the rest are deleted
+# (0 keeps all).
+REGISTRY_KEEP_VERSIONS = int(os.getenv("REGISTRY_KEEP_VERSIONS", "2"))
+# Serve predictions from flat NumPy copies of the models instead of sklearn/XGBoost calls
+FAST_INFERENCE = os.getenv("FAST_INFERENCE", "1") == "1"
+
+# pyplot is not thread-safe, so all plots are rendered by one background thread
+_render_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shap-render")
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def artifact_version(model_type):
+    """What is on disk for `model_type`: (promoted registry version, team snapshot
+    file stamp). Changes whenever any process trains, promotes, rolls back or
+    refreshes the data, so serving processes can tell their engine is stale."""
+    try:
+        stat = os.stat(TEAM_STATE_PATH)
+        snapshot = f"{stat.st_mtime_ns}:{stat.st_size}"
+    except FileNotFoundError:
+        snapshot = None
+    return ModelRegistry(os.path.join(MODELS_DIR, "registry", model_type)).current(), snapshot
+
+def prune_shap_dir(max_files=None, max_age=None):
+    """Evicts SHAP plots by age, then the oldest ones above the file budget."""
+    max_files = SHAP_MAX_FILES if max_files is None else max_files
+    max_age = SHAP_MAX_AGE if max_age is None else max_age
+    entries = []
+    for name in os.listdir(SHAP_DIR):
+        if name.endswith(".png"):
+            path = os.path.join(SHAP_DIR, name)
+            entries.append((os.path.getmtime(path), path))
+    entries.sort(reverse=True)
+
+    now = time.time()
+    for i, (mtime, path) in enumerate(entries):
+        if i >= max_files or now - mtime > max_age:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def _render_shap_plot(sv, input_data, path):
+    # shap and matplotlib take seconds to import, so only explain requests pay for them
+    import matplotlib.pyplot as plt
+    import shap
+
+    tmp = path + ".tmp"
+    try:
+        plt.figure()
+        shap.summary_plot(sv, input_data, show=False, plot_type="bar")
+        plt.savefig(tmp, bbox_inches='tight', format="png")
+    finally:
+        plt.close()
+    os.replace(tmp, path)
+    prune_shap_dir()
+
+def make_model(model_type, n_jobs=None):
+    """Unfitted model for `model_type`; the ensemble is a dict of all three."""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from xgboost import XGBClassifier
+
+    # Simple Optuna integration placeholder (hardcoded best params for brevity)
+    if model_type == "xgb":
+        return XGBClassifier(n_estimators=100, max_depth=3, learning_rate=0.1, n_jobs=n_jobs)
+    if model_type == "rf":
+        return RandomForestClassifier(n_estimators=100, max_depth=5, n_jobs=n_jobs)
+    if model_type == "logreg":
+        return LogisticRegression(max_iter=1000)
+    # Simplified Ensemble: Train all 3 and average them
+    return {
+        "xgb": XGBClassifier(n_estimators=100, max_depth=3, n_jobs=n_jobs),
+        "rf": RandomForestClassifier(n_estimators=100, max_depth=5, n_jobs=n_jobs),
+        "lr": LogisticRegression(max_iter=1000)
+    }
+
+def fit_model(model_type, X, y, n_jobs=None):
+    model = make_model(model_type, n_jobs=n_jobs)
+    for member in (model.values() if isinstance(model, dict) else [model]):
+        member.fit(X, y)
+    return model
+
+def model_proba(model, X):
+    """(n_rows, 3) Home/Draw/Away probabilities from a model made by `make_model`."""
+    if isinstance(model, dict):
+        return (model['xgb'].predict_proba(X) + model['rf'].predict_proba(X) + model['lr'].predict_proba(X)) / 3
+    return model.predict_proba(X)
+
+
 class MLEngine:
     def __init__(self, model_type="ensemble"):
         self.model_type = model_type
         self.model = None
         self.feature_cols = None
+        self.team_state = None
+        self.model_version = None
+        self.compiled = None
+        self.matchups = None
+        self.disk_version = None  # artifact_version() the loaded artifacts were read at
+        self.warmed = False
+        self._explainer = None
+        self._explanations = OrderedDict()  # (model_version, feature vector) -> explanation
+        self._pending_plots = set()
+        self._explain_lock = threading.Lock()
+        self.prediction_cache = PredictionCache(maxsize=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
         self.load_model()
 
-    def train(self):
-        raw_df = fetch_data()
-        df, features = prepare_features(raw_df)
+    def train(self, raw_df=None):
+        """Fits the model on `raw_df` (default: `fetch_data()`), saves and promotes it."""
+        with stage("engine.fetch_data"):
+            raw_df = fetch_data() if raw_df is None else raw_df
+        with stage("engine.sync_history"):
+            df = self._sync_history(raw_df)
+        features = list(FEATURE_COLS)
         self.feature_cols = features
         
         X = df[features]
         y = df['Target']
         
-        # Simple Optuna integration placeholder (hardcoded best params for brevity)
-        if self.model_type == "xgb":
-            clf = XGBClassifier(n_estimators=100, max_depth=3, learning_rate=0.1)
-        elif self.model_type == "rf":
-            clf = RandomForestClassifier(n_estimators=100, max_depth=5)
-        elif self.model_type == "logreg":
-            clf = LogisticRegression(max_iter=1000)
-        else: # Ensemble
-            # Simplified Ensemble: Train all 3 and store in a dict
-            clf = {
-                "xgb": XGBClassifier(n_estimators=100, max_depth=3).fit(X, y),
-                "rf": RandomForestClassifier(n_estimators=100, max_depth=5).fit(X, y),
-                "lr": LogisticRegression(max_iter=1000).fit(X, y)
-            }
-        
-        if self.model_type != "ensemble":
-            clf.fit(X, y)
+        with stage("engine.fit"):
+            self.model = fit_model(self.model_type, X, y)
         
-        self.model = clf
+        # Save a new registry version and serve it
+        metrics = {"rows": len(df)}
+        registry = self.registry()
+        with stage("engine.save_model"):
+            version = registry.save(self.model_type, self.model, self.feature_cols,
+                                    metrics=metrics, data_snapshot=self.team_state.version)
+            registry.promote(version)
+            if REGISTRY_KEEP_VERSIONS > 0:
+                registry.prune(keep=REGISTRY_KEEP_VERSIONS)
+        self._set_model_version(version)
+        self._load_matchups()
+        self.disk_version = artifact_version(self.model_type)
         
-        # Save artifacts
-        joblib.dump(self.model, os.path.join(MODELS_DIR, f"{self.model_type}_model.pkl"))
-        joblib.dump(self.feature_cols, os.path.join(MODELS_DIR, "features.pkl"))
-        
-        return {"status": "trained", "rows": len(df)}
+        return {"status": "trained", "version": version, **metrics}
+
+    def registry(self):
+        return ModelRegistry(os.path.join(MODELS_DIR, "registry", self.model_type))
 
-    def load_model(self):
+    def is_stale(self):
+        """True if another process changed the promoted model or team snapshot since this engine loaded."""
+        return self.disk_version != artifact_version(self.model_type)
+
+    def load_model(self, version=None):
+        """Loads the promoted (or given) registry version plus the team snapshot."""
+        # Read first: a change while loading then shows up as stale on the next check
+        self.disk_version = artifact_version(self.model_type)
         try:
-            self.model = joblib.load(os.path.join(MODELS_DIR, f"{self.model_type}_model.pkl"))
-            self.feature_cols = joblib.load(os.path.join(MODELS_DIR, "features.pkl"))
-        except:
+            model, manifest = self.registry().load(version)
+            self.model = model
+            self.feature_cols = manifest["feature_cols"]
+            self._set_model_version(manifest["version"])
+        except FileNotFoundError:
+            self._load_legacy_model()
+        if os.path.exists(TEAM_STATE_PATH):
+            self.team_state = TeamState.load(TEAM_STATE_PATH)
+        self._load_matchups()
+
+    def _load_legacy_model(self):
+        # Artifacts written before the registry existed
+        model_path = os.path.join(MODELS_DIR, f"{self.model_type}_model.pkl")
+        if not os.path.exists(model_path):
             print("Model not found. Train first.")
+            return
+        self.model = joblib.load(model_path)
+        self.feature_cols = joblib.load(os.path.join(MODELS_DIR, "features.pkl"))
+        self._set_model_version(_file_hash(model_path))
+
+    def _set_model_version(self, version):
+        # A new model invalidates the compiled copy, the explainer and every cached explanation
+        self.compiled = CompiledModel.compile(self.model, len(self.feature_cols)) if FAST_INFERENCE else None
+        with self._explain_lock:
+            self.model_version = version
+            self._explainer = None
+            self._explanations.clear()
+        self.prediction_cache.clear()
+
+    def refresh_team_state(self, raw_df=None):
+        """Brings the team snapshot up to date with fresh data (default: `fetch_data()`) without retraining the model."""
+        with stage("engine.fetch_data"):
+            raw_df = fetch_data() if raw_df is None else raw_df
+        with stage("engine.sync_history"):
+            history = self._sync_history(raw_df)
+        self._load_matchups()
+        self.disk_version = artifact_version(self.model_type)
+        return {"status": "refreshed", "matches": len(history), "teams": len(self.team_state.ratings)}
+
+    def _sync_history(self, raw_df):
+        """Updates the persisted team state and feature history with matches in `raw_df`.
+
+        Only matches that were not applied before are processed, so a daily refresh
+        costs O(new matches). The full `prepare_features` recompute runs on first use
+        or when older history changed.
+        """
+        history = pd.read_pickle(HISTORY_PATH) if os.path.exists(HISTORY_PATH) else None
+        state = copy.deepcopy(self.team_state) if self.team_state is not None else None
+
+        new_rows = state.new_matches(raw_df) if state is not None else None
+        if history is not None and state is not None and state.can_append(new_rows):
+            new_history = state.update(new_rows)[HISTORY_COLS]
+            if not new_history.empty:
+                history = pd.concat([history, new_history], ignore_index=True)
+        else:
+            df, _ = prepare_features(raw_df)
+            history = df[HISTORY_COLS].reset_index(drop=True)
+            state = TeamState.from_history(raw_df)
+
+        # Written to a temp file and renamed, so the explainer and other processes
+        # never read a partial file; the thread id keeps a refresh and an inline
+        # retrain in the same process apart
+        tmp = f"{HISTORY_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        history.to_pickle(tmp)
+        os.replace(tmp, HISTORY_PATH)
+        # Swap in the new snapshot only once it is complete
+        state.save(TEAM_STATE_PATH)
+        self.team_state = state
+        self.prediction_cache.clear()
+        return history
+
+    def _matchups_path(self):
+        return os.path.join(MODELS_DIR, f"matchups_{self.model_type}.npz")
+
+    def build_matchups(self):
+        """Predicts every ordered pair of known teams with one batched model call and
+        saves the (teams, teams, 3) probability tensor next to the models."""
+        teams = self.team_state.teams
+        columns = self.team_state.pair_features(teams)
+        X = np.stack([columns[c] for c in self.feature_cols], axis=-1).reshape(-1, len(self.feature_cols))
+        probs = np.asarray(self._predict_matrix(X), dtype=np.float64).reshape(len(teams), len(teams), -1)
+        self.matchups = Matchups(teams, probs, self.model_version, self.team_state.version)
+        self.matchups.save(self._matchups_path())
+        return self.matchups
+
+    def _load_matchups(self):
+        # The saved tensor if it belongs to this model and snapshot, else a fresh one
+        if self.model is None or self.team_state is None:
+            self.matchups = None
+            return
+        path = self._matchups_path()
+        if os.path.exists(path):
+            matchups = Matchups.load(path)
+            if matchups.matches(self.model_version, self.team_state.version):
+                self.matchups = matchups
+                return
+        with stage("engine.build_matchups"):
+            self.build_matchups()
 
-def predict_proba(self, home_team, away_team):
+    def _current_matchups(self):
+        # None while a new model or snapshot is being swapped in
+        matchups = self.matchups
+        if matchups is not None and matchups.matches(self.model_version, self.team_state.version):
+            return matchups
+        return None
+
+    def _check_ready(self):
         if self.model is None:
             # AUTO-FIX: Attempt to load again, or raise clear error
             self.load_model()
             if self.model is None:
                 raise ValueError("Model has not been trained yet. Please run the training script via /admin/retrain or CLI.")
-        
-        # ... rest of the function
-        # In a real app, we need the latest stats for these teams.
-        # We will re-fetch data, compute features for the latest date, 
-        # then artificially construct the row for prediction.
-        
-        # This is expensive, so in prod we'd cache the 'current form' of all teams separately.
-        # For this implementation, we re-run feature prep on historical data to get latest stats.
-        
-        raw_df = fetch_data()
-        df, _ = prepare_features(raw_df)
-        
-        # Get latest stats for home team
-        h_stats = df[df['HomeTeam'] == home_team].iloc[-1] if not df[df['HomeTeam'] == home_team].empty else None
-        a_stats = df[df['AwayTeam'] == away_team].iloc[-1] if not df[df['AwayTeam'] == away_team].empty else None
-        
-        if h_stats is None or a_stats is None:
-            raise ValueError("Team not found in history")
-
-        # Construct feature vector (Approximation using latest available rating/form)
-        # Note: Elo needs to be the POST-match rating of the last game.
-        input_data = pd.DataFrame([{
-            'Elo_Home': h_stats['Elo_Home'], 
-            'Elo_Away': a_stats['Elo_Away'],
-            'Home_Form_Pts': h_stats['Home_Form_Pts'], # Should ideally calculate form INCLUDING last match
-            'Away_Form_Pts': a_stats['Away_Form_Pts'],
-            'Home_Form_GF': h_stats['Home_Form_GF'],
-            'Away_Form_GF': a_stats['Away_Form_GF'],
-            'Home_Form_GA': h_stats['Home_Form_GA'],
-            'Away_Form_GA': a_stats['Away_Form_GA']
-        }])
-        
-        if self.model_type == "ensemble":
-            p1 = self.model['xgb'].predict_proba(input_data)[0]
-            p2 = self.model['rf'].predict_proba(input_data)[0]
-            p3 = self.model['lr'].predict_proba(input_data)[0]
-            probs = (p1 + p2 + p3) / 3
-            explainer_model = self.model['rf'] # Use RF for SHAP in ensemble mode for simplicity
-        else:
-            probs = self.model.predict_proba(input_data)[0]
-            explainer_model = self.model
+        if self.team_state is None:
+            raise ValueError("Team snapshot has not been built yet. Please retrain or refresh the data.")
 
-        # SHAP
-        explainer = shap.TreeExplainer(explainer_model) if hasattr(explainer_model, "feature_importances_") else shap.LinearExplainer(explainer_model, input_data)
-        shap_values = explainer.shap_values(input_data)
-        
-        # Handle SHAP output shape variations (binary vs multiclass)
-        if isinstance(shap_values, list):
-            sv = shap_values[0] # taking class 0 (Home Win) interest usually
-        else:
-            sv = shap_values
+    def warm_up(self):
+        """Runs one prediction so the first request does not pay for first-call costs
+        (lazy imports, compiled model and feature paths). Returns its duration in
+        seconds, or None if there is no trained model or team snapshot yet.
+        """
+        if self.model is None or self.team_state is None or len(self.team_state.teams) < 2:
+            return None
+        start = time.perf_counter()
+        home_team, away_team = self.team_state.teams[:2]
+        self.predict_proba(home_team, away_team)
+        self.warmed = True
+        return time.perf_counter() - start
 
-        # Generate plot
-        plt.figure()
-        shap.summary_plot(sv, input_data, show=False, plot_type="bar")
-        filename = f"{uuid.uuid4()}.png"
-        plt.savefig(os.path.join(SHAP_DIR, filename), bbox_inches='tight')
-        plt.close()
+    def _predict_matrix(self, X):
+        """(n_rows, 3) Home/Draw/Away probabilities for a feature array in `feature_cols` order."""
+        if self.compiled is not None:
+            return self.compiled.predict_proba(X)
+
+        return model_proba(self.model, pd.DataFrame(X, columns=self.feature_cols))
+
+    def predict_proba(self, home_team, away_team, explain=False):
+        return self.predict_many([(home_team, away_team)], explain=explain)[0]
+
+    def predict_many(self, pairs, explain=False):
+        """Predicts many (home_team, away_team) fixtures with one feature matrix.
 
+        SHAP explanations are only computed per row when `explain` is set.
+        """
+        self._check_ready()
+
+        # Identical inputs give identical outputs until the model or the snapshot changes
+        keys = [(self.model_version, self.team_state.version, h, a) for h, a in pairs]
+        cached = [self.prediction_cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+
+        if missing:
+            # Latest post-match Elo and form (including the most recent match) for both teams,
+            # read from the snapshot built at train/refresh time.
+            with stage("engine.features"):
+                rows = [self.team_state.features(*pairs[i]) for i in missing]
+            with stage("engine.model"):
+                matchups = self._current_matchups()
+                probs = matchups.lookup([pairs[i] for i in missing]) if matchups is not None else None
+                if probs is None:
+                    probs = self._predict_matrix(np.array([[row[c] for c in self.feature_cols] for row in rows]))
+            for j, i in enumerate(missing):
+                cached[i] = {
+                    "probs": {"Home": float(probs[j, 0]), "Draw": float(probs[j, 1]), "Away": float(probs[j, 2])},
+                    "features": rows[j]
+                }
+                self.prediction_cache.put(keys[i], cached[i])
+
+        results = []
+        for entry in cached:
+            result = {"probs": dict(entry["probs"]), "shap_url": None, "features": dict(entry["features"])}
+            if explain:
+                with stage("engine.explain"):
+                    result.update(self.explain(result["features"]))
+            results.append(result)
+        return results
+
+    def matchup_probs(self, pairs):
+        """(n_pairs, 3) Home/Draw/Away probabilities indexed straight out of the matchup
+        tensor; pairs it does not cover go through `predict_many`."""
+        self._check_ready()
+        matchups = self._current_matchups()
+        probs = matchups.lookup(pairs) if matchups is not None else None
+        if probs is None:
+            results = self.predict_many(pairs)
+            probs = np.array([[r["probs"]["Home"], r["probs"]["Draw"], r["probs"]["Away"]] for r in results])
+        return probs
+
+    def matchup_table(self, teams=None):
+        """The matchup tensor (optionally only `teams`) as nested lists for the API."""
+        self._check_ready()
+        matchups = self._current_matchups()
+        if matchups is None:
+            self._load_matchups()
+            matchups = self.matchups
+        teams = list(teams) if teams else matchups.teams
+        unknown = [team for team in teams if team not in matchups.index]
+        if unknown:
+            raise ValueError(f"Team not found in history: {', '.join(unknown)}")
         return {
-            "probs": {"Home": float(probs[0]), "Draw": float(probs[1]), "Away": float(probs[2])},
-            "shap_url": f"/admin/shap/{filename}",
-            "features": input_data.to_dict(orient="records")[0]
+            "model_version": matchups.model_version,
+            "snapshot": matchups.snapshot_version,
+            "teams": teams,
+            "probs": matchups.subset(teams).tolist(),
         }
+
+    def _get_explainer(self):
+        # Built once per loaded model
+        if self._explainer is None:
+            import shap
+            explainer_model = self.model['rf'] if self.model_type == "ensemble" else self.model # Use RF for SHAP in ensemble mode for simplicity
+            if hasattr(explainer_model, "feature_importances_"):
+                self._explainer = shap.TreeExplainer(explainer_model)
+            else:
+                background = pd.read_pickle(HISTORY_PATH)[self.feature_cols].tail(200)
+                self._explainer = shap.LinearExplainer(explainer_model, background)
+        return self._explainer
+
+    def explain(self, features):
+        """SHAP values (towards a Home win) for one feature row, plus the URL of its bar chart.
+
+        Results are cached per (model version, feature vector). The chart is rendered
+        in the background, so the URL may 404 for a moment after the first call.
+        """
+        key = (self.model_version, tuple(float(features[c]) for c in self.feature_cols))
+        with self._explain_lock:
+            explanation = self._explanations.get(key)
+            if explanation is not None:
+                self._explanations.move_to_end(key)
+
+        if explanation is None:
+            input_data = pd.DataFrame([features], columns=self.feature_cols)
+            shap_values = self._get_explainer().shap_values(input_data)
+
+            # Handle SHAP output shape variations (binary vs multiclass)
+            if isinstance(shap_values, list):
+                sv = shap_values[0] # taking class 0 (Home Win) interest usually
+            elif shap_values.ndim == 3:
+                sv = shap_values[:, :, 0]
+            else:
+                sv = shap_values
+
+            filename = hashlib.sha1(repr(key).encode()).hexdigest() + ".png"
+            explanation = {
+                "shap_url": f"/admin/shap/{filename}",
+                "shap_values": {c: float(v) for c, v in zip(self.feature_cols, sv[0])}
+            }
+            with self._explain_lock:
+                self._explanations[key] = explanation
+                while len(self._explanations) > EXPLAIN_CACHE_SIZE:
+                    self._explanations.popitem(last=False)
+
+        self._ensure_plot(explanation, features)
+        return dict(explanation)
+
+    def _ensure_plot(self, explanation, features):
+        filename = explanation["shap_url"].rsplit("/", 1)[-1]
+        path = os.path.join(SHAP_DIR, filename)
+        with self._explain_lock:
+            if os.path.exists(path) or filename in self._pending_plots:
+                return
+            self._pending_plots.add(filename)
+
+        sv = np.array([[explanation["shap_values"][c] for c in self.feature_cols]])
+        input_data = pd.DataFrame([features], columns=self.feature_cols)
+        future = _render_pool.submit(_render_shap_plot, sv, input_data, path)
+        future.add_done_callback(lambda _: self._pending_plots.discard(filename))
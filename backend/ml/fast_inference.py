@@ -0,0 +1,210 @@
+import json
+import numpy as np
+
+
+class FlatForest:
+    """Every tree of every tree-based member as flat node arrays, walked level by level
+    for all rows and all trees at once.
+
+    Leaves point to themselves, so each row takes exactly `depth` steps with no
+    branching. Splits are float32 `x > threshold -> right`, which is how both
+    sklearn (float32 inputs) and XGBoost (float32 `x < split -> left`) decide once
+    the thresholds are rounded down to float32 (see `_float32_below`).
+    """
+
+    def __init__(self, roots, feature, threshold, children, value, depth, n_features):
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.children = np.asarray(children, dtype=np.intp)  # [left0, right0, left1, right1, ...]
+        self.value = np.ascontiguousarray(value, dtype=np.float64)  # (n_nodes, n_classes)
+        self.depth = int(depth)
+        self.n_features = n_features
+
+    def leaves(self, X):
+        """(n_rows, n_trees, n_classes) leaf values reached by every row in every tree."""
+        if X.shape[0] == 1:
+            # Single row: plain 1-D gathers, no per-row offsets
+            x, node = X[0], self.roots
+            for _ in range(self.depth):
+                node = self.children[2 * node + (x[self.feature[node]] > self.threshold[node])]
+            return np.take(self.value, node, axis=0)[None]
+
+        x = X.ravel()
+        row_start = (np.arange(X.shape[0]) * self.n_features)[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.depth):
+            index = np.take(self.feature, node)
+            index += row_start
+            go_right = np.take(x, index) > np.take(self.threshold, node)
+            index = node * 2
+            index += go_right
+            node = np.take(self.children, index)
+        # take() is several times faster than fancy indexing for the (rows, trees, classes) gather
+        return np.take(self.value, node, axis=0)
+
+
+def _float32_below(threshold, strict):
+    """float32 t with `x <= t` equivalent to `x <= threshold` (or `x < threshold` if strict) for float32 x."""
+    threshold = np.asarray(threshold, dtype=np.float64)
+    t32 = threshold.astype(np.float32)
+    down = (t32 >= threshold) if strict else (t32 > threshold)
+    t32[down] = np.nextafter(t32[down], np.float32(-np.inf))
+    return t32
+
+
+def _tree_depth(left, right):
+    depth, frontier = 0, [0]
+    while True:
+        frontier = [c for n in frontier for c in (left[n], right[n]) if c != -1]
+        if not frontier:
+            return depth
+        depth += 1
+
+
+def _rf_trees(model):
+    """(feature, threshold, left, right, leaf value) per tree, -1 marking leaves.
+
+    Leaf values are class probabilities divided by the tree count, so summing over
+    trees gives RandomForestClassifier.predict_proba.
+    """
+    trees = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        value = tree.value[:, 0, :]
+        value = value / value.sum(axis=1, keepdims=True) / len(model.estimators_)
+        trees.append((
+            tree.feature, _float32_below(tree.threshold, strict=False),
+            tree.children_left, tree.children_right, value
+        ))
+    return trees
+
+
+def _xgb_trees(model):
+    """Same layout as `_rf_trees`; leaf values are the tree's margin in its class column.
+
+    Returns None for boosters that are not plain multi-class softmax tree models.
+    """
+    booster = model.get_booster()
+    learner = json.loads(booster.save_raw("json"))["learner"]
+    gbm = learner["gradient_booster"]
+    if gbm["name"] != "gbtree" or not learner["objective"]["name"].startswith("multi:soft"):
+        return None
+    n_classes = int(learner["learner_model_param"]["num_class"])
+
+    tree_json, tree_info = gbm["model"]["trees"], gbm["model"]["tree_info"]
+    # Same trees as XGBClassifier.predict_proba when early stopping recorded a best iteration
+    best = booster.attributes().get("best_iteration")
+    if best is not None:
+        per_round = n_classes * int(gbm["model"]["gbtree_model_param"]["num_parallel_tree"])
+        tree_json = tree_json[:(int(best) + 1) * per_round]
+
+    trees = []
+    for tree, cls in zip(tree_json, tree_info):
+        left = np.asarray(tree["left_children"])
+        # JSON holds the shortest decimal of each float32 value; round-trip through float32 first
+        split = np.asarray(tree["split_conditions"], dtype=np.float32).astype(np.float64)
+        value = np.zeros((len(left), n_classes))
+        value[left == -1, cls] = split[left == -1]
+        trees.append((
+            tree["split_indices"], _float32_below(split, strict=True),
+            left, tree["right_children"], value
+        ))
+    # base_score shifts every class margin equally, which softmax cancels out
+    return trees
+
+
+def _build_forest(trees, n_features):
+    roots, feature, threshold, children, value = [], [], [], [], []
+    offset, depth = 0, 0
+    for t_feature, t_threshold, t_left, t_right, t_value in trees:
+        t_left, t_right = np.asarray(t_left), np.asarray(t_right)
+        leaf = t_left == -1
+        depth = max(depth, _tree_depth(t_left, t_right))
+        ids = np.arange(len(t_left)) + offset
+        roots.append(offset)
+        feature.append(np.where(leaf, 0, t_feature))
+        threshold.append(np.where(leaf, 0, t_threshold).astype(np.float32))
+        children.append(np.column_stack([
+            np.where(leaf, ids, t_left + offset), np.where(leaf, ids, t_right + offset)
+        ]).ravel())
+        value.append(t_value)
+        offset += len(t_left)
+
+    return FlatForest(
+        roots, np.concatenate(feature), np.concatenate(threshold), np.concatenate(children),
+        np.concatenate(value), depth, n_features
+    )
+
+
+def _softmax(z):
+    z = z - z.max(axis=1, keepdims=True)
+    np.exp(z, out=z)
+    return z / z.sum(axis=1, keepdims=True)
+
+
+class CompiledModel:
+    """predict_proba for LogisticRegression / RandomForest / XGBoost models, or an
+    equal-weight dict ensemble of them, on plain NumPy arrays.
+
+    Linear members become a coefficient matrix; tree members share one FlatForest
+    so a prediction walks all trees in `depth` vectorised steps. Skips the per-call
+    validation and DataFrame handling of the library predict_proba; outputs match
+    them to floating point tolerance.
+    """
+
+    def __init__(self, linear, forest, tree_members, n_members):
+        self.linear = linear  # list of (coef (n_features, n_classes), intercept)
+        self.forest = forest
+        self.tree_members = tree_members  # list of (first tree, end tree, apply softmax)
+        self._starts = [start for start, _, _ in tree_members]
+        self.n_members = n_members
+
+    @classmethod
+    def compile(cls, model, n_features):
+        """Returns a CompiledModel for `model`, or None if any member is unsupported."""
+        # Imported here so the API process only loads sklearn/XGBoost along with a model
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.linear_model import LogisticRegression
+        from xgboost import XGBClassifier
+
+        members = model.values() if isinstance(model, dict) else [model]
+        linear, trees, tree_members = [], [], []
+        for member in members:
+            if isinstance(member, LogisticRegression):
+                multinomial = member.multi_class == "multinomial" or (
+                    member.multi_class == "auto" and len(member.classes_) > 2 and member.solver != "liblinear"
+                )
+                if not multinomial:
+                    return None
+                linear.append((member.coef_.T.copy(), member.intercept_.copy()))
+                continue
+
+            if isinstance(member, RandomForestClassifier):
+                member_trees, margins = _rf_trees(member), False
+            elif isinstance(member, XGBClassifier):
+                member_trees, margins = _xgb_trees(member), True
+            else:
+                member_trees = None
+            if member_trees is None:
+                return None
+            tree_members.append((len(trees), len(trees) + len(member_trees), margins))
+            trees.extend(member_trees)
+
+        forest = _build_forest(trees, n_features) if trees else None
+        return cls(linear, forest, tree_members, len(linear) + len(tree_members))
+
+    def predict_proba(self, X):
+        """(n_rows, n_classes) probabilities for a 2-D (or single 1-D) feature array."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        total = 0
+        for coef, intercept in self.linear:
+            total = total + _softmax(X @ coef + intercept)
+        if self.forest is not None:
+            # One reduction for all members: per-member sums over their tree ranges
+            summed = np.add.reduceat(self.forest.leaves(X), self._starts, axis=1)
+            for i, (_, _, margins) in enumerate(self.tree_members):
+                total = total + (_softmax(summed[:, i]) if margins else summed[:, i])
+        return total / self.n_members
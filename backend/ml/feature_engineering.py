@@ -1,100 +1,185 @@
 import pandas as pd
 import numpy as np
 
-def calculate_elo(df, k_factor=20, base_rating=1500):
-    # Dictionary to hold current ratings
-    ratings = {}
-    
+def encode_teams(df):
+    """Maps team names to integer ids. Returns (home_ids, away_ids, teams)."""
+    home, away = df['HomeTeam'], df['AwayTeam']
+    if isinstance(home.dtype, pd.CategoricalDtype) and home.dtype == away.dtype:
+        # One categorical shared by both columns (see data_fetch): its codes are the ids
+        return home.cat.codes.to_numpy(np.intp), away.cat.codes.to_numpy(np.intp), home.cat.categories
+    codes, teams = pd.factorize(pd.concat([df['HomeTeam'], df['AwayTeam']], ignore_index=True))
+    n = len(df)
+    return codes[:n], codes[n:], teams
+
+def match_results(df):
+    """Home side's actual score per match (1=win, 0.5=draw, 0=loss)."""
+    fthg = df['FTHG'].to_numpy()
+    ftag = df['FTAG'].to_numpy()
+    return np.where(fthg > ftag, 1.0, np.where(fthg == ftag, 0.5, 0.0))
+
+def _elo_pass(home_ids, away_ids, actual_h, ratings, k_factor):
+    # `ratings` holds one entry per team id: a float for a single parameter set,
+    # or an array with one rating per parameter set for a grid run.
     elo_home = []
     elo_away = []
-    
-    # Initialize ratings
-    teams = set(df['HomeTeam']).union(set(df['AwayTeam']))
-    for team in teams:
-        ratings[team] = base_rating
-        
-    for index, row in df.iterrows():
-        h_team = row['HomeTeam']
-        a_team = row['AwayTeam']
-        
-        h_rating = ratings[h_team]
-        a_rating = ratings[a_team]
-        
+    for h, a, act_h in zip(home_ids.tolist(), away_ids.tolist(), actual_h.tolist()):
+        h_rating = ratings[h]
+        a_rating = ratings[a]
+
         elo_home.append(h_rating)
         elo_away.append(a_rating)
-        
+
         # Calculate expected score
         expected_h = 1 / (1 + 10 ** ((a_rating - h_rating) / 400))
         expected_a = 1 / (1 + 10 ** ((h_rating - a_rating) / 400))
-        
-        # Actual score (1=win, 0.5=draw, 0=loss)
-        if row['FTHG'] > row['FTAG']:
-            actual_h, actual_a = 1, 0
-        elif row['FTHG'] == row['FTAG']:
-            actual_h, actual_a = 0.5, 0.5
-        else:
-            actual_h, actual_a = 0, 1
-            
+
         # Update ratings
-        ratings[h_team] = h_rating + k_factor * (actual_h - expected_h)
-        ratings[a_team] = a_rating + k_factor * (actual_a - expected_a)
-        
+        ratings[h] = h_rating + k_factor * (act_h - expected_h)
+        ratings[a] = a_rating + k_factor * ((1 - act_h) - expected_a)
+    return elo_home, elo_away
+
+def calculate_elo(df, k_factor=20, base_rating=1500):
+    home_ids, away_ids, teams = encode_teams(df)
+    ratings = [base_rating] * len(teams)
+    elo_home, elo_away = _elo_pass(home_ids, away_ids, match_results(df), ratings, k_factor)
+
     df['Elo_Home'] = elo_home
     df['Elo_Away'] = elo_away
     return df
 
-def get_recent_form(df, window=5):
-    # Calculate points per game for rolling window
-    # Create a long-format DF first
-    home_stats = df[['Date', 'HomeTeam', 'FTHG', 'FTAG', 'FTR']].rename(
-        columns={'HomeTeam': 'Team', 'FTHG': 'GoalsFor', 'FTAG': 'GoalsAgainst'}
-    )
-    home_stats['Points'] = home_stats['FTR'].map({'H': 3, 'D': 1, 'A': 0})
-    home_stats['IsHome'] = 1
+def calculate_elo_grid(df, k_factors, base_ratings=1500):
+    """Pre-match Elo ratings for several (k_factor, base_rating) sets in a single pass.
 
-    away_stats = df[['Date', 'AwayTeam', 'FTAG', 'FTHG', 'FTR']].rename(
-        columns={'AwayTeam': 'Team', 'FTAG': 'GoalsFor', 'FTHG': 'GoalsAgainst'}
-    )
-    away_stats['Points'] = away_stats['FTR'].map({'A': 3, 'D': 1, 'H': 0})
-    away_stats['IsHome'] = 0
-    
-    all_stats = pd.concat([home_stats, away_stats]).sort_values(['Team', 'Date'])
-    
-    # Rolling averages
-    all_stats['Form_Points'] = all_stats.groupby('Team')['Points'].transform(
-        lambda x: x.shift(1).rolling(window, min_periods=1).mean()
+    Parameters broadcast against each other. Returns (elo_home, elo_away), each of
+    shape (n_param_sets, n_matches). Row i equals `calculate_elo` run with set i up
+    to floating-point rounding (NumPy's vectorised pow can differ in the last ulp
+    from the scalar one).
+    """
+    k_factors, base_ratings = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(k_factors, dtype=float)),
+        np.atleast_1d(np.asarray(base_ratings, dtype=float))
     )
-    all_stats['Form_GoalsFor'] = all_stats.groupby('Team')['GoalsFor'].transform(
-        lambda x: x.shift(1).rolling(window, min_periods=1).mean()
-    )
-    all_stats['Form_GoalsAgainst'] = all_stats.groupby('Team')['GoalsAgainst'].transform(
-        lambda x: x.shift(1).rolling(window, min_periods=1).mean()
-    )
-    
-    # Merge back to main df
-    # We need to act carefully to merge back on specific match rows
-    # For simplicity in this demo, we re-merge based on Date + Team
-    
-    df_merged = df.copy()
-    
-    # Get pre-match stats for Home Team
-    h_form = all_stats[all_stats['IsHome'] == 1][['Date', 'Team', 'Form_Points', 'Form_GoalsFor', 'Form_GoalsAgainst']]
-    df_merged = df_merged.merge(h_form, left_on=['Date', 'HomeTeam'], right_on=['Date', 'Team'], how='left')
-    df_merged = df_merged.rename(columns={'Form_Points': 'Home_Form_Pts', 'Form_GoalsFor': 'Home_Form_GF', 'Form_GoalsAgainst': 'Home_Form_GA'}).drop(columns=['Team'])
-    
-    # Get pre-match stats for Away Team
-    a_form = all_stats[all_stats['IsHome'] == 0][['Date', 'Team', 'Form_Points', 'Form_GoalsFor', 'Form_GoalsAgainst']]
-    df_merged = df_merged.merge(a_form, left_on=['Date', 'AwayTeam'], right_on=['Date', 'Team'], how='left')
-    df_merged = df_merged.rename(columns={'Form_Points': 'Away_Form_Pts', 'Form_GoalsFor': 'Away_Form_GF', 'Form_GoalsAgainst': 'Away_Form_GA'}).drop(columns=['Team'])
-    
-    return df_merged.fillna(0)
+    home_ids, away_ids, teams = encode_teams(df)
+    ratings = [base_ratings.copy() for _ in range(len(teams))]
+    elo_home, elo_away = _elo_pass(home_ids, away_ids, match_results(df), ratings, k_factors)
+
+    shape = (len(k_factors), len(df))
+    if not elo_home:
+        return np.empty(shape), np.empty(shape)
+    return np.array(elo_home).T, np.array(elo_away).T
+
+# Per-team match stats for form features: name -> (home side column, away side column),
+# each read from the team's own perspective. 'Pts' is derived from FTR.
+FORM_STATS = {
+    'Pts': None,
+    'GF': ('FTHG', 'FTAG'),
+    'GA': ('FTAG', 'FTHG'),
+    'Shots': ('HS', 'AS'),
+    'ShotsAgainst': ('AS', 'HS'),
+    'SOT': ('HST', 'AST'),
+    'SOTAgainst': ('AST', 'HST'),
+    'xG': ('Home_xG', 'Away_xG'),
+    'xGA': ('Away_xG', 'Home_xG')
+}
+DEFAULT_FORM_STATS = ('Pts', 'GF', 'GA')
+DEFAULT_WINDOW = 5
+
+def form_column(side, stat, window=DEFAULT_WINDOW, venue=False):
+    """Name of a form feature, e.g. Home_Form_Pts, Away_Form10_GF, Home_VenueForm_GA."""
+    kind = "VenueForm" if venue else "Form"
+    if window != DEFAULT_WINDOW:
+        kind += str(window)
+    return f"{side}_{kind}_{stat}"
+
+def _side_values(df, stat):
+    """(home team's value, away team's value) per match for one FORM_STATS entry."""
+    if stat == 'Pts':
+        return (df['FTR'].map({'H': 3, 'D': 1, 'A': 0}).to_numpy(dtype=float),
+                df['FTR'].map({'A': 3, 'D': 1, 'H': 0}).to_numpy(dtype=float))
+    home_col, away_col = FORM_STATS[stat]
+    return df[home_col].to_numpy(dtype=float), df[away_col].to_numpy(dtype=float)
+
+def _rolling_means(group, order, values, windows):
+    """Mean of each of the previous `window` values within a group, per row.
+
+    `group` and `order` define the sequence (rows sorted by group, then order);
+    `values` is (n_rows, n_stats) with NaN for missing entries, which are skipped
+    like pandas' rolling(min_periods=1). One cumulative sum over the sorted rows
+    serves every window and stat. Returns {window: (n_rows, n_stats)} in the
+    original row order, NaN where a row has no earlier value.
+    """
+    n = len(group)
+    idx = np.lexsort((order, group))
+    sorted_values = values[idx]
+    present = ~np.isnan(sorted_values)
+
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.concatenate([zeros, np.cumsum(np.where(present, sorted_values, 0.0), axis=0)])
+    counts = np.concatenate([zeros, np.cumsum(present, axis=0)])
+
+    # Sorted position at which each row's group starts
+    pos = np.arange(n)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = group[idx][1:] != group[idx][:-1]
+    group_start = np.maximum.accumulate(np.where(new_group, pos, 0))
+
+    result = {}
+    for window in windows:
+        lo = np.maximum(group_start, pos - window)
+        total = sums[pos] - sums[lo]
+        count = counts[pos] - counts[lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(count > 0, total / count, np.nan)
+        out = np.empty_like(means)
+        out[idx] = means
+        result[window] = out
+    return result
+
+def form_features(df, windows=(DEFAULT_WINDOW,), stats=DEFAULT_FORM_STATS, venue=False):
+    """Pre-match rolling form of both teams for every match in `df`.
+
+    Each team's matches are ordered by date (then row order) and the features
+    are the mean of its last `window` matches before this one, for every window
+    and stat in one grouped pass. With `venue=True`, the home team's form only
+    counts its home matches and the away team's only its away matches.
+    Returns a frame aligned with `df`'s index; a team's first match gives 0.
+    """
+    n = len(df)
+    home_ids, away_ids, _ = encode_teams(df)
+    team = np.concatenate([home_ids, away_ids])
+    is_away = np.repeat([0, 1], n)
+    group = team * 2 + is_away if venue else team
+    dates = df['Date'].to_numpy()
+    order = np.lexsort((np.tile(np.arange(n), 2), np.concatenate([dates, dates])))
+    rank = np.empty(2 * n, dtype=np.int64)
+    rank[order] = np.arange(2 * n)
+
+    home_values, away_values = zip(*(_side_values(df, stat) for stat in stats))
+    values = np.concatenate([np.column_stack(home_values), np.column_stack(away_values)])
+
+    columns = {}
+    for window, means in _rolling_means(group, rank, values, windows).items():
+        means = np.nan_to_num(means, nan=0.0)
+        for j, stat in enumerate(stats):
+            columns[form_column('Home', stat, window, venue)] = means[:n, j]
+            columns[form_column('Away', stat, window, venue)] = means[n:, j]
+    return pd.DataFrame(columns, index=df.index)
+
+def get_recent_form(df, window=DEFAULT_WINDOW, stats=DEFAULT_FORM_STATS):
+    """`df` plus Home_/Away_Form_* columns (see `form_features`), written back by row."""
+    df = df.copy()
+    for col, values in form_features(df, windows=(window,), stats=stats).items():
+        df[col] = values
+    return df
 
 def prepare_features(df):
+    """Adds Elo, form and `Target` columns to `df` in place. Returns (df, feature_cols)."""
     df = calculate_elo(df)
-    df = get_recent_form(df)
+    for col, values in form_features(df).items():
+        df[col] = values
     
-    # Target
-    df['Target'] = df['FTR'].map({'H': 0, 'D': 1, 'A': 2})
+    # Target (FTR may be categorical, whose map would stay categorical)
+    df['Target'] = df['FTR'].astype(object).map({'H': 0, 'D': 1, 'A': 2})
     
     feature_cols = [
         'Elo_Home', 'Elo_Away', 
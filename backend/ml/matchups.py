@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+
+class Matchups:
+    """Home/Draw/Away probabilities of every ordered pair of teams.
+
+    `probs[i, j]` is the prediction for `teams[i]` at home to `teams[j]`. The
+    model and team snapshot versions it was computed from are stored with it, so
+    a file left over from another model or snapshot is never served.
+    """
+
+    def __init__(self, teams, probs, model_version, snapshot_version):
+        self.teams = list(teams)
+        self.index = {team: i for i, team in enumerate(self.teams)}
+        self.probs = probs
+        self.model_version = model_version
+        self.snapshot_version = snapshot_version
+
+    def matches(self, model_version, snapshot_version):
+        return self.model_version == model_version and self.snapshot_version == snapshot_version
+
+    def lookup(self, pairs):
+        """(n_pairs, 3) rows for (home, away) pairs, or None if a team is not in the matrix."""
+        try:
+            home = np.fromiter((self.index[h] for h, _ in pairs), dtype=np.intp, count=len(pairs))
+            away = np.fromiter((self.index[a] for _, a in pairs), dtype=np.intp, count=len(pairs))
+        except KeyError:
+            return None
+        return self.probs[home, away]
+
+    def subset(self, teams):
+        """(len(teams), len(teams), 3) block for `teams`, in that order."""
+        idx = [self.index[team] for team in teams]
+        return self.probs[np.ix_(idx, idx)]
+
+    def save(self, path):
+        # Written to a temp file and renamed, so readers never see a partial file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, teams=np.array(self.teams, dtype=str), probs=self.probs,
+                     model_version=str(self.model_version), snapshot_version=str(self.snapshot_version))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["teams"].tolist(), data["probs"], str(data["model_version"]), str(data["snapshot_version"]))
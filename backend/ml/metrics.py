@@ -0,0 +1,123 @@
+"""Per-stage timings, kept as Prometheus-style histograms.
+
+Code marks its stages with `stage("name")`. Every stage is observed in the
+process-wide histograms, and also appended to the trace of the current request
+(a context variable set by the API middleware), so a request knows where its
+time went. Stage timings from worker processes are shipped back with the task
+result and replayed with `record`.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# List of (stage, seconds) for the request (or worker task) being handled, if any
+_trace = ContextVar("epl_stage_trace", default=None)
+# Called with the current thread id on every stage entry (used by the profiler)
+_on_stage = ContextVar("epl_stage_hook", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, like a Prometheus client histogram."""
+
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.snapshot().items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, label_values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]}")
+        return "\n".join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram("epl_stage_seconds", "Time spent in internal stages.", ["stage"])
+REQUEST_SECONDS = Histogram("epl_request_seconds", "HTTP request latency.", ["handler", "method", "status"])
+
+
+@contextmanager
+def stage(name):
+    """Times the block as stage `name`."""
+    hook = _on_stage.get()
+    if hook is not None:
+        hook(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record([(name, time.perf_counter() - start)])
+
+
+def record(stages):
+    """Observes (stage, seconds) pairs measured elsewhere, e.g. in a worker process."""
+    trace = _trace.get()
+    for name, seconds in stages:
+        STAGE_SECONDS.observe(seconds, name)
+        if trace is not None:
+            trace.append((name, seconds))
+
+
+@contextmanager
+def trace():
+    """Collects the stages run inside the block (including nested threads that
+    inherit the context). Yields the list of (stage, seconds)."""
+    stages = []
+    token = _trace.set(stages)
+    try:
+        yield stages
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def stage_hook(callback):
+    """Calls `callback(thread_id)` whenever a stage starts inside the block."""
+    token = _on_stage.set(callback)
+    try:
+        yield
+    finally:
+        _on_stage.reset(token)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(h.render() for h in (REQUEST_SECONDS, STAGE_SECONDS)) + "\n"
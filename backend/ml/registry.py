@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import joblib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, os.replace still keeps state.json whole
+    fcntl = None
+
+MANIFEST = "manifest.json"
+STATE = "state.json"
+# Serializes state.json updates between threads; the file lock does so between processes
+_state_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Versioned model artifacts for one model type.
+
+    Layout::
+
+        <root>/<version>/manifest.json   hash, feature list, metrics, data snapshot
+        <root>/<version>/<member>.ubj    XGBoost native binary format
+        <root>/<version>/<member>.joblib uncompressed joblib (memory-mappable arrays)
+        <root>/state.json                current version + promotion history
+
+    Versions are written to a temp dir and renamed into place, and state.json is
+    replaced atomically, so readers only ever see complete versions. Promote and
+    rollback read-modify-write state.json under a lock held across threads and
+    processes, so concurrent admins never lose a history entry. `prune` bounds
+    the registry (the daily retrain job commits it) to the last promoted versions.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    # --- Writing ---
+    def save(self, model_type, model, feature_cols, metrics=None, data_snapshot=None):
+        """Stores a new (not yet promoted) version and returns its id."""
+        from xgboost import XGBClassifier
+
+        members = model if isinstance(model, dict) else {"model": model}
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        try:
+            artifacts = {}
+            for name, member in members.items():
+                if isinstance(member, XGBClassifier):
+                    artifacts[name] = f"{name}.ubj"
+                    member.save_model(os.path.join(tmp_dir, artifacts[name]))
+                else:
+                    artifacts[name] = f"{name}.joblib"
+                    joblib.dump(member, os.path.join(tmp_dir, artifacts[name]))
+
+            digest = hashlib.sha1()
+            for name in sorted(artifacts):
+                with open(os.path.join(tmp_dir, artifacts[name]), "rb") as f:
+                    digest.update(f.read())
+            created_at = datetime.now(timezone.utc)
+            version = f"{created_at:%Y%m%dT%H%M%S}-{digest.hexdigest()[:10]}"
+
+            manifest = {
+                "version": version,
+                "model_type": model_type,
+                "ensemble": isinstance(model, dict),
+                "created_at": created_at.isoformat(),
+                "hash": digest.hexdigest(),
+                "feature_cols": list(feature_cols),
+                "metrics": metrics or {},
+                "data_snapshot": data_snapshot,
+                "artifacts": artifacts
+            }
+            with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.rename(tmp_dir, os.path.join(self.root, version))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return version
+
+    def promote(self, version):
+        """Makes `version` the one served by `load()`."""
+        if not os.path.exists(os.path.join(self.root, version, MANIFEST)):
+            raise ValueError(f"Unknown model version: {version}")
+        with self._locked():
+            state = self._state()
+            if state["current"] != version:
+                state["history"].append(version)
+                state["current"] = version
+                self._write_state(state)
+
+    def rollback(self):
+        """Re-promotes the previously promoted version. Returns it."""
+        with self._locked():
+            state = self._state()
+            if len(state["history"]) < 2:
+                raise ValueError("No previous model version to roll back to")
+            state["history"].pop()
+            state["current"] = state["history"][-1]
+            self._write_state(state)
+            return state["current"]
+
+    def prune(self, keep=2):
+        """Deletes old versions, keeping the current one and the ones promoted just
+        before it (`keep` in total, what `rollback` can still return to). Versions
+        saved after the current one may be about to be promoted and are kept too.
+        Returns the deleted versions."""
+        with self._locked():
+            state = self._state()
+            if state["current"] is None:
+                return []
+            if len(state["history"]) > keep:
+                state["history"] = state["history"][-keep:]
+                self._write_state(state)
+            kept = set(state["history"])
+            current_created = self.manifest(state["current"])["created_at"]
+            removed = [
+                v for v in self.versions()
+                if v not in kept and self.manifest(v)["created_at"] < current_created
+            ]
+            for version in removed:
+                shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+        return removed
+
+    # --- Reading ---
+    def current(self):
+        return self._state()["current"]
+
+    def versions(self):
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, MANIFEST))
+        )
+
+    def manifest(self, version):
+        with open(os.path.join(self.root, version, MANIFEST)) as f:
+            return json.load(f)
+
+    def load(self, version=None, mmap_mode="r"):
+        """Loads (model, manifest) for `version` (default: current).
+
+        joblib artifacts are memory-mapped, which only saves copies of numpy
+        arrays the unpickled estimator keeps as-is (e.g. LogisticRegression
+        coefficients). sklearn trees copy their node arrays when unpickled, so
+        every process holds its own copy of a forest.
+        Raises FileNotFoundError if nothing was promoted yet.
+        """
+        version = version or self.current()
+        if version is None:
+            raise FileNotFoundError(f"No promoted model in {self.root}")
+        manifest = self.manifest(version)
+        version_dir = os.path.join(self.root, version)
+
+        members = {}
+        for name, filename in manifest["artifacts"].items():
+            path = os.path.join(version_dir, filename)
+            if filename.endswith(".ubj"):
+                from xgboost import XGBClassifier
+                members[name] = XGBClassifier()
+                members[name].load_model(path)
+            else:
+                members[name] = joblib.load(path, mmap_mode=mmap_mode)
+
+        model = members if manifest["ensemble"] else members["model"]
+        return model, manifest
+
+    def _state(self):
+        try:
+            with open(os.path.join(self.root, STATE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"current": None, "history": []}
+
+    @contextmanager
+    def _locked(self):
+        with _state_lock, open(os.path.join(self.root, STATE + ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+    def _write_state(self, state):
+        path = os.path.join(self.root, STATE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(path + ".tmp", path)
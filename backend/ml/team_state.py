@@ -0,0 +1,184 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from collections import deque
+
+from .data_fetch import REQUIRED_COLUMNS, fill_results
+
+FEATURE_COLS = [
+    'Elo_Home', 'Elo_Away',
+    'Home_Form_Pts', 'Away_Form_Pts',
+    'Home_Form_GF', 'Away_Form_GF',
+    'Home_Form_GA', 'Away_Form_GA'
+]
+
+HOME_POINTS = {'H': 3, 'D': 1, 'A': 0}
+AWAY_POINTS = {'A': 3, 'D': 1, 'H': 0}
+TARGET_MAP = {'H': 0, 'D': 1, 'A': 2}
+
+
+class TeamState:
+    """Current (post-match) Elo rating and rolling form of every team.
+
+    Built once from the match history at train/refresh time and persisted next to
+    the models, so a prediction is a couple of dict lookups instead of a full
+    fetch + feature recompute. The same state doubles as an incremental feature
+    pipeline: `update` only applies matches it has not seen and returns their
+    pre-match features, identical to what `prepare_features` would compute.
+    """
+
+    def __init__(self, window=5, k_factor=20, base_rating=1500):
+        self.window = window
+        self.k_factor = k_factor
+        self.base_rating = base_rating
+        self.ratings = {}
+        self.recent = {}  # team -> deque of (points, goals_for, goals_against)
+        self.seen = set()  # (date, home, away) of every applied match
+        self.n_matches = 0
+        self.last_date = None
+
+    @property
+    def version(self):
+        return f"{self.n_matches}:{self.last_date}"
+
+    @property
+    def teams(self):
+        return sorted(self.ratings)
+
+    def new_matches(self, df):
+        """Rows of `df` that have not been applied to this state yet."""
+        keys = zip(df['Date'], df['HomeTeam'], df['AwayTeam'])
+        mask = np.fromiter((key not in self.seen for key in keys), dtype=bool, count=len(df))
+        return df[mask]
+
+    def can_append(self, new_df):
+        """True if `new_df` only contains matches played after the last applied one.
+
+        Anything older means the history was rewritten, and Elo (which depends on
+        match order) has to be recomputed from scratch. So does a late match on the
+        last applied day: its order within that day could differ from a recompute's.
+        """
+        if self.last_date is None or new_df.empty:
+            return True
+        return new_df['Date'].min() > self.last_date
+
+    def update(self, df):
+        """Folds unseen matches (sorted by date) into the state.
+
+        Returns those matches with their pre-match feature columns and `Target`,
+        in the same layout as `prepare_features` output. Rows are cleaned the way
+        `fetch_data` cleans them before `prepare_features`: matches without a score
+        are skipped and a missing FTR is derived from the goals.
+        """
+        df = fill_results(df.dropna(subset=REQUIRED_COLUMNS))
+        new_df = self.new_matches(df).copy()
+        feature_rows = []
+        rows = zip(new_df['Date'], new_df['HomeTeam'], new_df['AwayTeam'],
+                   new_df['FTHG'], new_df['FTAG'], new_df['FTR'])
+        for date, h_team, a_team, fthg, ftag, ftr in rows:
+            feature_rows.append(self._feature_row(h_team, a_team))
+            self._apply_match(h_team, a_team, fthg, ftag, ftr)
+            self.seen.add((date, h_team, a_team))
+            self.n_matches += 1
+            self.last_date = date
+
+        features = pd.DataFrame(feature_rows, columns=FEATURE_COLS, index=new_df.index)
+        for col in FEATURE_COLS:
+            new_df[col] = features[col]
+        new_df['Target'] = new_df['FTR'].astype(object).map(TARGET_MAP)
+        # Categorical columns (teams, results from data_fetch) cannot take a 0
+        return new_df.fillna({
+            col: 0 for col, dtype in new_df.dtypes.items() if not isinstance(dtype, pd.CategoricalDtype)
+        })
+
+    def _apply_match(self, h_team, a_team, fthg, ftag, ftr):
+        # Same update rule as feature_engineering.calculate_elo
+        h_rating = self.ratings.get(h_team, self.base_rating)
+        a_rating = self.ratings.get(a_team, self.base_rating)
+
+        expected_h = 1 / (1 + 10 ** ((a_rating - h_rating) / 400))
+        expected_a = 1 / (1 + 10 ** ((h_rating - a_rating) / 400))
+
+        if fthg > ftag:
+            actual_h, actual_a = 1, 0
+        elif fthg == ftag:
+            actual_h, actual_a = 0.5, 0.5
+        else:
+            actual_h, actual_a = 0, 1
+
+        self.ratings[h_team] = h_rating + self.k_factor * (actual_h - expected_h)
+        self.ratings[a_team] = a_rating + self.k_factor * (actual_a - expected_a)
+
+        # Same points/goals as feature_engineering.get_recent_form
+        self._recent(h_team).append((HOME_POINTS.get(ftr), fthg, ftag))
+        self._recent(a_team).append((AWAY_POINTS.get(ftr), ftag, fthg))
+
+    def _recent(self, team):
+        if team not in self.recent:
+            self.recent[team] = deque(maxlen=self.window)
+        return self.recent[team]
+
+    def form(self, team):
+        """Mean (points, goals for, goals against) over the team's last `window` matches."""
+        recent = self.recent.get(team)
+        if not recent:
+            return 0.0, 0.0, 0.0
+        n = len(recent)
+        return tuple(sum(match[i] for match in recent) / n for i in range(3))
+
+    def features(self, home_team, away_team):
+        """Feature row for a fixture that would be played after the last known match."""
+        if home_team not in self.ratings or away_team not in self.ratings:
+            raise ValueError("Team not found in history")
+        return self._feature_row(home_team, away_team)
+
+    def pair_features(self, teams):
+        """Every FEATURE_COLS column for all (home, away) pairs of `teams` as (n, n)
+        arrays indexed [home, away]; entry [i, j] equals `features(teams[i], teams[j])`."""
+        n = len(teams)
+        elo = np.array([self.ratings.get(team, self.base_rating) for team in teams], dtype=np.float64)
+        form = np.array([self.form(team) for team in teams], dtype=np.float64).reshape(n, 3)
+        home = lambda values: np.broadcast_to(values[:, None], (n, n))
+        away = lambda values: np.broadcast_to(values[None, :], (n, n))
+        return {
+            'Elo_Home': home(elo),
+            'Elo_Away': away(elo),
+            'Home_Form_Pts': home(form[:, 0]),
+            'Away_Form_Pts': away(form[:, 0]),
+            'Home_Form_GF': home(form[:, 1]),
+            'Away_Form_GF': away(form[:, 1]),
+            'Home_Form_GA': home(form[:, 2]),
+            'Away_Form_GA': away(form[:, 2])
+        }
+
+    def _feature_row(self, home_team, away_team):
+        h_pts, h_gf, h_ga = self.form(home_team)
+        a_pts, a_gf, a_ga = self.form(away_team)
+        return {
+            'Elo_Home': self.ratings.get(home_team, self.base_rating),
+            'Elo_Away': self.ratings.get(away_team, self.base_rating),
+            'Home_Form_Pts': h_pts,
+            'Away_Form_Pts': a_pts,
+            'Home_Form_GF': h_gf,
+            'Away_Form_GF': a_gf,
+            'Home_Form_GA': h_ga,
+            'Away_Form_GA': a_ga
+        }
+
+    def save(self, path):
+        # Written to a temp file and renamed: other processes reload as soon as it changes
+        tmp = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(self, tmp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        return joblib.load(path)
+
+    @classmethod
+    def from_history(cls, df, **kwargs):
+        state = cls(**kwargs)
+        state.update(df)
+        return state
@@ -1,62 +1,146 @@
-import optuna
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.model_selection import TimeSeriesSplit
 from sklearn.metrics import log_loss
 from sklearn.ensemble import RandomForestClassifier
 from xgboost import XGBClassifier
 from sklearn.linear_model import LogisticRegression
 import joblib
+import multiprocessing
 import os
 
 MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models_store")
+LABELS = [0, 1, 2]  # Home, Draw, Away
+XGB_MAX_ESTIMATORS = 1000
+XGB_EARLY_STOPPING = 30
+XGB_STOPPING_FRACTION = 0.2  # latest share of each fold's training rows held out for early stopping
 
-def objective_rf(trial, X_train, y_train, tscv):
-    n_estimators = trial.suggest_int('n_estimators', 50, 300)
-    max_depth = trial.suggest_int('max_depth', 3, 15)
-    
-    model = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=42)
-    
-    # Time Series Cross-Validation
+def make_folds(X, y, n_splits=5):
+    """TimeSeriesSplit folds as contiguous arrays, computed once and shared by every trial."""
+    X = np.ascontiguousarray(np.asarray(X, dtype=np.float64))
+    y = np.asarray(y, dtype=np.int64)
+    return [
+        (X[train_index], y[train_index], X[val_index], y[val_index])
+        for train_index, val_index in TimeSeriesSplit(n_splits=n_splits).split(X)
+    ]
+
+def suggest_params(trial, model_name):
+    if model_name == 'rf':
+        return {
+            'n_estimators': trial.suggest_int('n_estimators', 50, 300),
+            'max_depth': trial.suggest_int('max_depth', 3, 15)
+        }
+    if model_name == 'xgb':
+        return {
+            'max_depth': trial.suggest_int('max_depth', 3, 10),
+            'learning_rate': trial.suggest_float('learning_rate', 0.01, 0.3, log=True),
+            'subsample': trial.suggest_float('subsample', 0.5, 1.0),
+            'colsample_bytree': trial.suggest_float('colsample_bytree', 0.5, 1.0)
+        }
+    if model_name == 'logreg':
+        return {'C': trial.suggest_float('C', 1e-3, 1e3, log=True)}
+    raise ValueError(f"Unknown model type: {model_name}")
+
+def build_model(model_name, params):
+    if model_name == 'rf':
+        return RandomForestClassifier(**params, random_state=42)
+    if model_name == 'xgb':
+        return XGBClassifier(**params, eval_metric='mlogloss')
+    if model_name == 'logreg':
+        return LogisticRegression(**params, max_iter=1000)
+    raise ValueError(f"Unknown model type: {model_name}")
+
+def cv_objective(trial, model_name, folds):
+    """Mean validation log loss over the time-series folds.
+
+    The running mean is reported after every fold so the pruner can stop weak
+    trials early. XGBoost grows up to XGB_MAX_ESTIMATORS trees per fold and stops
+    once the loss on the latest XGB_STOPPING_FRACTION of the fold's training rows
+    stalls; the fold's validation rows are only ever scored.
+    """
+    params = suggest_params(trial, model_name)
     logloss_scores = []
-    for train_index, val_index in tscv.split(X_train):
-        X_tr, X_val = X_train.iloc[train_index], X_train.iloc[val_index]
-        y_tr, y_val = y_train.iloc[train_index], y_train.iloc[val_index]
-        
-        model.fit(X_tr, y_tr)
+    best_iterations = []
+    for step, (X_tr, y_tr, X_val, y_val) in enumerate(folds):
+        if model_name == 'xgb':
+            model = build_model(model_name, dict(
+                params, n_estimators=XGB_MAX_ESTIMATORS, early_stopping_rounds=XGB_EARLY_STOPPING
+            ))
+            split = len(X_tr) - max(1, int(len(X_tr) * XGB_STOPPING_FRACTION))
+            model.fit(X_tr[:split], y_tr[:split], eval_set=[(X_tr[split:], y_tr[split:])], verbose=False)
+            best_iterations.append(model.best_iteration + 1)
+        else:
+            model = build_model(model_name, params)
+            model.fit(X_tr, y_tr)
+
         preds = model.predict_proba(X_val)
-        logloss_scores.append(log_loss(y_val, preds))
-        
+        logloss_scores.append(log_loss(y_val, preds, labels=LABELS))
+
+        trial.report(sum(logloss_scores) / len(logloss_scores), step)
+        if trial.should_prune():
+            import optuna
+            raise optuna.TrialPruned()
+
+    if best_iterations:
+        trial.set_user_attr('n_estimators', int(np.mean(best_iterations)))
     return sum(logloss_scores) / len(logloss_scores)
 
-def tune_and_save(X, y, model_name, n_trials=50, study_name="epl_optimization"):
-    tscv = TimeSeriesSplit(n_splits=5)
-    
+def _storage(storage_url):
+    # optuna is imported on first use; only tuning runs need it
+    import optuna
+    # SQLite is shared by every tuning process; wait on its write lock instead of failing
+    return optuna.storages.RDBStorage(storage_url, engine_kwargs={"connect_args": {"timeout": 60}})
+
+def _load_study(study_name, storage_url):
+    import optuna
+    return optuna.create_study(
+        direction="minimize", study_name=study_name, storage=_storage(storage_url), load_if_exists=True,
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+    )
+
+def _optimize(study_name, storage_url, model_name, folds, n_trials, n_jobs):
+    study = _load_study(study_name, storage_url)
+    study.optimize(lambda trial: cv_objective(trial, model_name, folds), n_trials=n_trials, n_jobs=n_jobs)
+
+def tune_and_save(X, y, model_name, n_trials=50, study_name="epl_optimization",
+                  n_jobs=1, n_processes=1, n_splits=5, storage_url=None):
+    """Tunes `model_name` with Optuna and saves the refit best model.
+
+    Trials run on `n_jobs` threads in each of `n_processes` processes, all sharing
+    one study in SQLite storage; fold matrices are built once up front.
+    """
+    if model_name not in ('rf', 'xgb', 'logreg'):
+        raise ValueError(f"Unknown model type: {model_name}")
+
+    folds = make_folds(X, y, n_splits=n_splits)
+
     # Optuna setup
-    storage_url = f"sqlite:///{os.path.join(MODELS_DIR, 'optuna_study.db')}"
-    study = optuna.create_study(direction="minimize", study_name=study_name, storage=storage_url, load_if_exists=True)
-    
-    if model_name == 'rf':
-        objective = lambda trial: objective_rf(trial, X, y, tscv)
-    elif model_name == 'xgb':
-        # Placeholder for XGB objective (simplified for brevity)
-        objective = lambda trial: log_loss(y, XGBClassifier(n_estimators=100, max_depth=trial.suggest_int('max_depth', 3, 10)).fit(X,y).predict_proba(X))
-    elif model_name == 'logreg':
-        # Placeholder for LogReg objective
-        objective = lambda trial: log_loss(y, LogisticRegression(C=trial.suggest_loguniform('C', 1e-3, 1e3), max_iter=1000).fit(X,y).predict_proba(X))
+    storage_url = storage_url or f"sqlite:///{os.path.join(MODELS_DIR, 'optuna_study.db')}"
+    study_name = f"{study_name}_{model_name}"  # param spaces differ per model
+    # Create the study once, before any worker process attaches to it
+    _load_study(study_name, storage_url)
+
+    if n_processes > 1:
+        shares = [n_trials // n_processes + (i < n_trials % n_processes) for i in range(n_processes)]
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_processes, mp_context=ctx) as pool:
+            futures = [
+                pool.submit(_optimize, study_name, storage_url, model_name, folds, share, n_jobs)
+                for share in shares if share
+            ]
+            for future in futures:
+                future.result()
     else:
-        raise ValueError(f"Unknown model type: {model_name}")
+        _optimize(study_name, storage_url, model_name, folds, n_trials, n_jobs)
 
-    study.optimize(objective, n_trials=n_trials)
-    
     # Train final model with best params
-    best_params = study.best_params
-    if model_name == 'rf':
-        final_model = RandomForestClassifier(**best_params, random_state=42)
-    elif model_name == 'xgb':
-        final_model = XGBClassifier(**best_params, use_label_encoder=False, eval_metric='mlogloss')
-    elif model_name == 'logreg':
-        final_model = LogisticRegression(**best_params, max_iter=1000)
+    study = _load_study(study_name, storage_url)
+    best_params = dict(study.best_params)
+    if model_name == 'xgb':
+        best_params['n_estimators'] = study.best_trial.user_attrs.get('n_estimators', 100)
+    final_model = build_model(model_name, best_params)
 
-    final_model.fit(X, y)
+    final_model.fit(np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.int64))
     joblib.dump(final_model, os.path.join(MODELS_DIR, f"{model_name}_tuned_model.pkl"))
-    
+
     return study.best_value, best_params
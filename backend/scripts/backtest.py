@@ -0,0 +1,47 @@
+import argparse
+import json
+import sys
+import os
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from ml.backtest import FREQS, MODEL_TYPES, backtest
+from ml.data_fetch import fetch_data
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['rows']} matches, {config['folds']} {config['freq']} folds, {config['processes']} processes")
+    print(f"{'model':<10}{'n':>7}{'log loss':>10}{'accuracy':>10}{'brier':>8}{'ece':>8}")
+    for model_type, result in report["models"].items():
+        o = result["overall"]
+        print(f"{model_type:<10}{o['n']:>7}{o['log_loss']:>10.4f}{o['accuracy']:>10.3f}{o['brier']:>8.4f}{o['ece']:>8.4f}")
+
+    print("\nBy season (log loss / accuracy):")
+    for model_type, result in report["models"].items():
+        cells = [f"{s} {m['log_loss']:.3f}/{m['accuracy']:.3f}" for s, m in result["seasons"].items()]
+        print(f"  {model_type:<10}" + "  ".join(cells))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the model types over the match history")
+    parser.add_argument("--models", default=",".join(MODEL_TYPES), help="comma separated subset of: " + ", ".join(MODEL_TYPES))
+    parser.add_argument("--freq", choices=sorted(FREQS), default="month", help="retrain at every matchday (week) or month")
+    parser.add_argument("--warmup-days", type=int, default=365, help="history used before the first test block")
+    parser.add_argument("--processes", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--offline", action="store_true", help="only use CSVs already in backend/data")
+    parser.add_argument("--output", help="write the full report (incl. folds and calibration tables) as JSON")
+    args = parser.parse_args()
+
+    model_types = [m.strip() for m in args.models.split(",") if m.strip()]
+    unknown = set(model_types) - set(MODEL_TYPES)
+    if unknown:
+        parser.error(f"unknown model types: {', '.join(sorted(unknown))}")
+
+    start = time.perf_counter()
+    report = backtest(fetch_data(offline=args.offline or None), model_types=model_types, freq=args.freq,
+                      warmup_days=args.warmup_days, processes=args.processes)
+    print_report(report)
+    print(f"\nDone in {time.perf_counter() - start:.1f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.output}")
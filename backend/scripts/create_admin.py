@@ -3,12 +3,13 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from app.database import SessionLocal
+from app.database import SessionLocal, init_db
 from app.models import User
 from app.auth import get_password_hash
 from app.config import settings
 
 def create_admin(password):
+    init_db()
     db = SessionLocal()
     email = settings.ADMIN_EMAIL
     user = db.query(User).filter(User.email == email).first()
@@ -0,0 +1,16 @@
+import argparse
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app import database, matches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upsert the configured seasons (DATA_SEASONS x DATA_DIVISIONS) into the matches table")
+    parser.add_argument("--offline", action="store_true", help="only use CSVs already in backend/data")
+    args = parser.parse_args()
+
+    database.init_db()
+    matches.ensure_schema(database.engine)
+    result = matches.ingest(offline=args.offline or None)
+    print(f"{result['matches']} matches fetched, {result['written']} rows written in {result['seconds']}s")
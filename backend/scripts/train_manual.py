@@ -3,10 +3,12 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from ml.engine import MLEngine
+from app import database, matches
 from app.config import settings
 
 if __name__ == "__main__":
     print(f"Starting training for {settings.MODEL_TYPE}...")
     engine = MLEngine(model_type=settings.MODEL_TYPE)
-    metrics = engine.train()
+    database.init_db()
+    metrics = engine.train(matches.history())
     print(f"Training complete. Metrics: {metrics}")
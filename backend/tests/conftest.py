@@ -0,0 +1,27 @@
+import os
+import tempfile
+import pytest
+
+# Keep the test database out of backend/data
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+# Run ML work in-process so tests can swap in stub engines
+os.environ.setdefault("ML_WORKERS", "0")
+# Tests reload engines explicitly; the watcher would replace their stubs
+os.environ.setdefault("MODEL_CHECK_INTERVAL", "3600")
+
+@pytest.fixture
+def trained_engine(tmp_path, monkeypatch):
+    """Ensemble MLEngine trained on synthetic history, with artifacts in a temp dir."""
+    from ml import engine
+    from tests.test_ml import make_matches
+
+    df = make_matches(n_rounds=30, n_teams=8)
+    monkeypatch.setattr(engine, "fetch_data", lambda: df.copy())
+    monkeypatch.setattr(engine, "MODELS_DIR", str(tmp_path))
+    monkeypatch.setattr(engine, "SHAP_DIR", str(tmp_path))
+    monkeypatch.setattr(engine, "TEAM_STATE_PATH", str(tmp_path / "team_state.pkl"))
+    monkeypatch.setattr(engine, "HISTORY_PATH", str(tmp_path / "feature_history.pkl"))
+
+    ml_engine = engine.MLEngine(model_type="ensemble")
+    ml_engine.train()
+    return ml_engine
@@ -1,9 +1,19 @@
+import time
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 from app.auth import create_access_token
+from app import middleware, scheduler, schemas
 
 client = TestClient(app)
 
+@pytest.fixture(scope="module", autouse=True)
+def lifespan():
+    # Startup creates the tables and loads the engine in the background; wait so stubs are not replaced
+    with client:
+        assert scheduler.wait_loaded(timeout=60)
+        yield
+
 def test_read_main():
     response = client.get("/docs")
     assert response.status_code == 200
@@ -11,3 +21,268 @@ def test_read_main():
 def test_prediction_no_auth():
     response = client.post("/predict", json={"home_team": "Arsenal", "away_team": "Chelsea"})
     assert response.status_code == 401
+
+FEATURES = {
+    "Elo_Home": 1500.0, "Elo_Away": 1500.0, "Home_Form_Pts": 1.0, "Away_Form_Pts": 1.0,
+    "Home_Form_GF": 1.5, "Away_Form_GF": 1.0, "Home_Form_GA": 1.0, "Away_Form_GA": 1.5
+}
+
+class StubEngine:
+    def predict_proba(self, home_team, away_team, explain=False):
+        return self.predict_many([(home_team, away_team)])[0]
+
+    def predict_many(self, pairs, explain=False):
+        return [
+            {"probs": {"Home": 0.5, "Draw": 0.3, "Away": 0.2}, "shap_url": None, "features": FEATURES}
+            for _ in pairs
+        ]
+
+def test_batch_prediction_counts_whole_batch(monkeypatch):
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", StubEngine())
+    client.post("/register", json={"email": "batch@example.com", "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'batch@example.com'})}"}
+
+    # A full season fits in the daily limit
+    assert middleware.batch_cost(schemas.MAX_BATCH_FIXTURES) <= middleware.DAILY_LIMIT
+    fixtures = [{"home_team": "Arsenal", "away_team": "Chelsea"}] * schemas.MAX_BATCH_FIXTURES
+    response = client.post("/predict/batch", json={"fixtures": fixtures}, headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == schemas.MAX_BATCH_FIXTURES
+    assert response.json()[0]["home_team"] == "Arsenal"
+
+    # 19 of the 30 daily requests are used up, another season does not fit
+    response = client.post("/predict/batch", json={"fixtures": fixtures}, headers=headers)
+    assert response.status_code == 429
+
+def test_simulate_match_modes(monkeypatch):
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", StubEngine())
+    client.post("/register", json={"email": "sim@example.com", "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'sim@example.com'})}"}
+    fixture = {"home_team": "Arsenal", "away_team": "Chelsea"}
+
+    exact = client.post("/simulate-match", json={**fixture, "mode": "exact"}, headers=headers).json()
+    assert exact["sim_probs"] == {"Home": 0.5, "Draw": 0.3, "Away": 0.2}
+
+    sampled = client.post(
+        "/simulate-match", json={**fixture, "n_simulations": 2_000_000, "scorelines": True, "seed": 1}, headers=headers
+    ).json()
+    assert abs(sampled["sim_probs"]["Home"] - 0.5) < 0.01
+    assert sampled["scoreline_sim"]["expected_goals"] == {"Home": 1.5, "Away": 1.0}
+
+    too_many = client.post("/simulate-match", json={**fixture, "n_simulations": 10**8}, headers=headers)
+    assert too_many.status_code == 422
+
+def test_retrain_runs_as_background_job(monkeypatch):
+    from app.config import settings
+    monkeypatch.setattr(scheduler, "_train_job", lambda model_type: {"status": "trained", "rows": 10})
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+    generation = scheduler.engine_holder.generation
+
+    response = client.post("/admin/retrain", headers=headers)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    scheduler._jobs[job_id].result(timeout=30)
+
+    status = client.get(f"/admin/retrain/{job_id}", headers=headers).json()
+    for _ in range(50):  # the log row is written by the job's completion callback
+        if status["status"] != "running":
+            break
+        time.sleep(0.1)
+        status = client.get(f"/admin/retrain/{job_id}", headers=headers).json()
+    assert status["status"] == "succeeded"
+    assert status["metrics"] == {"status": "trained", "rows": 10}
+    assert scheduler.engine_holder.generation > generation
+    assert client.get("/admin/retrain/999999", headers=headers).status_code == 404
+
+def test_request_timings_metrics_and_admin_profiles(monkeypatch, tmp_path):
+    from app import profiling
+    from app.config import settings
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", StubEngine())
+    monkeypatch.setattr(profiling, "PROFILES_DIR", str(tmp_path))
+    client.post("/register", json={"email": "timing@example.com", "password": "secret"})
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    user = {"Authorization": f"Bearer {create_access_token({'sub': 'timing@example.com'})}"}
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+    fixture = {"home_team": "Arsenal", "away_team": "Chelsea"}
+
+    response = client.post("/predict", json=fixture, headers=user)
+    timing = response.headers["Server-Timing"]
+    for name in ("api.auth", "api.rate_limit", "api.inference", "api.log_prediction", "total"):
+        assert f"{name};dur=" in timing
+
+    text = client.get("/admin/metrics", headers=admin).text
+    assert 'epl_request_seconds_count{handler="predict_match",method="POST",status="200"}' in text
+    assert 'epl_stage_seconds_bucket{stage="api.inference",le="+Inf"}' in text
+    assert client.get("/admin/metrics", headers=user).status_code == 403
+
+    # Profiling is only honoured for admins
+    assert "X-Profile-Id" not in client.post("/predict", json=fixture, headers={**user, "X-Profile": "1"}).headers
+    profile_id = client.post("/predict", json=fixture, headers={**admin, "X-Profile": "1"}).headers["X-Profile-Id"]
+    report = client.get(f"/admin/profiles/{profile_id}", headers=admin)
+    assert report.status_code == 200
+    assert "POST /predict -> 200" in report.text
+    assert client.get("/admin/profiles/missing", headers=admin).status_code == 404
+
+def test_login_and_cached_principal(monkeypatch):
+    from app import auth, database, models
+    client.post("/register", json={"email": "cache@example.com", "password": "secret"})
+    assert client.post("/token", data={"username": "cache@example.com", "password": "wrong"}).status_code == 401
+    token = client.post("/token", data={"username": "cache@example.com", "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/admin/metrics", headers=headers).status_code == 403
+
+    # Later requests with the same token skip the users table
+    lookups = []
+    load = auth._load_principal
+    monkeypatch.setattr(auth, "_load_principal", lambda t: (lookups.append(t), load(t))[1])
+    for _ in range(3):
+        assert client.get("/admin/metrics", headers=headers).status_code == 403
+    assert lookups == []
+
+    # Changing the user drops the cached principal
+    db = database.SessionLocal()
+    db.query(models.User).filter(models.User.email == "cache@example.com").one().is_admin = True
+    db.commit()
+    db.close()
+    assert client.get("/admin/metrics", headers=headers).status_code == 200
+    assert lookups == [token]
+
+def test_concurrent_predictions(monkeypatch):
+    import threading
+    from app.config import settings
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", StubEngine())
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+    statuses = []
+
+    def worker():
+        for _ in range(10):
+            response = client.post("/predict", json={"home_team": "Arsenal", "away_team": "Chelsea"}, headers=headers)
+            statuses.append(response.status_code)
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert statuses == [200] * 80
+
+def test_readiness_waits_for_loaded_and_warmed_engine(monkeypatch, trained_engine):
+    from app.config import settings
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+    fixture = {"home_team": "Arsenal", "away_team": "Chelsea"}
+
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", None)
+    response = client.get("/ready")
+    assert response.status_code == 503 and response.json()["model_loaded"] is False
+    assert client.post("/predict", json=fixture, headers=headers).status_code == 503
+
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", trained_engine)
+    assert client.get("/ready").json()["warmed"] is False
+    assert trained_engine.warm_up() is not None
+    status = client.get("/ready")
+    assert status.status_code == 200
+    assert status.json()["ready"] is True and status.json()["model_version"] == trained_engine.model_version
+
+def test_engine_follows_models_promoted_by_other_workers(monkeypatch, trained_engine):
+    from ml.engine import MLEngine
+    monkeypatch.setattr(scheduler, "_model_type", "ensemble")
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", trained_engine)
+    assert scheduler.reload_if_stale() is False
+
+    # Another app worker trains and promotes a new version
+    other = MLEngine(model_type="ensemble")
+    other.train()
+    generation = scheduler.engine_holder.generation
+    assert scheduler.reload_if_stale() is True
+    assert scheduler.engine_holder.get().model_version == other.model_version
+    assert scheduler.engine_holder.generation == generation + 1
+    assert scheduler.reload_if_stale() is False
+
+def test_rollback_reloads_the_serving_engine(monkeypatch, trained_engine):
+    from ml.engine import MLEngine
+    from app.config import settings
+    monkeypatch.setattr(scheduler, "_model_type", "ensemble")
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", trained_engine)
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+    first = trained_engine.model_version
+    MLEngine(model_type="ensemble").train()
+    scheduler.reload_if_stale()
+
+    assert client.post("/admin/models/rollback", headers=headers).json() == {"current": first}
+    models = client.get("/admin/models", headers=headers).json()
+    assert models["current"] == models["serving"] == first
+
+def test_refresh_swaps_in_a_new_snapshot(monkeypatch, trained_engine):
+    from app import matches
+    from app.config import settings
+    from tests.test_ml import make_matches
+    monkeypatch.setattr(scheduler, "_model_type", "ensemble")
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", trained_engine)
+    monkeypatch.setattr(matches, "history", lambda refresh=False: make_matches(n_rounds=31, n_teams=8))
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+    snapshot = trained_engine.team_state.version
+
+    assert client.post("/admin/refresh", headers=headers).json()["status"] == "refreshed"
+    # The serving engine was replaced, never updated in place
+    assert trained_engine.team_state.version == snapshot
+    refreshed = scheduler.engine_holder.get()
+    assert refreshed is not trained_engine and refreshed.team_state.version != snapshot
+    assert scheduler.reload_if_stale() is False
+
+def test_ingest_and_team_matches(monkeypatch):
+    from app import matches
+    from app.config import settings
+    from tests.test_ml import make_matches
+    df = make_matches(n_rounds=6, n_teams=4)
+    monkeypatch.setattr(matches, "fetch_data", lambda offline=None: df.copy())
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+
+    result = client.post("/admin/matches/ingest", headers=headers).json()
+    assert result["matches"] == len(df) and result["written"] >= 0
+    response = client.get("/teams/Team1/matches", params={"start": "2023-08-01", "limit": 2}, headers=headers)
+    assert response.status_code == 200
+    rows = response.json()
+    assert len(rows) == 2 and rows[0]["date"] > rows[1]["date"]
+    assert rows[0]["season"] == "2324"
+    assert client.get("/teams/Team1/matches", params={"limit": 0}, headers=headers).status_code == 400
+
+def test_matchups_matrix(monkeypatch, trained_engine):
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", trained_engine)
+    client.post("/register", json={"email": "matchups@example.com", "password": "secret"})
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'matchups@example.com'})}"}
+
+    table = client.get("/matchups", headers=headers).json()
+    n = len(trained_engine.team_state.teams)
+    assert table["teams"] == trained_engine.team_state.teams and len(table["probs"]) == n and len(table["probs"][0]) == n
+    assert table["model_version"] == trained_engine.model_version
+    block = client.get("/matchups", params={"teams": "Team3,Team1"}, headers=headers).json()
+    assert block["teams"] == ["Team3", "Team1"]
+    assert block["probs"][0][1] == table["probs"][3][1]
+    assert client.get("/matchups", params={"teams": "Nobody"}, headers=headers).status_code == 400
+
+def test_admin_stats_count_cache_lookups_in_pool_workers(monkeypatch, trained_engine):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.config import settings
+    from ml.engine import MLEngine
+    client.post("/register", json={"email": settings.ADMIN_EMAIL, "password": "secret"})
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': settings.ADMIN_EMAIL})}"}
+    monkeypatch.setattr(scheduler, "_model_type", "ensemble")
+    monkeypatch.setattr(scheduler.engine_holder, "_engine", trained_engine)
+    # A thread with its own engine stands in for a pool worker process
+    monkeypatch.setattr(scheduler, "_worker", {"generation": scheduler.engine_holder.generation, "engine": MLEngine(model_type="ensemble")})
+    monkeypatch.setattr(scheduler, "_worker_cache_stats", {})
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(scheduler, "_pool", pool)
+
+    for _ in range(3):
+        scheduler.run("predict_proba", "Team0", "Team1")
+    pool.shutdown()
+
+    stats = client.get("/admin/stats", headers=admin).json()["prediction_cache"]
+    assert trained_engine.prediction_cache.stats()["hits"] == 0
+    assert stats["hits"] == 2 and stats["misses"] == 1 and stats["processes"] == 2
@@ -0,0 +1,29 @@
+from benchmarks.run import compare, over_target, run
+from benchmarks.synthetic import make_history
+
+def test_synthetic_history_layout():
+    df = make_history(5_000, n_teams=60, seed=1)
+    assert len(df) == 5_000
+    assert df['Date'].is_monotonic_increasing
+    assert df['HomeTeam'].nunique() == 60
+    assert (df['HomeTeam'] != df['AwayTeam']).all()
+    assert set(df['FTR']) == {'H', 'D', 'A'}
+    assert (df['HST'] <= df['HS']).all()
+    # Three divisions, each with its own season files
+    assert df['raw_source'].str.endswith(('_D1.csv', '_D2.csv', '_D3.csv')).all()
+
+def test_compare_flags_regressions_over_threshold():
+    baseline = {"results": {"a": {"median_s": 1.0}, "b": {"median_s": 1.0}}}
+    results = {"a": {"median_s": 1.2}, "b": {"median_s": 1.3}, "new": {"median_s": 5.0}}
+    rows = {case: regressed for case, _, _, _, regressed in compare(results, baseline, threshold=0.25)}
+    assert rows == {"a": False, "b": True}
+
+def test_over_target_flags_absolute_budgets():
+    results = {"simulate_standings": {"median_s": 1.5}, "train": {"median_s": 9.0}}
+    assert over_target(results, {"simulate_standings": 1.0}) == ["simulate_standings"]
+    assert over_target(results, {"simulate_standings": 2.0}) == []
+
+def test_feature_cases_run_on_small_history():
+    results = run(2_000, 20, cases=["calculate_elo", "get_recent_form"])
+    assert set(results) == {"calculate_elo", "get_recent_form"}
+    assert all(r["median_s"] > 0 for r in results.values())
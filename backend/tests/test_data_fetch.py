@@ -0,0 +1,134 @@
+import os
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from ml import data_fetch
+
+CSV = (
+    "Div,Date,HomeTeam,AwayTeam,FTHG,FTAG,FTR\n"
+    "E0,12/08/2023,Arsenal,Chelsea,2,1,H\n"
+    "E0,19/08/2023,Chelsea,Arsenal,1,1,D\n"
+)
+
+class StandIn(BaseHTTPRequestHandler):
+    # Minimal football-data.co.uk stand-in that honours If-None-Match
+    etag = '"v1"'
+    body = CSV.encode()
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stand_in(tmp_path, monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StandIn.hits = []
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    monkeypatch.setattr(data_fetch, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(data_fetch, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(data_fetch, "META_PATH", str(tmp_path / "meta.json"))
+    monkeypatch.setattr(data_fetch, "URLS", [f"{base}/mmz4281/2324/E0.csv", f"{base}/mmz4281/2223/E0.csv"])
+    monkeypatch.setattr(data_fetch, "CHECK_INTERVAL", 0)
+    monkeypatch.setattr(data_fetch, "_memo", {})
+    monkeypatch.setattr(data_fetch, "_checked", {})
+    yield
+    server.shutdown()
+
+def test_fetch_uses_conditional_requests_and_cache(stand_in):
+    df = data_fetch.fetch_data()
+    assert len(df) == 4
+    assert set(df['raw_source']) == {"2324_E0.csv", "2223_E0.csv"}
+    assert str(df['Date'].dtype).startswith("datetime64")
+    assert StandIn.hits == [None, None]
+
+    # Second call revalidates with the stored ETag and gets 304s back
+    df['Elo_Home'] = 0
+    again = data_fetch.fetch_data()
+    assert StandIn.hits[2:] == ['"v1"', '"v1"']
+    assert 'Elo_Home' not in again.columns
+    assert len(again) == 4
+
+def test_meta_is_only_rewritten_when_files_change(stand_in, monkeypatch):
+    data_fetch.fetch_data()
+    saves = []
+    monkeypatch.setattr(data_fetch, "_save_meta", saves.append)
+
+    data_fetch.fetch_data()  # 304s
+    data_fetch.fetch_data(offline=True)
+    assert saves == []
+
+    StandIn.etag = '"v2"'
+    try:
+        data_fetch.fetch_data()
+    finally:
+        StandIn.etag = '"v1"'
+    assert len(saves) == 1
+
+def test_partial_parse_is_not_cached(stand_in, monkeypatch):
+    data_fetch.fetch_data()
+    data_fetch._memo.clear()
+    for name in os.listdir(data_fetch.CACHE_DIR):
+        os.remove(os.path.join(data_fetch.CACHE_DIR, name))
+
+    read = data_fetch._read
+    monkeypatch.setattr(data_fetch, "_read", lambda path: read(path) if "2324" in path else 1 / 0)
+    assert len(data_fetch.fetch_data(offline=True)) == 2
+
+    # Once the file parses again the missing season is back
+    monkeypatch.setattr(data_fetch, "_read", read)
+    assert len(data_fetch.fetch_data(offline=True)) == 4
+
+def test_offline_mode_reads_local_files_only(stand_in):
+    data_fetch.fetch_data()
+    n_hits = len(StandIn.hits)
+    data_fetch._memo.clear()
+
+    df = data_fetch.fetch_data(offline=True)
+    assert len(StandIn.hits) == n_hits
+    assert len(df) == 4
+
+def test_history_is_parsed_into_compact_columns(tmp_path, monkeypatch):
+    (tmp_path / "2324_E0.csv").write_text(
+        "Div,Date,Time,HomeTeam,AwayTeam,FTHG,FTAG,FTR,Referee,B365H\n"
+        "E0,12/08/2023,15:00,Arsenal,Chelsea,2,1,H,M Dean,1.9\n"
+        "E0,19/08/2023,15:00,Chelsea,Arsenal,,,,M Dean,2.1\n"  # not played yet
+    )
+    (tmp_path / "0203_E1.csv").write_text(
+        "Div,Date,HomeTeam,AwayTeam,FTHG,FTAG,FTR,HS,AS\n"
+        "E1,17/08/02,Burnley,Arsenal,0,0,D,7,12\n"
+        "E1,24/08/02,Arsenal,Burnley,3,1,,9,4\n"  # result column left empty
+    )
+    monkeypatch.setattr(data_fetch, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(data_fetch, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(data_fetch, "META_PATH", str(tmp_path / "meta.json"))
+    monkeypatch.setattr(data_fetch, "URLS", ["https://x.invalid/mmz4281/2324/E0.csv", "https://x.invalid/mmz4281/0203/E1.csv"])
+    monkeypatch.setattr(data_fetch, "_memo", {})
+
+    df = data_fetch.fetch_data(offline=True)
+    assert list(df.columns) == ['Div', 'Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'FTR', 'raw_source', 'HS', 'AS']
+    assert list(df['Date'].dt.strftime("%Y-%m-%d")) == ["2002-08-17", "2002-08-24", "2023-08-12"]
+    assert df['HomeTeam'].dtype == df['AwayTeam'].dtype
+    assert list(df['HomeTeam'].cat.categories) == ["Arsenal", "Burnley", "Chelsea"]
+    assert df['FTHG'].dtype == "int8" and df['HS'].dtype == "float32"
+    assert list(df['FTR'].cat.categories) == ['H', 'D', 'A']
+    assert list(df['FTR']) == ['D', 'H', 'H']
+    assert list(df['raw_source']) == ["0203_E1.csv", "0203_E1.csv", "2324_E0.csv"]
+
+    # A new process reuses the combined parse
+    monkeypatch.setattr(data_fetch, "_memo", {})
+    monkeypatch.setattr(data_fetch, "_read", lambda path: pytest.fail("re-parsed"))
+    assert data_fetch.fetch_data(offline=True).equals(df)
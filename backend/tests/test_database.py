@@ -0,0 +1,57 @@
+import multiprocessing
+import pytest
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.exc import OperationalError
+from app import database, models
+
+def _write_predictions(url, worker, n):
+    from app import database, models
+    engine = database.create_db_engine(url)
+    for i in range(n):
+        # One small transaction per row: the worst case for lock contention
+        with engine.begin() as conn:
+            conn.execute(insert(models.Prediction.__table__), [
+                {"user_id": worker, "home_team": "Arsenal", "away_team": "Chelsea", "probs_json": {"Home": i}}
+            ])
+    engine.dispose()
+
+def test_sqlite_connections_are_tuned(tmp_path):
+    url = f"sqlite:///{tmp_path / 'tuned.db'}"
+    engine = database.create_db_engine(url)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.settings.DB_BUSY_TIMEOUT
+    assert engine.pool.size() == database.settings.DB_POOL_SIZE
+
+    read_engine = database.create_db_engine(url, read_only=True)
+    with pytest.raises(OperationalError):
+        with read_engine.begin() as conn:
+            conn.execute(text("CREATE TABLE t (x INTEGER)"))
+
+def test_concurrent_writer_processes_do_not_hit_lock_errors(tmp_path):
+    url = f"sqlite:///{tmp_path / 'shared.db'}"
+    engine = database.create_db_engine(url)
+    models.Base.metadata.create_all(bind=engine)
+
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=_write_predictions, args=(url, w, 100)) for w in range(4)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(timeout=120)
+    assert [p.exitcode for p in workers] == [0] * 4
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(models.Prediction.__table__)).scalar() == 400
+
+def test_init_db_adds_columns_missing_from_old_tables(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE retrain_logs (id INTEGER PRIMARY KEY, started_at DATETIME, "
+                          "finished_at DATETIME, metrics_json JSON)"))
+        conn.execute(text("INSERT INTO retrain_logs (id) VALUES (1)"))
+
+    database.init_db(engine)
+    database.init_db(engine)  # a second worker finds nothing to do
+    with engine.connect() as conn:
+        assert conn.execute(select(models.RetrainLog.__table__.c.status)).scalar() is None
@@ -0,0 +1,104 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from app import database, matches, models, utils
+from ml.feature_engineering import prepare_features
+from tests.test_ml import make_matches
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'matches.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+def history_frame():
+    # Two seasons of the main division plus a second division, as fetch_data returns them
+    old, new = make_matches(n_rounds=20, n_teams=6, seed=1), make_matches(n_rounds=10, n_teams=6, seed=2)
+    old['Date'] -= pd.Timedelta(days=365)
+    second = make_matches(n_rounds=10, n_teams=4, seed=3).replace({'Team0': 'Lower0', 'Team1': 'Lower1', 'Team2': 'Lower2', 'Team3': 'Lower3'})
+    old[['Div', 'raw_source']] = 'E0', '2223_E0.csv'
+    new[['Div', 'raw_source']] = 'E0', '2324_E0.csv'
+    second[['Div', 'raw_source']] = 'E1', '2324_E1.csv'
+    return pd.concat([old, new, second], ignore_index=True).sort_values('Date', kind='stable', ignore_index=True)
+
+def test_upsert_is_idempotent_and_updates_changed_results(engine):
+    df = history_frame()
+    assert matches.upsert_matches(df, engine=engine) == len(df)
+    assert matches.upsert_matches(df, engine=engine) == 0  # nothing changed
+
+    df.loc[0, ['FTHG', 'FTAG']] = 5, 0
+    assert matches.upsert_matches(df, engine=engine) == 1
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT count(*), count(DISTINCT season) FROM matches")).one()
+        first = conn.execute(text("SELECT home_goals, ftr, season FROM matches ORDER BY date, id LIMIT 1")).one()
+    assert tuple(rows) == (len(df), 2)
+    assert tuple(first) == (5, 'H', '2223')
+
+def test_db_history_matches_csv_history(engine):
+    df = history_frame()
+    matches.upsert_matches(df, engine=engine)
+
+    loaded = matches.load_history(engine=engine)
+    assert len(loaded) == len(df) and isinstance(loaded['HomeTeam'].dtype, pd.CategoricalDtype)
+    from_db, _ = prepare_features(loaded)
+    from_csv, _ = prepare_features(df.copy())
+    assert from_db['Elo_Home'].tolist() == pytest.approx(from_csv['Elo_Home'].tolist())
+
+    season = matches.current_season(engine=engine)
+    expected = utils.current_season(df)
+    assert len(season) == len(expected) and set(season['raw_source']) == {'2324_E0.csv'}
+    assert len(matches.load_history(start='2023-08-01', divisions=['E1'], engine=engine)) == (df['Div'] == 'E1').sum()
+
+    recent = matches.team_matches('Team1', start='2023-09-01', limit=3, engine=engine)
+    assert len(recent) == 3 and recent[0]['date'] > recent[-1]['date']
+    assert all('Team1' in (r['home_team'], r['away_team']) for r in recent)
+
+def test_history_queries_use_indexes(engine):
+    plans = {
+        "team": "SELECT * FROM matches WHERE (home_team = 'Team1' OR away_team = 'Team1') AND date >= '2023-09-01'",
+        "season": "SELECT * FROM matches WHERE season = '2324' AND division = 'E0'",
+        "latest": "SELECT season FROM matches WHERE division = 'E0' ORDER BY date DESC LIMIT 1",
+        "range": "SELECT * FROM matches WHERE date >= '2023-09-01' AND date < '2024-01-01'",
+    }
+    with engine.connect() as conn:
+        for name, sql in plans.items():
+            plan = " ".join(row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql))
+            assert "USING INDEX ix_matches_" in plan and "SCAN matches" not in plan, (name, plan)
+
+def test_schema_upgrade_of_existing_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE matches (id INTEGER PRIMARY KEY, date DATETIME, home_team VARCHAR, away_team VARCHAR, "
+            "home_goals INTEGER, away_goals INTEGER, ftr VARCHAR, raw_source VARCHAR)"
+        ))
+        conn.execute(text("INSERT INTO matches (date, home_team, away_team, home_goals, away_goals, ftr) VALUES "
+                          "('2024-01-01 00:00:00.000000', 'A', 'B', 1, 0, 'H'), ('2024-01-01 00:00:00.000000', 'A', 'B', 2, 0, 'H')"))
+
+    matches.ensure_schema(engine)
+    matches.ensure_schema(engine)  # idempotent
+
+    assert {"season", "division"} <= {c["name"] for c in inspect(engine).get_columns("matches")}
+    assert {ix["name"] for ix in inspect(engine).get_indexes("matches")} >= {ix.name for ix in models.Match.__table__.indexes}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT home_goals FROM matches")).scalars().all() == [2]
+
+def test_schema_upgrade_tolerates_a_concurrent_worker(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE matches (id INTEGER PRIMARY KEY, date DATETIME, home_team VARCHAR, away_team VARCHAR, "
+            "home_goals INTEGER, away_goals INTEGER, ftr VARCHAR, raw_source VARCHAR)"
+        ))
+    stale = inspect(engine).get_indexes("matches")
+
+    class StaleInspector:
+        # What this worker saw before another worker upgraded the table
+        def get_indexes(self, name):
+            return stale
+
+    matches.ensure_schema(engine)  # the other worker
+    monkeypatch.setattr(matches, "inspect", lambda bind: StaleInspector())
+    matches.ensure_schema(engine)
+
+    assert {ix["name"] for ix in inspect(engine).get_indexes("matches")} >= {ix.name for ix in models.Match.__table__.indexes}
@@ -1,8 +1,14 @@
 import sys
 import os
 import pytest
+import numpy as np
 import pandas as pd
-from ml.feature_engineering import prepare_features
+from ml.feature_engineering import prepare_features, calculate_elo, calculate_elo_grid, form_column, form_features, get_recent_form
+from ml.team_state import TeamState, FEATURE_COLS, TARGET_MAP
+from ml.data_fetch import fill_results
+from ml.backtest import backtest, fold_bounds
+from ml.cache import PredictionCache
+from ml.engine import MLEngine
 
 def test_feature_engineering():
     # Mock data
@@ -25,3 +31,435 @@ def test_feature_engineering():
     # Check Target mapping (H=0, D=1, A=2)
     assert processed_df.iloc[0]['Target'] == 0
     assert processed_df.iloc[1]['Target'] == 1
+
+def test_team_state_matches_next_fixture_features():
+    data = {
+        'Date': ['01/01/2023', '08/01/2023', '15/01/2023', '22/01/2023'],
+        'HomeTeam': ['TeamA', 'TeamB', 'TeamC', 'TeamA'],
+        'AwayTeam': ['TeamB', 'TeamC', 'TeamA', 'TeamC'],
+        'FTHG': [1, 2, 0, 3],
+        'FTAG': [0, 2, 1, 1],
+        'FTR': ['H', 'D', 'A', 'H']
+    }
+    df = pd.DataFrame(data)
+    df['Date'] = pd.to_datetime(df['Date'], dayfirst=True)
+    state = TeamState.from_history(df)
+
+    # The snapshot must equal the pre-match features of a fixture played right after the history
+    upcoming = pd.DataFrame({
+        'Date': [pd.Timestamp('2023-01-29')], 'HomeTeam': ['TeamB'], 'AwayTeam': ['TeamA'],
+        'FTHG': [0], 'FTAG': [0], 'FTR': ['D']
+    })
+    processed_df, features = prepare_features(pd.concat([df, upcoming], ignore_index=True))
+    expected = processed_df.iloc[-1][features].to_dict()
+
+    assert state.features('TeamB', 'TeamA') == pytest.approx(expected)
+    assert state.n_matches == 4
+    with pytest.raises(ValueError):
+        state.features('TeamB', 'Unknown')
+
+def make_matches(n_rounds=10, n_teams=6, seed=0):
+    # Synthetic double round-robin style history: one round per week
+    rng = np.random.default_rng(seed)
+    teams = [f"Team{i}" for i in range(n_teams)]
+    rows = []
+    for r in range(n_rounds):
+        order = rng.permutation(teams)
+        for i in range(0, n_teams, 2):
+            hg, ag = rng.poisson(1.4), rng.poisson(1.1)
+            rows.append({
+                'Date': pd.Timestamp('2023-08-05') + pd.Timedelta(weeks=r),
+                'HomeTeam': order[i], 'AwayTeam': order[i + 1],
+                'FTHG': hg, 'FTAG': ag,
+                'FTR': 'H' if hg > ag else ('D' if hg == ag else 'A')
+            })
+    return pd.DataFrame(rows)
+
+def test_incremental_update_matches_full_recompute():
+    df = make_matches()
+    full_df, features = prepare_features(df.copy())
+
+    # Apply the history in three refreshes, the last one re-sending already seen rows
+    state = TeamState()
+    parts = [state.update(df.iloc[:21]), state.update(df.iloc[:24]), state.update(df)]
+    incremental_df = pd.concat(parts)
+
+    assert list(incremental_df.index) == list(range(len(df)))
+    pd.testing.assert_frame_equal(
+        incremental_df[features + ['Target']], full_df[features + ['Target']], check_dtype=False
+    )
+    assert state.ratings == TeamState.from_history(df).ratings
+    assert state.update(df).empty
+    assert not state.can_append(df.iloc[:3])
+    # A late match on the last applied day may sort differently in a full recompute
+    assert not state.can_append(df.iloc[-1:])
+
+def test_update_skips_matches_without_result():
+    df = make_matches(n_rounds=2)
+    pending = df.iloc[-1:].assign(Date=df['Date'].max() + pd.Timedelta(days=7), FTHG=np.nan, FTAG=np.nan, FTR=None)
+    state = TeamState()
+    new_rows = state.update(pd.concat([df, pending], ignore_index=True))
+
+    assert len(new_rows) == len(df)
+    assert state.n_matches == len(df)
+    assert all(np.isfinite(state.form(team)).all() for team in state.teams)
+
+def test_update_derives_missing_result_like_fetch_data():
+    df = make_matches(n_rounds=6)
+    no_ftr = df.assign(FTR=df['FTR'].where(df.index % 3 != 0))
+    state = TeamState()
+    incremental = pd.concat([state.update(no_ftr.iloc[:10]), state.update(no_ftr)])
+
+    full = TeamState.from_history(fill_results(no_ftr))
+    assert len(incremental) == len(df)
+    assert state.ratings == full.ratings == TeamState.from_history(df).ratings
+    assert list(incremental['Target']) == list(df['FTR'].map(TARGET_MAP))
+
+def legacy_calculate_elo(df, k_factor=20, base_rating=1500):
+    # Original iterrows implementation, kept as the reference for the array engine
+    ratings = {team: base_rating for team in set(df['HomeTeam']).union(set(df['AwayTeam']))}
+    elo_home, elo_away = [], []
+    for _, row in df.iterrows():
+        h_rating, a_rating = ratings[row['HomeTeam']], ratings[row['AwayTeam']]
+        elo_home.append(h_rating)
+        elo_away.append(a_rating)
+        expected_h = 1 / (1 + 10 ** ((a_rating - h_rating) / 400))
+        expected_a = 1 / (1 + 10 ** ((h_rating - a_rating) / 400))
+        if row['FTHG'] > row['FTAG']:
+            actual_h, actual_a = 1, 0
+        elif row['FTHG'] == row['FTAG']:
+            actual_h, actual_a = 0.5, 0.5
+        else:
+            actual_h, actual_a = 0, 1
+        ratings[row['HomeTeam']] = h_rating + k_factor * (actual_h - expected_h)
+        ratings[row['AwayTeam']] = a_rating + k_factor * (actual_a - expected_a)
+    return np.array(elo_home, dtype=float), np.array(elo_away, dtype=float)
+
+def test_array_elo_matches_legacy_bit_for_bit():
+    df = make_matches(n_rounds=40, n_teams=12, seed=3)
+    k_factors = [10, 20, 32]
+
+    elo_df = calculate_elo(df.copy())
+    grid_home, grid_away = calculate_elo_grid(df, k_factors, base_ratings=1500)
+    assert grid_home.shape == (3, len(df))
+
+    ref_home, ref_away = legacy_calculate_elo(df)
+    assert np.array_equal(elo_df['Elo_Home'].to_numpy(), ref_home)
+    assert np.array_equal(elo_df['Elo_Away'].to_numpy(), ref_away)
+
+    for i, k in enumerate(k_factors):
+        ref_home, ref_away = legacy_calculate_elo(df, k_factor=k)
+        np.testing.assert_allclose(grid_home[i], ref_home, rtol=1e-12)
+        np.testing.assert_allclose(grid_away[i], ref_away, rtol=1e-12)
+
+def reference_form(df, window, stat_cols, venue=False):
+    # Plain per-match loop: mean of the team's last `window` non-missing values
+    history = {}
+    rows = []
+    for _, row in df.sort_values('Date', kind='stable').iterrows():
+        out = {}
+        for side, team in (('Home', row['HomeTeam']), ('Away', row['AwayTeam'])):
+            key = (team, side) if venue else team
+            past = history.setdefault(key, [])[-window:]
+            for stat, cols in stat_cols.items():
+                vals = [v[stat] for v in past if not np.isnan(v[stat])]
+                out[(side, stat)] = np.mean(vals) if vals else 0.0
+        for side, team, own in (('Home', row['HomeTeam'], 0), ('Away', row['AwayTeam'], 1)):
+            key = (team, side) if venue else team
+            history[key].append({stat: float(row[cols[own]]) for stat, cols in stat_cols.items()})
+        rows.append((row.name, out))
+    return dict(rows)
+
+def test_form_features_windows_venue_and_missing_values():
+    df = make_matches(n_rounds=12, n_teams=6, seed=5)
+    rng = np.random.default_rng(1)
+    df['HS'] = rng.integers(3, 20, len(df)).astype(float)
+    df['AS'] = rng.integers(3, 20, len(df)).astype(float)
+    df.loc[[4, 9], 'HS'] = np.nan
+    stat_cols = {'GF': ('FTHG', 'FTAG'), 'Shots': ('HS', 'AS')}
+
+    for venue in (False, True):
+        features = form_features(df, windows=(3, 5), stats=('GF', 'Shots'), venue=venue)
+        assert list(features.index) == list(df.index)
+        for window in (3, 5):
+            expected = reference_form(df, window, stat_cols, venue=venue)
+            for i in df.index:
+                for side in ('Home', 'Away'):
+                    for stat in stat_cols:
+                        col = form_column(side, stat, window, venue)
+                        assert features.at[i, col] == pytest.approx(expected[i][(side, stat)]), (col, i)
+
+def test_recent_form_keeps_rows_when_a_team_plays_twice_on_one_date():
+    df = pd.DataFrame({
+        'Date': pd.to_datetime(['2023-08-05', '2023-08-05', '2023-08-12']),
+        'HomeTeam': ['TeamA', 'TeamB', 'TeamA'],
+        'AwayTeam': ['TeamB', 'TeamA', 'TeamC'],
+        'FTHG': [2, 1, 0], 'FTAG': [0, 1, 3], 'FTR': ['H', 'D', 'A']
+    }, index=[10, 11, 12])
+
+    form = get_recent_form(df)
+    assert list(form.index) == [10, 11, 12]
+    # The second same-day fixture sees the first one, by row order
+    assert form.loc[11, 'Away_Form_Pts'] == 3
+    assert form.loc[11, 'Home_Form_Pts'] == 0
+    assert form.loc[12, 'Home_Form_Pts'] == 2
+    assert form.loc[12, 'Home_Form_GF'] == 1.5
+
+def test_predict_many_matches_single_predictions(trained_engine):
+    pairs = [('Team0', 'Team1'), ('Team2', 'Team3'), ('Team1', 'Team0')]
+    batch = trained_engine.predict_many(pairs)
+
+    assert len(batch) == 3
+    assert all(r['shap_url'] is None for r in batch)
+    for (home_team, away_team), result in zip(pairs, batch):
+        single = trained_engine.predict_proba(home_team, away_team)
+        assert single['probs'] == pytest.approx(result['probs'])
+        assert sum(result['probs'].values()) == pytest.approx(1)
+
+    with pytest.raises(ValueError):
+        trained_engine.predict_many([('Team0', 'Unknown')])
+
+def test_explanations_are_lazy_cached_and_pruned(trained_engine, tmp_path):
+    from ml import engine
+
+    assert trained_engine.predict_proba('Team0', 'Team1')['shap_url'] is None
+    assert trained_engine._explainer is None
+
+    first = trained_engine.predict_proba('Team0', 'Team1', explain=True)
+    explainer = trained_engine._explainer
+    second = trained_engine.predict_proba('Team0', 'Team1', explain=True)
+    assert first['shap_url'] == second['shap_url']
+    assert set(first['shap_values']) == set(trained_engine.feature_cols)
+    assert trained_engine._explainer is explainer
+
+    # Rendering happens on the background worker
+    engine._render_pool.submit(lambda: None).result()
+    plot = tmp_path / first['shap_url'].rsplit('/', 1)[-1]
+    assert plot.exists()
+
+    (tmp_path / 'old.png').write_bytes(b'')
+    os.utime(tmp_path / 'old.png', (0, 0))
+    engine.prune_shap_dir()
+    assert not (tmp_path / 'old.png').exists()
+    assert plot.exists()
+    engine.prune_shap_dir(max_files=0)
+    assert not plot.exists()
+
+def test_prediction_cache_hits_and_invalidation(trained_engine):
+    cache = trained_engine.prediction_cache
+    first = trained_engine.predict_proba('Team0', 'Team1')
+    assert cache.stats()['misses'] == 1
+
+    first['probs']['Home'] = -1  # callers get copies, not the cached entry
+    second = trained_engine.predict_proba('Team0', 'Team1')
+    assert cache.stats()['hits'] == 1
+    assert second['probs']['Home'] >= 0
+
+    trained_engine.refresh_team_state()
+    assert cache.stats()['size'] == 0
+
+def test_prediction_cache_ttl_and_lru():
+    cache = PredictionCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    expired = PredictionCache(ttl=-1)
+    expired.put('a', 1)
+    assert expired.get('a') is None
+
+def test_tuning_reports_folds_and_early_stops(tmp_path, monkeypatch):
+    import optuna
+    from ml import trainer
+    monkeypatch.setattr(trainer, "MODELS_DIR", str(tmp_path))
+    storage_url = f"sqlite:///{tmp_path / 'study.db'}"
+
+    df, features = prepare_features(make_matches(n_rounds=30, n_teams=8))
+    X, y = df[features], df['Target']
+    best_value, best_params = trainer.tune_and_save(
+        X, y, 'xgb', n_trials=3, n_jobs=2, n_splits=3, storage_url=storage_url
+    )
+
+    assert best_value > 0
+    assert best_params['n_estimators'] < trainer.XGB_MAX_ESTIMATORS
+    assert (tmp_path / 'xgb_tuned_model.pkl').exists()
+    study = optuna.load_study(study_name="epl_optimization_xgb", storage=storage_url)
+    assert len(study.trials) == 3
+    assert all(len(t.intermediate_values) == 3 for t in study.trials)
+
+def test_xgb_early_stops_on_training_rows_only(monkeypatch):
+    import optuna
+    from ml import trainer
+    df, features = prepare_features(make_matches(n_rounds=30, n_teams=8))
+    folds = trainer.make_folds(df[features], df['Target'], n_splits=3)
+    eval_sets = []
+    build = trainer.build_model
+
+    def spy(model_name, params):
+        model = build(model_name, params)
+        fit = model.fit
+
+        def fit_and_record(X, y, eval_set=None, **kwargs):
+            eval_sets.append(eval_set[0][0])
+            return fit(X, y, eval_set=eval_set, **kwargs)
+        model.fit = fit_and_record
+        return model
+    monkeypatch.setattr(trainer, "build_model", spy)
+
+    trial = optuna.trial.FixedTrial({'max_depth': 3, 'learning_rate': 0.1, 'subsample': 1.0, 'colsample_bytree': 1.0})
+    assert trainer.cv_objective(trial, 'xgb', folds) > 0
+    for (X_tr, _, X_val, _), X_stop in zip(folds, eval_sets):
+        # The held-out rows are the latest training rows, never the scored fold
+        assert np.array_equal(X_stop, X_tr[len(X_tr) - len(X_stop):])
+        assert len(X_stop) == max(1, int(len(X_tr) * trainer.XGB_STOPPING_FRACTION))
+
+def test_registry_versions_promote_and_rollback(trained_engine):
+    registry = trained_engine.registry()
+    first = registry.current()
+    manifest = registry.manifest(first)
+    assert manifest['feature_cols'] == FEATURE_COLS
+    assert manifest['data_snapshot'] == trained_engine.team_state.version
+    assert set(manifest['artifacts']) == {'xgb', 'rf', 'lr'}
+    assert manifest['artifacts']['xgb'].endswith('.ubj')
+
+    probs = trained_engine.predict_proba('Team0', 'Team1')['probs']
+    trained_engine.train()
+    second = registry.current()
+    assert second != first
+    assert registry.versions() == sorted([first, second])
+
+    assert registry.rollback() == first
+    reloaded = MLEngine(model_type="ensemble")
+    assert reloaded.model_version == first
+    assert reloaded.predict_proba('Team0', 'Team1')['probs'] == pytest.approx(probs)
+    with pytest.raises(ValueError):
+        registry.rollback()
+
+def test_registry_prunes_all_but_current_and_previous(trained_engine):
+    registry = trained_engine.registry()
+    first = registry.current()
+    # Partial ensembles, so their content hashes differ from the promoted versions'
+    unpromoted = registry.save("ensemble", {"lr": trained_engine.model["lr"]}, FEATURE_COLS)
+    trained_engine.train()
+    second = registry.current()
+    trained_engine.train()
+    third = registry.current()
+
+    # Pruned on every retrain: the first version and the one never promoted are gone
+    assert registry.versions() == sorted([second, third])
+    assert first not in registry.versions() and unpromoted not in registry.versions()
+    assert registry.rollback() == second
+    with pytest.raises(ValueError):
+        registry.rollback()
+    # A version saved after the current one may be about to be promoted
+    pending = registry.save("ensemble", {"rf": trained_engine.model["rf"]}, FEATURE_COLS)
+    assert registry.prune() == []
+    assert pending in registry.versions()
+
+def test_compiled_model_matches_library_predictions():
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from xgboost import XGBClassifier
+    from ml.fast_inference import CompiledModel
+
+    df, features = prepare_features(make_matches(n_rounds=30, n_teams=8))
+    X, y = df[features], df['Target']
+    xgb_es = XGBClassifier(n_estimators=200, max_depth=4, early_stopping_rounds=5)
+    xgb_es.fit(X[:150], y[:150], eval_set=[(X[150:], y[150:])], verbose=False)
+    models = {
+        "xgb": XGBClassifier(n_estimators=50, max_depth=3).fit(X, y),
+        "rf": RandomForestClassifier(n_estimators=30, max_depth=6, random_state=0).fit(X, y),
+        "lr": LogisticRegression(max_iter=1000).fit(X, y),
+        "xgb_early_stopped": xgb_es
+    }
+
+    for name, model in models.items():
+        compiled = CompiledModel.compile(model, len(features))
+        np.testing.assert_allclose(compiled.predict_proba(X.values), model.predict_proba(X), atol=1e-6, err_msg=name)
+        # Single rows take the 1-D path
+        np.testing.assert_allclose(compiled.predict_proba(X.values[0]), model.predict_proba(X[:1]), atol=1e-6)
+
+    ensemble = {k: models[k] for k in ("xgb", "rf", "lr")}
+    expected = sum(m.predict_proba(X) for m in ensemble.values()) / 3
+    np.testing.assert_allclose(
+        CompiledModel.compile(ensemble, len(features)).predict_proba(X.values), expected, atol=1e-6
+    )
+
+def test_engine_serves_compiled_model(trained_engine):
+    assert trained_engine.compiled is not None
+    fast = trained_engine.predict_proba('Team0', 'Team1')
+    X = np.array([[fast['features'][c] for c in trained_engine.feature_cols]])
+    library = sum(m.predict_proba(pd.DataFrame(X, columns=trained_engine.feature_cols))
+                  for m in trained_engine.model.values()) / 3
+    assert [fast['probs'][k] for k in ('Home', 'Draw', 'Away')] == pytest.approx(library[0].tolist(), abs=1e-6)
+
+def test_matchup_tensor_serves_predictions(trained_engine, monkeypatch):
+    from ml import engine
+    matchups = trained_engine.matchups
+    teams = trained_engine.team_state.teams
+    assert matchups.teams == teams and matchups.probs.shape == (len(teams), len(teams), 3)
+    assert np.allclose(matchups.probs.sum(axis=2), 1)
+
+    # Same numbers as one model call per fixture
+    state = trained_engine.team_state
+    for home_team, away_team in [('Team0', 'Team1'), ('Team3', 'Team2'), ('Team5', 'Team5')]:
+        row = state.features(home_team, away_team)
+        X = np.array([[row[c] for c in trained_engine.feature_cols]])
+        expected = trained_engine._predict_matrix(X)[0]
+        assert matchups.probs[matchups.index[home_team], matchups.index[away_team]] == pytest.approx(expected, abs=1e-6)
+
+    # Requests and season fixtures are array lookups, not model calls
+    monkeypatch.setattr(trained_engine, "_predict_matrix", lambda X: pytest.fail("model called"))
+    result = trained_engine.predict_proba('Team1', 'Team4')
+    assert list(result['probs'].values()) == pytest.approx(matchups.probs[matchups.index['Team1'], matchups.index['Team4']])
+    assert trained_engine.matchup_probs([('Team2', 'Team0')]) == pytest.approx(matchups.probs[[matchups.index['Team2']], [matchups.index['Team0']]])
+    table = trained_engine.matchup_table(['Team2', 'Team0'])
+    assert table['teams'] == ['Team2', 'Team0'] and np.array(table['probs']).shape == (2, 2, 3)
+    with pytest.raises(ValueError):
+        trained_engine.matchup_table(['Unknown'])
+
+    # Saved with the model: a new engine loads it instead of rebuilding
+    monkeypatch.setattr(engine.MLEngine, "build_matchups", lambda self: pytest.fail("rebuilt"))
+    reloaded = engine.MLEngine(model_type="ensemble")
+    assert np.array_equal(reloaded.matchups.probs, matchups.probs)
+
+def test_matchup_tensor_rebuilt_on_refresh(trained_engine, monkeypatch):
+    from ml import engine
+    before = trained_engine.matchups
+    newer = make_matches(n_rounds=32, n_teams=8)
+    monkeypatch.setattr(engine, "fetch_data", lambda: newer.copy())
+    trained_engine.refresh_team_state()
+    assert trained_engine.matchups is not before
+    assert trained_engine.matchups.snapshot_version == trained_engine.team_state.version
+    assert not np.allclose(trained_engine.matchups.probs, before.probs)
+    # Written atomically: the history is complete and no temp file is left behind
+    assert len(pd.read_pickle(engine.HISTORY_PATH)) == len(newer)
+    assert not [f for f in os.listdir(os.path.dirname(engine.HISTORY_PATH)) if f.endswith(".tmp")]
+
+def test_walk_forward_backtest():
+    df = make_matches(n_rounds=52, n_teams=8)  # August to August: two seasons
+    dates = df['Date']
+    bounds = fold_bounds(dates, freq="month", warmup_days=84)
+    assert bounds[0][0] > 0 and bounds[-1][1] == len(df)
+    assert all(prev[1] == nxt[0] for prev, nxt in zip(bounds, bounds[1:]))
+    for start, end in bounds:
+        assert dates[start] >= dates[0] + pd.Timedelta(days=84)
+        assert dates[start:end].dt.to_period("M").nunique() == 1
+    assert len(fold_bounds(dates, freq="matchday", warmup_days=84)) == 52 - 12
+
+    report = backtest(df, model_types=["logreg", "xgb"], warmup_days=84, processes=1)
+    logreg = report["models"]["logreg"]
+    assert logreg["overall"]["n"] == len(df) - bounds[0][0]
+    assert 0 < logreg["overall"]["log_loss"] < 2 and 0 <= logreg["overall"]["accuracy"] <= 1
+    assert 0 <= logreg["overall"]["brier"] <= 2 and 0 <= logreg["overall"]["ece"] <= 1
+    assert sum(row["n"] for row in logreg["calibration"]) == 3 * logreg["overall"]["n"]
+    assert list(logreg["seasons"]) == ["2023/24", "2024/25"]
+    assert len(report["folds"]) == 2 * len(bounds)
+
+    # Folds run in worker processes give the same predictions
+    parallel = backtest(df, model_types=["logreg"], warmup_days=84, processes=2)
+    assert parallel["config"]["processes"] == 2
+    assert parallel["models"]["logreg"]["overall"] == pytest.approx(logreg["overall"])
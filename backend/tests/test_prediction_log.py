@@ -0,0 +1,59 @@
+import threading
+import time
+from app import database, models
+from app.prediction_log import PredictionLogger
+
+models.Base.metadata.create_all(bind=database.engine)
+
+RESULT = {"probs": {"Home": 0.5, "Draw": 0.3, "Away": 0.2}, "features": {"Elo_Home": 1500.0}}
+
+def logged_rows(user_id):
+    db = database.SessionLocal()
+    rows = db.query(models.Prediction).filter(models.Prediction.user_id == user_id).all()
+    db.close()
+    return rows
+
+def test_writer_batches_rows_from_many_threads(monkeypatch):
+    logger = PredictionLogger(maxsize=100, batch_size=50, flush_interval=0.01)
+    batches = []
+    write = logger._write
+    monkeypatch.setattr(logger, "_write", lambda rows: (batches.append(len(rows)), write(rows)))
+    logger.start()
+
+    def worker():
+        for _ in range(100):
+            logger.log(301, [("Arsenal", "Chelsea", RESULT)])
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    logger.flush()
+    assert len(logged_rows(301)) == 400
+    assert logger.pending() == 0
+
+    logger.log(301, [("Arsenal", "Chelsea", RESULT), ("Leeds", "Everton", RESULT)])
+    logger.stop()  # queued rows are written on shutdown
+    rows = logged_rows(301)
+    assert len(rows) == 402
+    assert rows[-1].probs_json == RESULT["probs"] and rows[-1].created_at is not None
+    assert sum(batches) == 402 and max(batches) <= 50
+
+def test_full_queue_applies_backpressure_then_writes_inline():
+    logger = PredictionLogger(maxsize=2, put_timeout=0.2)  # writer not started
+    start = time.perf_counter()
+    logger.log(302, [("Arsenal", "Chelsea", RESULT)] * 5)
+    # Waits for room once, not once per overflowing row
+    assert time.perf_counter() - start < 0.5
+    assert logger.pending() == 2
+    assert len(logged_rows(302)) == 3
+    logger.stop()
+    assert len(logged_rows(302)) == 5
+
+def test_failed_background_writes_are_logged(monkeypatch, caplog):
+    logger = PredictionLogger(maxsize=10)
+    monkeypatch.setattr(logger, "_write", lambda rows: 1 / 0)
+    logger.log(303, [("Arsenal", "Chelsea", RESULT)] * 2)
+    logger.stop()
+    assert "Failed to log 2 predictions" in caplog.text
+    assert logger.pending() == 0
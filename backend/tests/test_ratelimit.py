@@ -0,0 +1,94 @@
+import threading
+from sqlalchemy import create_engine, inspect, text
+from app import database, models
+from app.ratelimit import MemoryCounterStore, RateLimiter, SQLiteCounterStore, ensure_unique_index
+
+models.Base.metadata.create_all(bind=database.engine)
+
+def hammer(limiter, user_id, n_threads=8, hits=100, limit=500):
+    allowed = []
+    def worker():
+        allowed.append(sum(limiter.hit(user_id, limit=limit, day="2024-01-01") for _ in range(hits)))
+    threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(allowed)
+
+def test_counters_are_atomic_across_threads(tmp_path):
+    assert hammer(RateLimiter(MemoryCounterStore()), 101) == 500
+    assert hammer(RateLimiter(SQLiteCounterStore(str(tmp_path / "counters.sqlite"))), 102) == 500
+
+def test_flushed_counts_survive_restart():
+    limiter = RateLimiter(MemoryCounterStore())
+    assert limiter.hit(201, cost=20, limit=30, day="2024-01-02")
+    limiter.flush()
+    assert limiter.hit(201, cost=5, limit=30, day="2024-01-02")
+    limiter.flush()  # updates the same row
+
+    restarted = RateLimiter(MemoryCounterStore())
+    assert restarted.count(201, day="2024-01-02") == 25
+    assert not restarted.hit(201, cost=6, limit=30, day="2024-01-02")
+    assert restarted.hit(201, cost=5, limit=30, day="2024-01-02")
+
+    db = database.SessionLocal()
+    rows = db.query(models.RateLimit).filter(models.RateLimit.user_id == 201).all()
+    db.close()
+    assert [(r.date, r.requests_count) for r in rows] == [("2024-01-02", 25)]
+
+def test_workers_share_counters_through_sqlite_store(tmp_path):
+    path = str(tmp_path / "shared.sqlite")
+    worker_a, worker_b = RateLimiter(SQLiteCounterStore(path)), RateLimiter(SQLiteCounterStore(path))
+    assert worker_a.hit(301, cost=20, limit=30, day="2024-01-03")
+    assert not worker_b.hit(301, cost=20, limit=30, day="2024-01-03")
+    assert worker_b.hit(301, cost=10, limit=30, day="2024-01-03")
+    worker_b.flush()
+    worker_a.flush()  # older view of the same key never lowers the stored count
+    assert RateLimiter(MemoryCounterStore()).count(301, day="2024-01-03") == 30
+
+def test_several_app_workers_default_to_the_shared_store(tmp_path, monkeypatch):
+    from app import ratelimit
+    monkeypatch.setattr(ratelimit.settings, "RATE_LIMIT_STORE", str(tmp_path / "counters.sqlite"))
+    monkeypatch.setattr(ratelimit.settings, "RATE_LIMIT_BACKEND", "auto")
+    monkeypatch.setattr(ratelimit.settings, "WEB_CONCURRENCY", 1)
+    assert isinstance(ratelimit.create_limiter().store, MemoryCounterStore)
+    monkeypatch.setattr(ratelimit.settings, "WEB_CONCURRENCY", 4)
+    assert isinstance(ratelimit.create_limiter().store, SQLiteCounterStore)
+
+def test_unique_index_added_to_existing_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE rate_limits (id INTEGER PRIMARY KEY, user_id INTEGER, date VARCHAR, requests_count INTEGER)"
+        ))
+        conn.execute(text("INSERT INTO rate_limits (user_id, date, requests_count) VALUES "
+                          "(1, '2024-01-01', 3), (1, '2024-01-01', 7), (2, '2024-01-01', 1)"))
+
+    ensure_unique_index(engine)
+    ensure_unique_index(engine)  # idempotent
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT user_id, requests_count FROM rate_limits ORDER BY user_id")).fetchall()
+    assert [tuple(r) for r in rows] == [(1, 7), (2, 1)]
+    assert any(ix["unique"] for ix in inspect(engine).get_indexes("rate_limits"))
+
+def test_unique_index_tolerates_a_concurrent_worker(tmp_path, monkeypatch):
+    from app import ratelimit
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE rate_limits (id INTEGER PRIMARY KEY, user_id INTEGER, date VARCHAR, requests_count INTEGER)"
+        ))
+    stale = inspect(engine).get_indexes("rate_limits")
+
+    class StaleInspector:
+        # What this worker saw before another worker added the index
+        def get_indexes(self, name):
+            return stale
+
+    ensure_unique_index(engine)  # the other worker
+    monkeypatch.setattr(ratelimit, "inspect", lambda bind: StaleInspector())
+    ensure_unique_index(engine)
+
+    assert any(ix["unique"] for ix in inspect(engine).get_indexes("rate_limits"))
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import pandas as pd
+from app import utils
+
+class StubEngine:
+    # Home side always wins, except Team0 who never loses
+    def predict_many(self, pairs, explain=False):
+        return [self.predict(home_team, away_team) for home_team, away_team in pairs]
+
+    def matchup_probs(self, pairs):
+        return np.array([[r['probs'][o] for o in utils.OUTCOMES] for r in self.predict_many(pairs)])
+
+    def predict(self, home_team, away_team):
+        if away_team == 'Team0':
+            return {'probs': {'Home': 0.0, 'Draw': 0.5, 'Away': 0.5}}
+        return {'probs': {'Home': 1.0, 'Draw': 0.0, 'Away': 0.0}}
+
+def season_frame():
+    rows = [
+        ('2023-08-12', 'Team0', 'Team1', 2, 0, 'H'),
+        ('2023-08-12', 'Team2', 'Team3', 1, 1, 'D'),
+        ('2023-08-19', 'Team1', 'Team2', 0, 3, 'A'),
+    ]
+    df = pd.DataFrame(rows, columns=['Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'FTR'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['raw_source'] = '2324_E0.csv'
+    old = df.assign(Date=df['Date'] - pd.Timedelta(days=365), raw_source='2223_E0.csv', HomeTeam='Relegated')
+    return pd.concat([old, df], ignore_index=True)
+
+def test_simulate_season_position_distributions(monkeypatch):
+    monkeypatch.setattr(utils, "fetch_data", season_frame)
+    results = utils.simulate_season(StubEngine(), rounds=2000, seed=1)
+
+    by_team = {r['Team']: r for r in results}
+    assert set(by_team) == {'Team0', 'Team1', 'Team2', 'Team3'}
+    assert by_team['Team0']['Current_Pts'] == 3
+    assert by_team['Team0']['Remaining_Fixtures'] == 5
+    assert by_team['Team1']['Remaining_Fixtures'] == 4
+
+    # Every position is filled exactly once per round
+    position_probs = np.array([r['Position_Probs'] for r in results])
+    assert np.allclose(position_probs.sum(axis=0), 1)
+    assert np.allclose(position_probs.sum(axis=1), 1)
+    assert sum(r['Title_Odds'] for r in results) == 1
+
+    # Team0 wins every home game and never loses away, so nobody can catch them
+    assert by_team['Team0']['Title_Odds'] == 1
+    assert results[0]['Team'] == 'Team0'
+
+def test_simulate_standings_matches_exact_distribution():
+    # Two teams, one fixture each way: enumerate the 9 outcome pairs
+    probs = np.array([[0.5, 0.3, 0.2], [0.25, 0.25, 0.5]])
+    home_idx, away_idx = np.array([1, 0]), np.array([0, 1])
+    baseline = np.array([0, 1])
+    expected_first = 0.0
+    for o0 in range(3):
+        for o1 in range(3):
+            points = baseline.copy()
+            points[[1, 0]] += utils.HOME_POINTS[[o0, o1]]
+            points[[0, 1]] += utils.AWAY_POINTS[[o0, o1]]
+            # Team 0 wins ties on points
+            expected_first += probs[0, o0] * probs[1, o1] * (points[0] >= points[1])
+
+    rounds = 200_000
+    counts = utils.simulate_standings(baseline, home_idx, away_idx, probs, rounds, np.random.default_rng(0))
+    assert counts.sum() == 2 * rounds
+    assert counts[0, 0] / rounds == pytest.approx(expected_first, abs=0.005)
+
+def test_simulate_match_and_scorelines_are_vectorised():
+    rng = np.random.default_rng(0)
+    probs = np.array([0.5, 0.3, 0.2])
+    sim = utils.simulate_match(probs, 1_000_000, rng)
+    assert sum(sim.values()) == pytest.approx(1)
+    assert abs(sim['Home'] - 0.5) < 0.01
+
+    features = {'Home_Form_GF': 2.0, 'Away_Form_GA': 1.0, 'Away_Form_GF': 1.0, 'Home_Form_GA': 0.8}
+    result = utils.simulate_scorelines(features, 200_000, rng)
+    assert result['expected_goals'] == {'Home': 1.5, 'Away': 0.9}
+    assert sum(result['outcome_probs'].values()) == pytest.approx(1)
+    assert result['outcome_probs']['Home'] > result['outcome_probs']['Away']
+    assert len(result['scorelines']) == 10
+    probs_desc = [s['prob'] for s in result['scorelines']]
+    assert probs_desc == sorted(probs_desc, reverse=True)
@@ -21,16 +21,22 @@ const AdminPanel = ({ isAdmin, token }) => {
     setError('');
     setLoading(true);
     try {
-      const response = await axios.post('/admin/retrain', null, {
-        headers: {
-          Authorization: `Bearer ${token}`,
-        },
-        timeout: 600000, // 10 minutes timeout for long training process
-      });
-      setRetrainStatus(`Training Complete! ${response.data.message}`);
+      const headers = { Authorization: `Bearer ${token}` };
+      const response = await axios.post('/admin/retrain', null, { headers });
+
+      // Training runs in the background; poll the job until it finishes
+      let job = { status: 'running' };
+      while (job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 3000));
+        job = (await axios.get(response.data.status_url, { headers })).data;
+      }
+      if (job.status !== 'succeeded') {
+        throw new Error('Retraining failed. Check backend logs.');
+      }
+      setRetrainStatus('Training Complete! New model is live.');
     } catch (err) {
       console.error(err);
-      setError(err.response?.data?.detail || 'Retraining failed. Check backend logs.');
+      setError(err.response?.data?.detail || err.message || 'Retraining failed. Check backend logs.');
       setRetrainStatus('Failed');
     } finally {
       setLoading(false);
@@ -21,7 +21,7 @@ export default function Predictor({ token }) {
     setResult(null);
     setLoading(true);
     try {
-      const res = await axios.post('/predict',
+      const res = await axios.post('/predict?explain=true',
         { home_team: home, away_team: away },
         { headers: { Authorization: `Bearer ${token}` } }
       );
@@ -133,7 +133,7 @@ export default function Predictor({ token }) {
           <div className="glass-card p-6">
             <h2 className="text-2xl font-display font-bold mb-6 text-white border-b border-white/10 pb-2">AI Analysis</h2>
             <div className="bg-white/5 rounded-lg p-2 border border-white/10">
-              <img src={`http://localhost:8000${result.shap_url}`} alt="SHAP Plot" className="w-full rounded opacity-90 hover:opacity-100 transition-opacity" />
+              {result.shap_url && <img src={`http://localhost:8000${result.shap_url}`} alt="SHAP Plot" className="w-full rounded opacity-90 hover:opacity-100 transition-opacity" />}
             </div>
             <p className="mt-4 text-sm text-dark-muted text-center">
               Feature importance showing key factors influencing the prediction.